@@ -0,0 +1,113 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Compare the codecs of the JSON columns.
+
+Usage::
+
+    python benchmarks/bench_json_codec.py [--rows N]
+
+"""
+
+import argparse
+import time
+import timeit
+import uuid
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from numinadb.model import Base, DataProcessingTask, ObservingBlock, defer_json
+from numinadb.jsonsqlite import create_codec, set_codec
+
+
+def make_request():
+    return {
+        "id": str(uuid.uuid4()),
+        "pipeline": "default",
+        "mode_override": None
+    }
+
+
+def make_result(nframes=200):
+    """A result similar to the contents of result.json of a composite OB"""
+    taskdir = "task_012_{}".format(uuid.uuid4())
+    return {
+        "logs": taskdir + "/results/processing.log",
+        "task": taskdir + "/results/task.json",
+        "result": taskdir + "/results/result.json",
+        "values": {
+            "master_fiberflat": "master_fiberflat.fits",
+            "master_traces": "master_traces.json",
+            "qc": "GOOD"
+        },
+        "frames": ["0003{:05d}-{}.fits".format(i, uuid.uuid4()) for i in range(nframes)],
+        "stats": [{"mean": 1023.5 + i, "std": 12.25, "npix": 4112 * 4096} for i in range(nframes)]
+    }
+
+
+def available_codecs():
+    codecs = []
+    for name in ['json', 'orjson']:
+        try:
+            codecs.append(create_codec(name))
+        except ImportError:
+            print('codec', name, 'not available')
+    return codecs
+
+
+def bench_codecs(number):
+    payloads = [('request', make_request()), ('result', make_result())]
+    print('{:10s} {:10s} {:>12s} {:>12s}'.format('codec', 'payload', 'dumps (us)', 'loads (us)'))
+    for codec in available_codecs():
+        for label, payload in payloads:
+            encoded = codec.dumps(payload)
+            tdump = timeit.timeit(lambda: codec.dumps(payload), number=number) / number
+            tload = timeit.timeit(lambda: codec.loads(encoded), number=number) / number
+            print('{:10s} {:10s} {:12.2f} {:12.2f}'.format(codec.name, label, 1e6 * tdump, 1e6 * tload))
+
+
+def bench_scan(nrows):
+    print('scan of {} rows of dp_task'.format(nrows))
+    print('{:10s} {:10s} {:>10s}'.format('codec', 'columns', 'time (ms)'))
+    for codec in available_codecs():
+        set_codec(codec.name)
+        engine = create_engine("sqlite:///:memory:", echo=False)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as session:
+            ob = ObservingBlock(id='1', instrument_id='MEGARA', mode='MegaraFiberFlatImage')
+            session.add(ob)
+            for _ in range(nrows):
+                task = DataProcessingTask(ob=ob, state=2, request=make_request(), result=make_result())
+                session.add(task)
+            session.commit()
+
+            for label, options in [('loaded', []), ('deferred', defer_json(DataProcessingTask))]:
+                session.expunge_all()
+                t0 = time.perf_counter()
+                states = [task.state for task in session.query(DataProcessingTask).options(*options)]
+                t1 = time.perf_counter()
+                assert len(states) == nrows
+                print('{:10s} {:10s} {:10.2f}'.format(codec.name, label, 1e3 * (t1 - t0)))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Compare the codecs of the JSON columns')
+    parser.add_argument('--number', type=int, default=1000, help='repetitions of each encoding')
+    parser.add_argument('--rows', type=int, default=2000, help='rows in dp_task')
+    args = parser.parse_args(args)
+
+    bench_codecs(args.number)
+    print()
+    bench_scan(args.rows)
+
+
+if __name__ == '__main__':
+    main()
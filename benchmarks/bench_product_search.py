@@ -0,0 +1,115 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Compare the product search with and without the instrument and pipeline filters.
+
+A synthetic database has products of several instruments and pipelines,
+with the same datatype names. The product requested is the one with the
+lowest priority, so that the search scans all the candidates.
+
+Usage::
+
+    python benchmarks/bench_product_search.py [--products N]
+
+"""
+
+import argparse
+import datetime
+import time
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from numina.dal.utils import tags_are_valid
+from numina.types.frame import DataFrameType
+from numina.types.product import DataProductMixin
+
+from numinadb.model import Base, DataProduct, ProductFact
+from numinadb.dal import SqliteDAL
+
+
+INSTRUMENTS = ['MEGARA', 'EMIR', 'FRIDA', 'TARSIS', 'MIRADAS']
+PIPELINES = ['default', 'test']
+VPHS = ['LR-U', 'LR-B', 'LR-V', 'LR-R', 'LR-I', 'LR-Z', 'MR-U', 'MR-G', 'HR-R', 'HR-I']
+
+
+class MasterFiberFlat(DataProductMixin, DataFrameType):
+    pass
+
+
+def create_products(session, nproducts):
+    """Products of each instrument and pipeline, with a vph tag"""
+    start = datetime.datetime(2020, 1, 1)
+    for instrument in INSTRUMENTS:
+        for pipeline in PIPELINES:
+            for idx in range(nproducts):
+                prod = DataProduct(instrument_id=instrument, datatype='MasterFiberFlat', task_id=None,
+                                   contents='{}/{}/flat_{}.fits'.format(instrument, pipeline, idx),
+                                   priority=nproducts - idx, pipeline=pipeline)
+                prod.dateobs = start + datetime.timedelta(days=idx)
+                prod.facts = {'vph': ProductFact(key='vph', value=VPHS[idx % len(VPHS)])}
+                session.add(prod)
+    session.commit()
+
+
+def search_unfiltered(session, label, tags):
+    """The search before the filters, by datatype only"""
+    res = session.query(DataProduct).filter(DataProduct.datatype == label).order_by(DataProduct.priority.desc())
+    for prod in res:
+        pt = {val.key: val.value for val in prod.facts.values()}
+        if tags_are_valid(pt, tags):
+            return prod
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Compare the product search with and without filters')
+    parser.add_argument('--products', type=int, default=2000, help='products per instrument and pipeline')
+    parser.add_argument('--number', type=int, default=5, help='repetitions of each search')
+    args = parser.parse_args(args)
+
+    engine = create_engine("sqlite:///:memory:", echo=False)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        create_products(session, args.products)
+        dal = SqliteDAL('bench', session, basedir='.', datadir='.', drps={})
+        tipo = MasterFiberFlat()
+        label = tipo.name()
+        # only the product with the lowest priority has this tag
+        last = session.scalars(
+            select(DataProduct).where(DataProduct.instrument_id == 'MEGARA', DataProduct.pipeline == 'default')
+            .order_by(DataProduct.priority).limit(1)
+        ).one()
+        last.facts['vph'].value = 'HR-Z'
+        last_id = last.id
+        session.commit()
+        tags = {'vph': 'HR-Z'}
+
+        total = session.scalar(select(func.count()).where(DataProduct.datatype == label))
+        candidates = session.scalar(select(func.count()).where(
+            DataProduct.datatype == label, DataProduct.instrument_id == 'MEGARA', DataProduct.pipeline == 'default'
+        ))
+        print('{} products, {} candidates with the filters'.format(total, candidates))
+
+        print('{:12s} {:>10s} {:>10s}'.format('search', 'scanned', 'time (ms)'))
+        for name, search in [
+            ('unfiltered', lambda: search_unfiltered(session, label, tags).id),
+            ('filtered', lambda: dal.search_prod_type_tags(tipo, 'MEGARA', tags, 'default').id),
+        ]:
+            scanned = total if name == 'unfiltered' else candidates
+            t0 = time.perf_counter()
+            for _ in range(args.number):
+                session.expunge_all()
+                found = search()
+            t1 = time.perf_counter()
+            assert found == last_id
+            print('{:12s} {:10d} {:10.2f}'.format(name, scanned, 1e3 * (t1 - t0) / args.number))
+
+
+if __name__ == '__main__':
+    main()
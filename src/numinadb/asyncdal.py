@@ -0,0 +1,109 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Asynchronous lookups in the database.
+
+Requires the asyncio extension of SQLAlchemy and an async driver,
+such as aiosqlite or asyncpg (``pip install numinadb[async]``).
+"""
+
+import asyncio
+import copy
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from numina.dal.stored import StoredProduct
+from numina.store import load
+
+from .dal import SqliteDAL
+
+
+# Async drivers used by default for each backend
+_async_drivers = {
+    'sqlite': 'aiosqlite',
+    'postgresql': 'asyncpg',
+}
+
+
+def async_uri(uri):
+    """Select an async driver in uri, if it has no driver"""
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if url.drivername == backend and backend in _async_drivers:
+        url = url.set(drivername='{}+{}'.format(backend, _async_drivers[backend]))
+    return url
+
+
+def create_async_sessionmaker(uri, **kwargs):
+    """Create a factory of AsyncSession for the database in uri"""
+    engine = create_async_engine(async_uri(uri), **kwargs)
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+def _load_oblock(obsres):
+    # the object is used after its session is closed,
+    # load the relationships used by recipes and taggers
+    obsres.frames
+    obsres.children
+    obsres.facts
+    return obsres
+
+
+class AsyncSqliteDAL(object):
+    """Asynchronous counterpart of SqliteDAL.
+
+    Each lookup runs in its own AsyncSession, created by `sessionmaker`,
+    so that many lookups can be awaited concurrently. The queries are
+    those of SqliteDAL, run through AsyncSession.run_sync, and the results
+    are the same. Observing blocks are returned detached from the session,
+    with their frames, children and facts loaded. Products are loaded
+    from their files in a thread, not in the event loop.
+    """
+
+    def __init__(self, dialect, sessionmaker, basedir, datadir, drps=None, product_ranking=None):
+        self.sessionmaker = sessionmaker
+        self._dal = SqliteDAL(dialect, None, basedir, datadir, drps=drps, product_ranking=product_ranking)
+
+    @property
+    def extra_data(self):
+        return self._dal.extra_data
+
+    def _run(self, session, method, args, kwargs):
+        dal = copy.copy(self._dal)
+        dal.session = dal.lookup_session = session
+        try:
+            return getattr(dal, method)(*args, **kwargs)
+        finally:
+            # checked once, see SqliteDAL.parameter_index_ready
+            self._dal._parameter_index = dal._parameter_index
+
+    async def _call(self, method, *args, **kwargs):
+        async with self.sessionmaker() as session:
+            return await session.run_sync(self._run, method, args, kwargs)
+
+    def _run_oblock(self, session, method, args, kwargs):
+        return _load_oblock(self._run(session, method, args, kwargs))
+
+    async def _call_oblock(self, method, *args, **kwargs):
+        async with self.sessionmaker() as session:
+            return await session.run_sync(self._run_oblock, method, args, kwargs)
+
+    async def search_oblock_from_id(self, obsref):
+        return await self._call_oblock('search_oblock_from_id', obsref)
+
+    async def obsres_from_oblock_id(self, obsid, override_mode=None):
+        return await self._call_oblock('obsres_from_oblock_id', obsid, override_mode=override_mode)
+
+    async def search_product(self, name, tipo, obsres, options=None):
+        prod_id, path, tags = await self._call('locate_product', name, tipo, obsres)
+        content = await asyncio.to_thread(load, tipo, path)
+        return StoredProduct(id=prod_id, content=content, tags=tags)
+
+    async def search_parameter(self, name, tipo, obsres, options=None):
+        return await self._call('search_parameter', name, tipo, obsres, options=options)
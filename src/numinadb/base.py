@@ -9,6 +9,24 @@
 """Base class for database support"""
 
 
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
+
+
+def create_db_engine(uri, pool_size=None, echo=False):
+    """Create an engine for the database in uri.
+
+    Server databases, such as PostgreSQL, use a pool of `pool_size`
+    connections, checked before use.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        return create_engine(url, echo=echo)
+
+    kwargs = dict(pool_pre_ping=True)
+    if pool_size is not None:
+        kwargs['pool_size'] = pool_size
+    return create_engine(url, echo=echo, **kwargs)
@@ -0,0 +1,62 @@
+
+from sqlalchemy.orm import sessionmaker
+
+from ..base import create_db_engine
+from ..dal import SqliteDAL, RANK_TIME
+from ..jsonsqlite import set_codec
+from ..profiler import enable_profiling, get_profiler
+from ..schema import check_schema, SchemaError
+from ..snapshot import open_snapshot
+
+
+# DAL methods profiled as a single call each
+profiled_dal_calls = [
+    'search_oblock_from_id',
+    'obsres_from_oblock_id',
+    'search_recipe_from_ob',
+    'search_parameter',
+    'search_param_type_tags',
+    'search_product',
+    'search_prod_type_tags',
+    'search_result_relative'
+]
+
+
+def create_session(args):
+    """Create a session with the database of the command line"""
+
+    if getattr(args, 'json_codec', None) is not None:
+        set_codec(args.json_codec)
+    engine = create_db_engine(args.db_uri, pool_size=getattr(args, 'pool_size', None))
+    try:
+        check_schema(engine)
+    except SchemaError as error:
+        raise SystemExit('error: {}'.format(error))
+    if getattr(args, 'profile_sql', False):
+        enable_profiling(engine)
+    Session = sessionmaker(bind=engine)
+    return Session()
+
+
+def profile_dal(dal):
+    """Profile the calls of the DAL, if profiling is enabled"""
+    profiler = get_profiler()
+    if profiler is not None:
+        profiler.wrap(dal, profiled_dal_calls)
+    return dal
+
+
+def product_ranking(args):
+    """Ranking of the products of each datatype, from the command line"""
+    return {datatype: RANK_TIME for datatype in getattr(args, 'nearest_in_time', None) or []}
+
+
+def create_dal(dialect, session, basedir, datadir, snapshot=None, product_ranking=None, drps=None):
+    """Create the DAL, searching inputs in the snapshot if given"""
+    if snapshot is None:
+        lookup_session = None
+    else:
+        lookup_session = open_snapshot(snapshot)()
+    dal = SqliteDAL(dialect, session, basedir=basedir, datadir=datadir, lookup_session=lookup_session,
+                    product_ranking=product_ranking, drps=drps)
+    return profile_dal(dal)
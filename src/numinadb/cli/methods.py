@@ -5,6 +5,8 @@ from numina.user.helpers import WorkEnvironment
 from numina.user.baserun import run_recipe_timed
 
 from ..helpers import ProcessingTask
+from ..memo import recipe_input_key, find_reusable_result, link_result
+from ..timing import TaskTimer
 
 _logger = logging.getLogger(__name__)
 
@@ -26,20 +28,35 @@ def reductionOB(**kwargs):
     obid = request['id']
     pipe_name = request.get('pipe_name', 'default')
     mode_name = request.get('mode_override')
+    timer = kwargs.get('timer')
+    reuse = request.get('reuse', True)
+    store_options = dict(
+        store_workers=request.get('store_workers'),
+        compress_fits=request.get('compress_fits', False),
+        compact_json=request.get('compact_json', False),
+        gzip_json=request.get('gzip_json', False)
+    )
 
     return reductionOB_request(dal, taskid, obid,
                                mode_name=mode_name,
-                               pipe_name=pipe_name
+                               pipe_name=pipe_name,
+                               timer=timer,
+                               store_options=store_options,
+                               reuse=reuse
                                )
 
 
-def reductionOB_request(dal, taskid, obid, mode_name=None, pipe_name='default'):
+def reductionOB_request(dal, taskid, obid, mode_name=None, pipe_name='default', timer=None,
+                        store_options=None, reuse=True):
 
     session = dal.session
     datadir = dal.datadir
     basedir = dal.basedir
 
-    with working_directory(datadir):
+    if timer is None:
+        timer = TaskTimer()
+
+    with working_directory(datadir), timer.span('dal'):
         obsres = dal.obsres_from_oblock_id(obid,
                                            override_mode=mode_name
                                            )
@@ -47,7 +64,8 @@ def reductionOB_request(dal, taskid, obid, mode_name=None, pipe_name='default'):
     workenv = WorkEnvironment(basedir, datadir, taskid, obid)
 
     with working_directory(workenv.datadir):
-        recipe = dal.search_recipe_from_ob(obsres)
+        with timer.span('dal'):
+            recipe = dal.search_recipe_from_ob(obsres)
 
         # Enable intermediate results by default
         _logger.debug('enable intermediate results')
@@ -66,7 +84,8 @@ def reductionOB_request(dal, taskid, obid, mode_name=None, pipe_name='default'):
         try:
             # uhmmm
             obsres.taskid = taskid
-            rinput = recipe.build_recipe_input(obsres, dal)
+            with timer.span('build_recipe_input'), dal.recording_inputs() as resolved:
+                rinput = recipe.build_recipe_input(obsres, dal)
         except ValueError as err:
             _logger.error("during recipe input construction")
             for msg in err.args[0]:
@@ -85,6 +104,17 @@ def reductionOB_request(dal, taskid, obid, mode_name=None, pipe_name='default'):
         for req in recipe.products().values():
             _logger.info('recipe provides %s, %s', req.type, req.description)
 
+    input_key = recipe_input_key(obsres, recipe, resolved)
+    _logger.debug('recipe input key is %s', input_key)
+    if reuse:
+        previous = find_reusable_result(session, input_key)
+        if previous is not None:
+            print('inputs unchanged, reusing the result of task', previous.task_id)
+            link_result(session, previous, taskid, obsres.id)
+            result = dict(previous.task.result or {})
+            result['reused'] = previous.task_id
+            return result
+
     # Logging and task control
     logger_control = dict(
         logfile='processing.log',
@@ -105,15 +135,20 @@ def reductionOB_request(dal, taskid, obid, mode_name=None, pipe_name='default'):
         'runner_version': runner_version,
         'instrument_configuration': None
     }
+    if store_options:
+        runinfo.update(store_options)
+    runinfo['input_key'] = input_key
 
-    task = ProcessingTask(session, obsres, runinfo)
+    task = ProcessingTask(session, obsres, runinfo, timer=timer)
 
     # Copy files
     if True:
         _logger.debug('copy files to work directory')
         workenv.sane_work()
-        workenv.copyfiles_stage1(obsres)
-        workenv.copyfiles_stage2(rinput)
+        with timer.span('copyfiles_stage1'):
+            workenv.copyfiles_stage1(obsres)
+        with timer.span('copyfiles_stage2'):
+            workenv.copyfiles_stage2(rinput)
         workenv.adapt_obsres(obsres)
     # link files
     else:
@@ -123,14 +158,19 @@ def reductionOB_request(dal, taskid, obid, mode_name=None, pipe_name='default'):
         workenv.copyfiles_stage2(rinput)
         workenv.adapt_obsres(obsres)
 
-    completed_task = run_recipe_timed(recipe=recipe, task=task, rinput=rinput,
-                                      workenv=workenv, task_control=task_control)
+    with timer.span('run_recipe'):
+        completed_task = run_recipe_timed(recipe=recipe, task=task, rinput=rinput,
+                                          workenv=workenv, task_control=task_control)
 
     where = DiskStorageDefault(resultsdir=workenv.resultsdir)
     where.task = 'task.json'
     where.result = 'result.json'
+    if runinfo.get('gzip_json'):
+        where.task += '.gz'
+        where.result += '.gz'
 
-    result = where.store(completed_task)
+    with timer.span('store'):
+        result = where.store(completed_task)
     return result
 
 
@@ -1,15 +1,11 @@
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
 from ..control import mode_alias_add, mode_alias_del, mode_alias_list
+from .common import create_session
 
 
 def mode_alias(args, extra_args, config):
 
-    engine = create_engine(args.db_uri, echo=False)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    session = create_session(args)
 
     if args.action == 'add':
         mode_alias_add(session, args.aliasname, args.uuid, force=args.force)
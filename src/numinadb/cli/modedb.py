@@ -1,7 +1,11 @@
 
-from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
 
-from ..base import Base
+from ..base import Base, create_db_engine
+from ..model import RecipeParameters
+from ..paramindex import rebuild_parameter_index
+from ..schema import upgrade_schema
+from ..snapshot import export_snapshot
 
 
 def mode_db(args, extra_args, config):
@@ -10,7 +14,21 @@ def mode_db(args, extra_args, config):
         print(f"Create new database in {args.initdb}")
         create_db(uri=args.initdb)
 
+    if args.export_snapshot is not None:
+        engine = create_db_engine(args.db_uri)
+        nrows = export_snapshot(engine, args.export_snapshot)
+        print(f"Snapshot with {nrows} rows written in {args.export_snapshot}")
+
 
 def create_db(uri):
-    engine = create_engine(uri, echo=False)
+    engine = create_db_engine(uri)
     Base.metadata.create_all(bind=engine)
+    # columns and indexes added to tables of an existing database
+    for ddl in upgrade_schema(engine):
+        print(ddl)
+
+    # the parameter index of databases created before it
+    with Session(engine) as session:
+        instruments = [row[0] for row in session.query(RecipeParameters.instrument_id).distinct()]
+        rebuild_parameter_index(session, instruments)
+        session.commit()
@@ -0,0 +1,38 @@
+import itertools
+
+from ..query import find_obs, find_frames
+from .common import create_session
+
+
+def _format_time(value):
+    return '-' if value is None else value.isoformat(timespec='seconds')
+
+
+def mode_find(args, extra_args, config):
+
+    session = create_session(args)
+
+    criteria = dict(
+        instrument=args.instrument, mode=args.mode, object=args.object,
+        start=args.start, end=args.end, page_size=args.page_size
+    )
+    if args.frames:
+        rows = find_frames(session, **criteria)
+        fmt = '{:8d} {:19s} {:19s} {:20s} {}'
+        lines = (
+            fmt.format(row.id, _format_time(row.start_time), _format_time(row.completion_time),
+                       row.object or '-', row.name)
+            for row in rows
+        )
+    else:
+        rows = find_obs(session, **criteria)
+        fmt = '{:36s} {:19s} {:19s} {:10s} {:30s} {}'
+        lines = (
+            fmt.format(row.id, _format_time(row.start_time), _format_time(row.completion_time),
+                       row.instrument_id, row.mode, row.object or '-')
+            for row in rows
+        )
+
+    # rows are printed as the pages are read
+    for line in itertools.islice(lines, args.limit):
+        print(line)
@@ -1,22 +1,53 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import logging
 
+from ..event import event_stats
 from ..ingest import ingest_ob_file, ingest_dir, ingest_control_file
+from ..profiler import sql_scope
+from ..watch import create_watcher, watch_dir
+from .common import create_session
+
+
+_logger = logging.getLogger(__name__)
+
+
+def log_event_stats():
+    for name, stats in event_stats().items():
+        for handler in stats:
+            _logger.debug('event %s, handler %s: %d calls, %d errors, %.3f s total, %.3f s max',
+                          name, handler.name, handler.calls, handler.errors, handler.total, handler.max)
 
 
 def mode_ingest(args, extra_args, config):
 
-    engine = create_engine(args.db_uri, echo=False)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    session = create_session(args)
 
     if args.control_file:
-        ingest_control_file(session, args.path)
+        with sql_scope('ingest_control_file'):
+            ingest_control_file(session, args.path)
         return
 
     if args.ob_file:
-        ingest_ob_file(session, args.path)
+        with sql_scope('ingest_ob_file'):
+            ingest_ob_file(session, args.path)
         return
     else:
-        ingest_dir(session, args.path)
+        if args.watch:
+            return watch(session, args)
+        with sql_scope('ingest_dir'):
+            ingest_dir(session, args.path, two_phase=args.two_phase, workers=args.workers)
+        log_event_stats()
         return
+
+
+def watch(session, args):
+    """Ingest the directory, then the files written in it"""
+    # watch before the first pass, to miss no file written meanwhile
+    watcher = create_watcher(args.path, polling=args.poll)
+    pipeline = ingest_dir(session, args.path)
+    print('watching', args.path)
+    try:
+        watch_dir(session, args.path, watcher=watcher, pipeline=pipeline, debounce=args.debounce)
+    except KeyboardInterrupt:
+        pass
+    log_event_stats()
+    return 0
@@ -1,12 +1,22 @@
+import concurrent.futures
 import datetime
 import logging
 import os
+import socket
 
-from sqlalchemy import create_engine
+import numina.drps
+from sqlalchemy import select
 from sqlalchemy.orm import sessionmaker
 
-from ..dal import SqliteDAL, search_oblock_from_id
-from ..model import DataProcessingTask
+from ..base import create_db_engine
+from ..dal import search_oblock_from_id
+from ..event import call_event, flush_events
+from ..jsonsqlite import get_codec, set_codec
+from ..lease import Heartbeat, reset_tree, claim_task
+from ..model import DataProcessingTask, DataProduct
+from ..query import select_obs
+from ..timing import TaskTimer
+from .common import create_session, create_dal, product_ranking
 from .methods import reduction, reductionOB
 
 _logger = logging.getLogger("numina.db")
@@ -20,43 +30,195 @@ runner_version = '1'
 
 
 def mode_run_db(args, extra_args, config):
-    mode_run_common_obs(args, extra_args)
+    mode_run_common_obs(args, extra_args, config)
     return 0
 
 
-def mode_run_common_obs(args, extra_args, config):
-    """Observing mode processing mode of numina."""
-
-    engine = create_engine(args.db_uri, echo=False)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    print('generate reduction tasks')
+def build_request_params(args):
+    """Parameters of the reduction requests, from the command line"""
     request_params = {}
     if args.mode_name:
         request_params['mode_override'] = args.mode_name
     request_params['pipeline'] = args.pipe_name
-    task = generate_reduction_tasks(session, args.obid, request_params)
+    request_params['compress_fits'] = args.compress_fits
+    request_params['compact_json'] = args.compact_json
+    request_params['gzip_json'] = args.gzip_json
+    request_params['reuse'] = args.reuse
+    if args.store_workers is not None:
+        request_params['store_workers'] = args.store_workers
+    return request_params
 
-    # query
-    # tasks = session.query(DataProcessingTask).filter_by(label='root', state=0)
 
-    # DAL must use the database
+def get_datadir(args):
     if args.datadir is None:
-        datadir = os.path.join(args.basedir, 'data')
+        return os.path.join(args.basedir, 'data')
     else:
-        datadir = args.datadir
+        return args.datadir
+
+
+def mode_run_common_obs(args, extra_args, config):
+    """Observing mode processing mode of numina."""
+
+    session = create_session(args)
+
+    obids = select_obids(session, args)
+    if not obids:
+        print('no OBs to reduce')
+        return
+
+    print('generate reduction tasks')
+    request_params = build_request_params(args)
+    tasks = generate_batch_tasks(session, obids, request_params)
+
+    # DAL must use the database
+    datadir = get_datadir(args)
 
-    dal = SqliteDAL(runner, session, basedir=args.basedir, datadir=datadir)
+    dal = create_dal(runner, session, args.basedir, datadir, snapshot=args.snapshot,
+                     product_ranking=product_ranking(args))
     _logger.debug("DAL is %s with datadir=%s", type(dal), datadir)
 
     # Directories with relevant data
     # pipe_name = 'default'
 
-    print('start')
+    for task in tasks:
+        print('start')
+        run_task(session, task, dal)
+        print('end', task.completion_time)
+    session.commit()
+
+
+def select_obids(session, args):
+    """OB ids given in the command line and selected by the query"""
+    if getattr(args, 'obids', None):
+        obids = list(args.obids)
+    elif getattr(args, 'obid', None):
+        obids = [args.obid]
+    else:
+        obids = []
+    if args.query:
+        obids.extend(select_obs(session, args.query))
+    # an OB given twice is reduced once
+    return list(dict.fromkeys(obids))
+
+
+def mode_run_batch(args, extra_args, config):
+    """Reduce several OBs in one process, sharing the DAL."""
+
+    session = create_session(args)
+
+    obids = select_obids(session, args)
+    if not obids:
+        print('no OBs to reduce')
+        return 0
+
+    print('generate reduction tasks for', len(obids), 'OBs')
+    request_params = build_request_params(args)
+    task_ids = [task.id for task in generate_batch_tasks(session, obids, request_params)]
+
+    datadir = get_datadir(args)
+
+    if args.jobs > 1:
+        # The recipes change the working directory, so parallel
+        # reductions run in separate processes, each with its own DAL
+        initargs = (args.db_uri, args.basedir, datadir, args.snapshot, product_ranking(args), get_codec().name)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                                    initargs=initargs) as executor:
+            results = list(executor.map(_run_worker_task, task_ids))
+    else:
+        # the DRPs are loaded once for all the OBs
+        drps = numina.drps.get_system_drps()
+        dal = create_dal(runner, session, args.basedir, datadir, snapshot=args.snapshot,
+                         product_ranking=product_ranking(args), drps=drps)
+        results = [run_task_id(session, task_id, dal) for task_id in task_ids]
+
+    failed = [(task_id, error) for task_id, error in results if error is not None]
+    print('end, {} tasks, {} failed'.format(len(results), len(failed)))
+    for task_id, error in failed:
+        print('task', task_id, 'failed:', error)
+    return 1 if failed else 0
+
+
+def mode_run_resume(args, extra_args, config):
+    """Run again the failed and interrupted tasks of a task tree."""
+
+    session = create_session(args)
+
+    task = session.get(DataProcessingTask, args.task_id)
+    if task is None:
+        print('task', args.task_id, 'not found')
+        return 1
+
+    try:
+        reset = reset_tree(task, lease=args.lease)
+    except ValueError as error:
+        session.rollback()
+        print('cannot resume task', task.id, ':', error)
+        return 1
+    session.commit()
+    print('resume task', task.id, ',', len(reset), 'tasks to run again')
+
+    datadir = get_datadir(args)
+    dal = create_dal(runner, session, args.basedir, datadir, snapshot=args.snapshot,
+                     product_ranking=product_ranking(args))
+
     run_task(session, task, dal)
     print('end', task.completion_time)
-    session.commit()
+    return 0
+
+
+def mode_run_worker(args, extra_args, config):
+    """Claim and run tasks until none is ready."""
+
+    session = create_session(args)
+    datadir = get_datadir(args)
+    dal = create_dal(runner, session, args.basedir, datadir, snapshot=args.snapshot,
+                     product_ranking=product_ranking(args))
+
+    host = socket.gethostname()
+    count = 0
+    while args.max_tasks is None or count < args.max_tasks:
+        task = claim_task(session, host=host)
+        if task is None:
+            break
+        count += 1
+        print('claimed task', task.id)
+        try:
+            execute_task(session, task, dal)
+            if task.parent is not None and all(child.state == 2 for child in task.parent.children):
+                task.parent.waiting = False
+                session.commit()
+        except Exception:
+            _logger.exception('task %s failed', task.id)
+
+    print('end, {} tasks run'.format(count))
+    return 0
+
+
+def run_task_id(session, task_id, dal):
+    """Run a task by id, return (task_id, error)"""
+    task = session.get(DataProcessingTask, task_id)
+    try:
+        run_task(session, task, dal)
+    except Exception as error:
+        _logger.exception('task %s failed', task_id)
+        return task_id, repr(error)
+    return task_id, None
+
+
+# Session and DAL of the worker processes of the batch mode
+_worker = {}
+
+
+def _init_worker(db_uri, basedir, datadir, snapshot=None, ranking=None, codec=None):
+    set_codec(codec)
+    engine = create_db_engine(db_uri, pool_size=2)
+    session = sessionmaker(bind=engine)()
+    _worker['session'] = session
+    _worker['dal'] = create_dal(runner, session, basedir, datadir, snapshot=snapshot, product_ranking=ranking)
+
+
+def _run_worker_task(task_id):
+    return run_task_id(_worker['session'], task_id, _worker['dal'])
 
 
 def run_task(session, task, dal):
@@ -79,26 +241,57 @@ def run_task(session, task, dal):
         print('im running and nothing is awaited')
         task.waiting = False
 
+    execute_task(session, task, dal)
+
+
+def execute_task(session, task, dal):
+    """Run the method of a task, its children must be finished."""
+
     # setup things
+    # the claim is committed, so that an interrupted task can be detected
     task.start_time = datetime.datetime.utcnow()
+    task.heartbeat = task.start_time
     task.state = 1
+    session.commit()
+    call_event('on_task_claimed', session, [task.id])
+
     task_method = methods[task.method]
+    timer = TaskTimer()
 
     try:
-        result = task_method(request=task.request, dal=dal, taskid=task.id)
+        with Heartbeat(session.get_bind(), task.id):
+            result = task_method(request=task.request, dal=dal, taskid=task.id, timer=timer)
         task.result = result
         # On completion
         task.state = 2
         task.awaited = False
     except Exception:
+        # discard partial results, keep the failure
+        session.rollback()
         task.state = 3
         raise
     finally:
         task.completion_time = datetime.datetime.utcnow()
+        timer.store(session, task.id)
         session.commit()
+        # a failing handler does not replace the error of the recipe
+        try:
+            task_finished(session, task)
+        except Exception:
+            _logger.exception('handlers of the end of task %s failed', task.id)
 
 
-def generate_reduction_tasks(session, obid, request_params):
+def task_finished(session, task):
+    """Emit the events of a finished task"""
+    if task.state == 2:
+        product_ids = list(session.scalars(select(DataProduct.id).where(DataProduct.task_id == task.id)))
+        if product_ids:
+            call_event('on_products_registered', session, product_ids)
+    call_event('on_task_finished', session, [task.id])
+    flush_events()
+
+
+def generate_reduction_tasks(session, obid, request_params, commit=True):
     """Generate reduction tasks."""
 
     obsres = search_oblock_from_id(session, obid)
@@ -123,10 +316,18 @@ def generate_reduction_tasks(session, obid, request_params):
     print('generate recursive')
     recursive_tasks(dbtask, obsres, request_params)
 
-    session.commit()
+    if commit:
+        session.commit()
     return dbtask
 
 
+def generate_batch_tasks(session, obids, request_params):
+    """Generate the reduction tasks of several OBs, in one transaction."""
+    tasks = [generate_reduction_tasks(session, obid, request_params, commit=False) for obid in obids]
+    session.commit()
+    return tasks
+
+
 def recursive_tasks(parent_task, obsres, request_params):
 
     request = {"id": obsres.id}
@@ -139,10 +340,11 @@ def recursive_tasks(parent_task, obsres, request_params):
     dbtask.waiting = False
     dbtask.method = 'reductionOB'
     dbtask.request = request
-    dbtask.ob = obsres
     if parent_task:
         dbtask.awaited = True
+        # added to the session with the parent, before linking it to the OB
         parent_task.children.append(dbtask)
+    dbtask.ob = obsres
 
     for ob in obsres.children:
         recursive_tasks(dbtask, ob, request_params)
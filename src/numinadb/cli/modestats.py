@@ -0,0 +1,19 @@
+
+from ..timing import timing_summary
+from .common import create_session
+
+
+def mode_stats(args, extra_args, config):
+
+    session = create_session(args)
+
+    summary = timing_summary(session, task_ids=args.task_ids)
+    if not summary:
+        print('no timing information')
+        return
+
+    fmt = '{:20s} {:>8s} {:>12s} {:>10s} {:>10s}'
+    print(fmt.format('stage', 'count', 'total (s)', 'mean (s)', 'max (s)'))
+    fmt = '{:20s} {:8d} {:12.3f} {:10.3f} {:10.3f}'
+    for stage, count, total, mean, maxd in summary:
+        print(fmt.format(stage, count, total, mean, maxd))
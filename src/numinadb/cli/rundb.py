@@ -10,13 +10,20 @@
 """User command line interface of Numina DB"""
 
 
+import datetime
 import logging
 import os
 
+from ..ingest import INGEST_WORKERS
+from ..lease import LEASE_TIME
+from ..query import FIND_PAGE_SIZE
+from ..watch import DEBOUNCE
 from .modealias import mode_alias
 from .modedb import mode_db
-from .moderun import mode_run_db
+from .modefind import mode_find
+from .moderun import mode_run_db, mode_run_batch, mode_run_resume, mode_run_worker
 from .modeingest import mode_ingest
+from .modestats import mode_stats
 
 
 _logger = logging.getLogger("numina.db")
@@ -32,6 +39,8 @@ def complete_config(config):
         'database': 'sqlite:///processing.db',
         'datadir': "",
         'basedir': os.getcwd(),
+        # datatypes whose products are selected by time
+        'nearest_in_time': "",
     }
 
     for k, v in values.items():
@@ -41,6 +50,63 @@ def complete_config(config):
     return config
 
 
+def add_dal_arguments(parser, bdir_default, ddir_default, nearest_default=()):
+    """Arguments common to the commands running tasks, id, batch, resume and worker"""
+
+    parser.add_argument(
+        '--basedir', action="store", dest="basedir",
+        default=bdir_default,
+        help='path to create the following directories'
+        )
+    parser.add_argument(
+        '--datadir', action="store", dest="datadir", default=ddir_default,
+        help='path to directory containing pristine data'
+        )
+    parser.add_argument(
+        '--snapshot', metavar='PATH',
+        help='resolve the observing blocks and parameters in a snapshot created with "db --export-snapshot", '
+             'products are searched in the database'
+        )
+    parser.add_argument(
+        '--nearest-in-time', action='append', default=list(nearest_default), metavar='DATATYPE',
+        help='use the products of this datatype nearest in time to the OB (can be repeated)'
+        )
+
+
+def add_run_arguments(parser, bdir_default, ddir_default, nearest_default=()):
+    """Arguments common to the commands running reductions"""
+
+    parser.add_argument(
+        '-p', '--pipeline', dest='pipe_name',
+        default='default', help='name of a pipeline'
+        )
+    parser.add_argument(
+        '--mode', dest='mode_name',
+        help='override observing mode'
+        )
+    add_dal_arguments(parser, bdir_default, ddir_default, nearest_default)
+    parser.add_argument(
+        '--store-workers', type=int, dest='store_workers',
+        help='number of threads writing the products'
+        )
+    parser.add_argument(
+        '--compress-fits', action='store_true', dest='compress_fits',
+        help='write FITS products compressed with gzip'
+        )
+    parser.add_argument(
+        '--compact-json', action='store_true', dest='compact_json',
+        help='write task.json and result.json without indentation'
+        )
+    parser.add_argument(
+        '--gzip-json', action='store_true', dest='gzip_json',
+        help='write task.json and result.json compressed with gzip'
+        )
+    parser.add_argument(
+        '--no-reuse', action='store_false', dest='reuse',
+        help='run the recipe even if a previous task had the same inputs'
+        )
+
+
 def register(subparsers, config):
 
     complete_config(config)
@@ -48,6 +114,7 @@ def register(subparsers, config):
     db_default = config.get('rundb', 'database')
     ddir_default = config.get('rundb', 'datadir')
     bdir_default = config.get('rundb', 'basedir')
+    nearest_default = config.get('rundb', 'nearest_in_time').split()
 
     if ddir_default == "":
         ddir_default = None
@@ -63,6 +130,18 @@ def register(subparsers, config):
                               metavar='URI',
                               help='Path to the database'
                               )
+    parser_rundb.add_argument('--profile-sql',
+                              action='store_true',
+                              help='Report the time spent in SQL statements at exit'
+                              )
+    parser_rundb.add_argument('--json-codec',
+                              choices=['json', 'orjson'],
+                              help='Codec of the JSON columns in SQLite, orjson is faster (default json)'
+                              )
+    parser_rundb.add_argument('--pool-size',
+                              type=int,
+                              help='Size of the connection pool, for server databases'
+                              )
 
     subdb = parser_rundb.add_subparsers(
         title='DB Targets',
@@ -97,37 +176,80 @@ def register(subparsers, config):
                            const=db_default,
                            metavar='URI',
                            help='Create a database')
+    parser_db.add_argument('--export-snapshot', metavar='PATH',
+                           help='Write a read-only SQLite snapshot of the tables used to resolve inputs')
 
     parser_db.set_defaults(command=mode_db)
 
     parser_id = subdb.add_parser('id', help='run reductions based on OB id')
-    parser_id.add_argument('obid')
+    parser_id.add_argument('obid', nargs='?')
     parser_id.add_argument('--query',
-                           help='Query')
-    parser_id.add_argument(
-        '-p', '--pipeline', dest='pipe_name',
-        default='default', help='name of a pipeline'
-        )
-    parser_id.add_argument(
-        '--mode', dest='mode_name',
-        help='override observing mode'
+                           help='select the OBs with a query, i.e. "instrument=MEGARA start>=2025-03-01 pending"')
+    add_run_arguments(parser_id, bdir_default, ddir_default, nearest_default)
+    parser_id.set_defaults(command=mode_run_db)
+
+    parser_batch = subdb.add_parser('batch', help='run reductions of several OBs in one process')
+    parser_batch.add_argument('obids', nargs='*', metavar='obid')
+    parser_batch.add_argument('--query',
+                              help='select the OBs with a query, i.e. "instrument=MEGARA start>=2025-03-01 pending"')
+    parser_batch.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of OBs reduced in parallel'
         )
-    parser_id.add_argument(
-        '--basedir', action="store", dest="basedir",
-        default=bdir_default,
-        help='path to create the following directories'
+    add_run_arguments(parser_batch, bdir_default, ddir_default, nearest_default)
+    parser_batch.set_defaults(command=mode_run_batch)
+
+    parser_resume = subdb.add_parser('resume', help='run again the failed or interrupted tasks of a task tree')
+    parser_resume.add_argument('task_id', type=int, help='id of the root task')
+    parser_resume.add_argument(
+        '--lease', type=float, default=LEASE_TIME,
+        help='seconds without heartbeat after which a running task is considered dead'
         )
-    parser_id.add_argument(
-        '--datadir', action="store", dest="datadir", default=ddir_default,
-        help='path to directory containing pristine data'
+    add_dal_arguments(parser_resume, bdir_default, ddir_default, nearest_default)
+    parser_resume.set_defaults(command=mode_run_resume)
+
+    parser_worker = subdb.add_parser('worker', help='claim and run tasks ready to run, until none is left')
+    parser_worker.add_argument(
+        '--max-tasks', type=int,
+        help='stop after running this number of tasks'
         )
-    parser_id.set_defaults(command=mode_run_db)
+    add_dal_arguments(parser_worker, bdir_default, ddir_default, nearest_default)
+    parser_worker.set_defaults(command=mode_run_worker)
 
     parser_ingest = subdb.add_parser('ingest', help='ingest data in the database')
     parser_ingest.add_argument('--ob-file', action='store_true')
     parser_ingest.add_argument('--control-file', action='store_true')
+    parser_ingest.add_argument('--two-phase', action='store_true',
+                               help='register the frames from their headers first, then extract their metadata')
+    parser_ingest.add_argument('--workers', type=int, default=INGEST_WORKERS,
+                               help='threads extracting metadata in two-phase ingestion')
+    parser_ingest.add_argument('--watch', action='store_true',
+                               help='after ingesting the directory, ingest the new files written in it')
+    parser_ingest.add_argument('--poll', action='store_true',
+                               help='watch the directory scanning it, instead of using inotify')
+    parser_ingest.add_argument('--debounce', type=float, default=DEBOUNCE,
+                               help='seconds without new files before ingesting them')
     parser_ingest.add_argument('path')
 
     parser_ingest.set_defaults(command=mode_ingest)
 
+    parser_find = subdb.add_parser('find', help='list the OBs or frames observed in a time range')
+    parser_find.add_argument('--instrument', help='name of the instrument')
+    parser_find.add_argument('--mode', help='observing mode')
+    parser_find.add_argument('--object', help='name of the object')
+    parser_find.add_argument('--start', type=datetime.datetime.fromisoformat,
+                             help='started at or after this time, in ISO format')
+    parser_find.add_argument('--end', type=datetime.datetime.fromisoformat,
+                             help='started before this time, in ISO format')
+    parser_find.add_argument('--frames', action='store_true', help='list frames instead of OBs')
+    parser_find.add_argument('--limit', type=int, help='maximum number of rows listed')
+    parser_find.add_argument('--page-size', type=int, default=FIND_PAGE_SIZE,
+                             help='rows read from the database at once')
+    parser_find.set_defaults(command=mode_find)
+
+    parser_stats = subdb.add_parser('stats', help='summary of the time spent in each stage of the tasks')
+    parser_stats.add_argument('--task', dest='task_ids', type=int, action='append',
+                              metavar='ID', help='summary of this task (can be repeated)')
+    parser_stats.set_defaults(command=mode_stats)
+
     return parser_rundb
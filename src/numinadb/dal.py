@@ -10,9 +10,14 @@
 """User command line interface of Numina."""
 
 
+import contextlib
+import itertools
+import json
 import logging
 import os
 
+from sqlalchemy import cast, UnicodeText
+
 import numina.drps
 from numina.store import load
 from numina.dal.absdal import AbsDrpDAL
@@ -22,10 +27,42 @@ from numina.dal.utils import tags_are_valid
 from numina.core import DataFrameType
 
 from .model import ObservingBlock, DataProduct, RecipeParameters, ObservingBlockAlias
-from .model import DataProcessingTask, ReductionResult
+from .model import RecipeParameterValues, RecipeParameterIndex
+from .jsonsqlite import get_codec
+from .query import find_obs, find_frames
+from .model import DataProcessingTask, ReductionResult, defer_json
 
 _logger = logging.getLogger("numina.db.dal")
 
+# Ranking of the products compatible with a request, per datatype:
+# the highest priority first
+RANK_PRIORITY = 'priority'
+# the nearest in time to the OB first, then the highest priority
+RANK_TIME = 'time'
+
+
+# Products fetched at once by the searches nearest in time
+NEAREST_BATCH = 50
+
+
+def merge_nearest(before, after, when):
+    """Merge the products before and after `when`, the nearest in time first.
+
+    `before` are ordered by decreasing dateobs and `after` by increasing
+    dateobs, at equal dateobs by decreasing priority. At equal distance,
+    the product with the highest priority comes first.
+    """
+    before, after = iter(before), iter(after)
+    prev, nxt = next(before, None), next(after, None)
+    while prev is not None or nxt is not None:
+        if nxt is None or (prev is not None and
+                           (when - prev.dateobs, -(prev.priority or 0)) <= (nxt.dateobs - when, -(nxt.priority or 0))):
+            yield prev
+            prev = next(before, None)
+        else:
+            yield nxt
+            nxt = next(after, None)
+
 
 def search_oblock_from_id(session, obsref):
 
@@ -44,19 +81,63 @@ def search_oblock_from_id(session, obsref):
 
 
 class SqliteDAL(AbsDrpDAL):
-    def __init__(self, dialect, session, basedir, datadir):
-        drps = numina.drps.get_system_drps()
+    """DAL over a database.
+
+    Observing blocks and parameters are searched in `lookup_session`,
+    such as a session of a snapshot (see numinadb.snapshot), or in
+    `session` if not given. Products, tasks and results are read from
+    `session`, so that the products of earlier tasks of the run are found.
+
+    `product_ranking` maps datatypes to the ranking of their products,
+    RANK_PRIORITY (the default) or RANK_TIME, i.e. for master calibrations.
+    """
+
+    def __init__(self, dialect, session, basedir, datadir, drps=None, lookup_session=None,
+                 product_ranking=None):
+        if drps is None:
+            drps = numina.drps.get_system_drps()
         super(SqliteDAL, self).__init__(drps)
 
         self.dialect = dialect
         self.session = session
+        self.lookup_session = session if lookup_session is None else lookup_session
         self.basedir = basedir
         self.datadir = datadir
+        self.product_ranking = {} if product_ranking is None else product_ranking
         self.extra_data = {}
+        # inputs resolved while recording, see recording_inputs
+        self.resolved = None
+        # see parameter_index_ready
+        self._parameter_index = None
+
+    @contextlib.contextmanager
+    def recording_inputs(self):
+        """Record the products, parameters and results resolved by the DAL.
+
+        Yields a dictionary, filled with the name of each input and
+        an identification of the value returned for it.
+        """
+        self.resolved = {}
+        try:
+            yield self.resolved
+        finally:
+            self.resolved = None
+
+    def _record_input(self, name, value):
+        if self.resolved is not None:
+            self.resolved[name] = value
 
     def search_oblock_from_id(self, obsref):
 
-        return search_oblock_from_id(self.session, obsref)
+        return search_oblock_from_id(self.lookup_session, obsref)
+
+    def find_obs(self, **criteria):
+        """Observing blocks by instrument, mode, object and time, see query.find_obs"""
+        return find_obs(self.lookup_session, **criteria)
+
+    def find_frames(self, **criteria):
+        """Frames by instrument, mode, object and time, see query.find_frames"""
+        return find_frames(self.lookup_session, **criteria)
 
     def search_prod_obsid(self, ins, obsid, pipeline):
         """Returns the first coincidence..."""
@@ -73,17 +154,49 @@ class SqliteDAL(AbsDrpDAL):
     def search_prod_req_tags(self, req, ins, tags, pipeline):
         return self.search_prod_type_tags(req.type, ins, tags, pipeline)
 
-    def search_prod_type_tags(self, tipo, ins, tags, pipeline):
-        """Returns the first coincidence..."""
+    def search_prod_type_tags(self, tipo, ins, tags, pipeline, when=None):
+        """Returns the first coincidence...
+
+        Only products of the instrument and pipeline are considered.
+        If the datatype is ranked by time and `when` is given, products
+        nearest in time to `when` are preferred. They are read in the
+        order of the index on dateobs, which needs the pipeline; without
+        it, the candidates are sorted by the database.
+        """
+        prod_id, path, pt = self.locate_prod_type_tags(tipo, ins, tags, pipeline, when=when)
+        return StoredProduct(id=prod_id, content=load(tipo, path), tags=pt)
+
+    def locate_prod_type_tags(self, tipo, ins, tags, pipeline, when=None):
+        """The id, path and tags of the product of search_prod_type_tags, without loading it"""
 
         _logger.debug('query search_prod_type_tags type=%s instrument=%s tags=%s pipeline=%s',
                       tipo, ins, tags, pipeline)
         # drp = self.drps.query_by_name(ins)
         label = tipo.name()
         # print('search prod', tipo, ins, tags, pipeline)
+        # products are registered during the run, not in a snapshot
         session = self.session
-        # FIXME: and instrument == ins
-        res = session.query(DataProduct).filter(DataProduct.datatype == label).order_by(DataProduct.priority.desc())
+        instrument_id = ins if isinstance(ins, str) else ins.name
+        # candidates from the indexes on (datatype, instrument_id, pipeline, ...)
+        res = session.query(DataProduct).filter(
+            DataProduct.datatype == label,
+            DataProduct.instrument_id == instrument_id
+        )
+        if pipeline is not None:
+            res = res.filter(DataProduct.pipeline == pipeline)
+        if when is not None and self.product_ranking.get(label, RANK_PRIORITY) == RANK_TIME:
+            # two scans of ix_products_lookup_dateobs, away from `when`, read
+            # in batches until a product is valid; then the undated products
+            before = res.filter(DataProduct.dateobs <= when).order_by(
+                DataProduct.dateobs.desc(), DataProduct.priority.desc()
+            ).yield_per(NEAREST_BATCH)
+            after = res.filter(DataProduct.dateobs > when).order_by(
+                DataProduct.dateobs, DataProduct.priority.desc()
+            ).yield_per(NEAREST_BATCH)
+            undated = res.filter(DataProduct.dateobs.is_(None)).order_by(DataProduct.priority.desc())
+            res = itertools.chain(merge_nearest(before, after, when), undated)
+        else:
+            res = res.order_by(DataProduct.priority.desc())
         _logger.debug('requested tags are %s', tags)
         for prod in res:
             pt = {}
@@ -98,26 +211,71 @@ class SqliteDAL(AbsDrpDAL):
                 _logger.debug('tags are valid, return product, id=%s', prod.id)
                 _logger.debug('content is %s', prod.contents)
                 # this is a valid product
-                return StoredProduct(id=prod.id,
-                                     content=load(tipo, os.path.join(self.basedir, prod.contents)),
-                                     tags=pt
-                                     )
+                return prod.id, os.path.join(self.basedir, prod.contents), pt
             _logger.debug('tags are in valid')
         else:
             _logger.debug('query search_prod_type_tags, no result found')
             msg = 'type %s compatible with tags %r not found' % (label, tags)
             raise NoResultFound(msg)
 
+    def parameter_index_ready(self):
+        """True if the parameters are in the resolution index.
+
+        Databases created before the index have parameters but an empty
+        index, until "db --initdb" builds it. Checked once per DAL.
+        """
+        if self._parameter_index is None:
+            session = self.lookup_session
+            indexed = session.query(RecipeParameterIndex.value_id).first() is not None
+            self._parameter_index = indexed or session.query(RecipeParameterValues.id).first() is None
+            if not self._parameter_index:
+                _logger.warning('the parameter index is empty, parameters are searched without it; '
+                                'run "numina rundb db --initdb" to build it')
+        return self._parameter_index
+
     def search_param_type_tags(self, name, tipo, instrument, mode, pipeline, tags):
         _logger.debug('query search_param_type_tags name=%s instrument=%s tags=%s '
                       'pipeline=%s mode=%s', name, instrument, tags, pipeline, mode)
-        session = self.session
+        session = self.lookup_session
 
         if isinstance(instrument, str):
             instrument_id = instrument
         else:
             instrument_id = instrument.name
 
+        if not self.parameter_index_ready():
+            return self.search_param_type_tags_scan(name, tipo, instrument_id, mode, pipeline, tags)
+
+        # The content is fetched as text, only the selected value is decoded
+        res = session.query(
+            RecipeParameterIndex.value_id,
+            RecipeParameterIndex.tags,
+            cast(RecipeParameterValues.content, UnicodeText)
+        ).join(RecipeParameterIndex.value).filter(
+            RecipeParameterIndex.instrument_id == instrument_id,
+            RecipeParameterIndex.pipeline == pipeline,
+            RecipeParameterIndex.name == name,
+            RecipeParameterIndex.mode == mode
+        ).order_by(RecipeParameterIndex.value_id).all()
+
+        _logger.debug('requested tags are %s', tags)
+        for value_id, value_tags, content in res:
+            pt = json.loads(value_tags)
+            _logger.debug('found value with id %d', value_id)
+            _logger.debug('param tags are %s', pt)
+
+            if tags_are_valid(pt, tags):
+                _logger.debug('tags are valid, param, id=%s, end', value_id)
+                _logger.debug('content is %s', content)
+                # this is a valid product
+                return StoredParameter(get_codec().loads(content))
+        else:
+            raise NoResultFound("No parameters for %s mode, pipeline %s", mode, pipeline)
+
+    def search_param_type_tags_scan(self, name, tipo, instrument_id, mode, pipeline, tags):
+        """Search parameters without the resolution index"""
+        session = self.lookup_session
+
         res = session.query(RecipeParameters).filter(
             RecipeParameters.instrument_id == instrument_id,
             RecipeParameters.pipeline == pipeline,
@@ -177,30 +335,42 @@ class SqliteDAL(AbsDrpDAL):
         if name in self.extra_data:
             value = self.extra_data[name]
             content = StoredParameter(value)
-            return content
         else:
-            return self.search_param_type_tags(name, tipo, instrument, mode, pipeline, tags)
+            content = self.search_param_type_tags(name, tipo, instrument, mode, pipeline, tags)
+        self._record_input(name, {'parameter': content.content})
+        return content
 
     def search_product(self, name, tipo, obsres, options=None):
         # returns StoredProduct
+        prod_id, path, tags = self.locate_product(name, tipo, obsres)
+        return StoredProduct(id=prod_id, content=load(tipo, path), tags=tags)
+
+    def locate_product(self, name, tipo, obsres):
+        """The id, path and tags of the product of search_product, without loading it"""
         ins = obsres.instrument
         tags = obsres.tags
         pipeline = obsres.pipeline
 
         if name in self.extra_data:
             val = self.extra_data[name]
-            content = load(tipo, val)
-            return StoredProduct(id=0, tags={}, content=content)
+            self._record_input(name, {'file': val})
+            return 0, val, {}
         else:
-            return self.search_prod_type_tags(tipo, ins, tags, pipeline)
+            when = getattr(obsres, 'start_time', None)
+            located = self.locate_prod_type_tags(tipo, ins, tags, pipeline, when=when)
+            self._record_input(name, {'product': located[0]})
+            return located
 
     def search_result_relative(self, name, tipo, obsres, mode, field, node, options=None):
         # So, if node is children, I have to obtain
         session = self.session
         if node == 'children':
             print('obtain', field, 'from all the children of', obsres.taskid)
-            res = session.query(DataProcessingTask).filter_by(id=obsres.taskid).one()
+            res = session.query(DataProcessingTask).options(
+                *defer_json(DataProcessingTask)
+            ).filter_by(id=obsres.taskid).one()
             result = []
+            contents = []
             for child in res.children:
                 # this can be done better...
                 nodes = session.query(ReductionResult).filter_by(task_id=child.id).first()
@@ -214,12 +384,16 @@ class SqliteDAL(AbsDrpDAL):
                             tags={}
                         )
                         result.append(st)
+                        contents.append(prod.contents)
                         break
+            self._record_input(name, {'results': contents})
             return result
 
         elif node == 'prev':
             print('obtain', field, 'from the previous node to', obsres.taskid)
-            res = session.query(DataProcessingTask).filter_by(id=obsres.taskid).one()
+            res = session.query(DataProcessingTask).options(
+                *defer_json(DataProcessingTask)
+            ).filter_by(id=obsres.taskid).one()
             # inspect children of my parent
             parent = res.parent
             if parent:
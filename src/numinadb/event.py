@@ -1,25 +1,189 @@
+"""Events emitted during ingestion and processing.
 
+Handlers are registered with `manage` or the `on_event` decorator. They can
+run synchronously, when the event is called, in background threads, or in
+batch, receiving the arguments and keyword arguments of all the calls
+since the last flush at once. Events are flushed with `flush_events`,
+i.e. before committing the session. Failures of the background and batch
+handlers are logged, they do not stop the ingestion or the processing.
+Background handlers run in other threads, they must not use the session::
 
+    @on_event('on_ingest_raw_fits', background=True)
+    def preview(session, frame, meta):
+        ...
+
+    @on_event('on_ingest_raw_fits', batch=True)
+    def statistics(calls):
+        for (session, frame, meta), kwargs in calls:
+            ...
+
+"""
+
+import concurrent.futures
+import logging
+import threading
+import time
+
+
+_logger = logging.getLogger(__name__)
+
+# Events and their arguments. Batch events are called once per
+# transaction, after the commit, with the ids of the rows
 _event_names = [
-    'on_ingest_raw_fits'
+    # (session, frame uuid, frame metadata), for each raw frame
+    'on_ingest_raw_fits',
+    # (session, OB ids, frame ids)
+    'on_ingest_batch_committed',
+    # (session, product ids)
+    'on_products_registered',
+    # (session, task ids)
+    'on_task_claimed',
+    # (session, task ids)
+    'on_task_finished',
 ]
 
+# Threads running background handlers, per event
+BACKGROUND_WORKERS = 4
+
+# Maximum number of background calls waiting to run, per event;
+# calling the event blocks when the limit is reached
+BACKGROUND_QUEUE = 64
+
+
+class HandlerStats(object):
+    """Number of calls and time spent in a handler"""
+
+    __slots__ = ['name', 'calls', 'total', 'max', 'errors']
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def add(self, elapsed, error=False):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        if error:
+            self.errors += 1
+
+
+class Handler(object):
+    """A callable registered in an EventManager"""
+
+    def __init__(self, callable, background=False, batch=False):
+        if background and batch:
+            raise ValueError('a handler can not be background and batch')
+        self.callable = callable
+        self.background = background
+        self.batch = batch
+        self.stats = HandlerStats(getattr(callable, '__qualname__', repr(callable)))
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        error = True
+        try:
+            res = self.callable(*args, **kwargs)
+            error = False
+            return res
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stats.add(elapsed, error=error)
+
+
+class BoundedExecutor(object):
+    """A thread pool with a limited number of pending calls"""
+
+    def __init__(self, max_workers=BACKGROUND_WORKERS, max_queue=BACKGROUND_QUEUE):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.semaphore = threading.BoundedSemaphore(max_workers + max_queue)
+
+    def submit(self, fn, *args, **kwargs):
+        self.semaphore.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.semaphore.release()
+            raise
+        future.add_done_callback(lambda f: self.semaphore.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
 
 class EventManager(object):
     def __init__(self, name):
         self.name = name
         self.events = []
+        self._executor = None
+        self._futures = []
+        self._calls = []
+
+    def register(self, callable, background=False, batch=False):
+        self.events.append(Handler(callable, background=background, batch=batch))
 
-    def register(self, callable):
-        self.events.append(callable)
+    def _submit(self, handler, *args, **kwargs):
+        if self._executor is None:
+            self._executor = BoundedExecutor()
+        future = self._executor.submit(handler, *args, **kwargs)
+        self._futures.append(future)
+        return future
 
     def __call__(self, *args, **kwargs):
+        """Call the handlers.
+
+        Returns the results of the synchronous handlers,
+        and a Future for each background handler.
+        """
+        result = []
+        batch = False
+        for handler in self.events:
+            if handler.batch:
+                batch = True
+            elif handler.background:
+                result.append(self._submit(handler, *args, **kwargs))
+            else:
+                result.append(handler(*args, **kwargs))
+        if batch:
+            self._calls.append((args, kwargs))
+        return result
+
+    def flush(self):
+        """Call the batch handlers and wait for the background handlers.
+
+        Batch handlers receive the list of the (args, kwargs) of each
+        call since the last flush. Returns the results of the batch and
+        background handlers that did not fail. Failures are logged and
+        counted in the stats of the handler.
+        """
+        calls, self._calls = self._calls, []
+        futures, self._futures = self._futures, []
+
         result = []
-        for callable in self.events:
-            res = callable(*args, **kwargs)
-            result.append(res)
+        if calls:
+            for handler in self.events:
+                if handler.batch:
+                    try:
+                        result.append(handler(calls))
+                    except Exception:
+                        _logger.error('batch handler %s of %s failed', handler.stats.name, self.name,
+                                      exc_info=True)
+
+        for future in futures:
+            try:
+                result.append(future.result())
+            except Exception:
+                _logger.error('background handler of %s failed', self.name, exc_info=True)
         return result
 
+    def stats(self):
+        return [handler.stats for handler in self.events]
+
 
 def _create_managers():
     managers = {}
@@ -31,10 +195,10 @@ def _create_managers():
 _managers = _create_managers()
 
 
-def manage(name, callable):
+def manage(name, callable, background=False, batch=False):
     global _managers  # noqa
     manager = _managers[name]
-    manager.register(callable)
+    manager.register(callable, background=background, batch=batch)
     return callable
 
 
@@ -44,10 +208,23 @@ def call_event(name, *args, **kwargs):
     return manager(*args, **kwargs)
 
 
+def flush_events():
+    """Flush all the events, see EventManager.flush"""
+    for manager in _managers.values():
+        manager.flush()
+
+
+def event_stats():
+    """Statistics of the handlers of each event"""
+    return {name: manager.stats() for name, manager in _managers.items()}
+
+
 class on_event(object):
-    def __init__(self, name):
+    def __init__(self, name, background=False, batch=False):
         self.name = name
+        self.background = background
+        self.batch = batch
 
     def __call__(self, fn):
-        manage(self.name, fn)
+        manage(self.name, fn, background=self.background, batch=self.batch)
         return fn
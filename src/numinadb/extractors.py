@@ -0,0 +1,305 @@
+#
+# Copyright 2017-2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Extraction of the metadata of the files to ingest.
+
+Extractors are selected by the suffix of the file or, for unknown
+suffixes, by its first bytes. Other packages can add extractors
+in the entry point group ``numinadb.extractors``::
+
+    [project.entry-points."numinadb.extractors"]
+    myformat = "mypackage.ingest:MyFormatExtractor"
+
+The entry point is an Extractor subclass, or instance. An extractor with
+the name of a builtin one replaces it.
+"""
+
+import gzip
+import importlib.metadata
+import logging
+import os.path
+
+from astropy.io import fits
+import numina.store
+from numina.types.frame import DataFrameType
+from numina.types.linescatalog import LinesCatalog
+from numina.types.structured import BaseStructuredCalibration
+
+
+_logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'numinadb.extractors'
+
+# Bytes read to recognize a file by its content
+SNIFF_SIZE = 80
+
+base_db_info_keys = [
+    'instrument',
+    'object',
+    'observation_date',
+    'uuid',
+    'type',
+    'mode',
+    'exptime',
+    'darktime',
+    'insconf',
+    'blckuuid',
+    'quality_control'
+]
+
+# Metadata read from the primary header to classify a FITS file
+CLASSIFY_KEYS = [
+    'instrument',
+    'type',
+    'uuid',
+    'blckuuid',
+    'mode',
+    'object',
+    'observation_date',
+    'insconf',
+]
+
+
+def image_hdulist(hdulist):
+    """The HDUList with the image header in the primary HDU.
+
+    In tile-compressed files (.fits.fz) the primary HDU is empty
+    and the image is in the first extension.
+    """
+    if len(hdulist) > 1 and isinstance(hdulist[1], fits.CompImageHDU) and hdulist[0].data is None:
+        header = hdulist[1].header.copy()
+        header.pop('XTENSION', None)
+        header.pop('PCOUNT', None)
+        header.pop('GCOUNT', None)
+        return fits.HDUList([fits.PrimaryHDU(header=header)] + list(hdulist[2:]))
+    return hdulist
+
+
+def metadata_fits(obj, drps):
+
+    with fits.open(obj) as hdulist:
+        view = image_hdulist(hdulist)
+        # get instrument
+        instrument_id = view[0].header['INSTRUME']
+
+        this_drp = drps.query_by_name(instrument_id)
+
+        datamodel = this_drp.datamodel
+        keys = datamodel.db_info_keys
+        if view is not hdulist:
+            # the header of the compressed image
+            return DataFrameType(datamodel=datamodel).extract_db_info(view, keys)
+
+    result = DataFrameType(datamodel=datamodel).extract_db_info(obj, keys)
+    return result
+
+
+def classify_fits(path, drps):
+    """Metadata of a FITS file from its primary header only.
+
+    Only the header is read, the keys in CLASSIFY_KEYS are extracted
+    with the datamodel of the instrument, missing keys are None.
+    """
+    with fits.open(path) as hdulist:
+        header = image_hdulist(hdulist)[0].header
+    this_drp = drps.query_by_name(header['INSTRUME'])
+    extractor = this_drp.datamodel.extractor_map['fits']
+    hdulist = fits.HDUList([fits.PrimaryHDU(header=header)])
+    result = {}
+    for key in CLASSIFY_KEYS:
+        try:
+            result[key] = extractor.extract(key, hdulist)
+        except KeyError:
+            result[key] = None
+    return result
+
+
+def metadata_product(path, datatype, instrument, drps):
+    """Metadata of a product, loaded with the type of its datatype"""
+    this_drp = drps.query_by_name(instrument)
+    prodtype = this_drp.pipelines['default'].load_product_from_name(datatype)
+    obj = numina.store.load(prodtype, path)
+    result = prodtype.extract_db_info(obj, this_drp.datamodel.db_info_keys)
+    result['type'] = datatype
+    return result
+
+
+def lis_instrument(obj, drps):
+    """Instrument of a lines catalog.
+
+    The name of a directory of the path, if it is an instrument,
+    ignoring case, or the instrument, if only one is installed.
+    """
+    instruments = set(drps.query_all())
+    names = {name.lower(): name for name in instruments}
+    for part in reversed(os.path.normpath(os.path.abspath(obj)).split(os.sep)[:-1]):
+        if part.lower() in names:
+            return names[part.lower()]
+    if len(instruments) == 1:
+        return instruments.pop()
+    raise ValueError('unable to find the instrument of {}'.format(obj))
+
+
+def metadata_lis(obj, drps):
+    """Extract metadata from serialized file.
+
+    The tags are in the name of the file, <vph>_<speclamp>.lis
+    """
+    result = LinesCatalog().extract_db_info(obj, base_db_info_keys)
+
+    head, tail = os.path.split(obj)
+    base, ext = os.path.splitext(tail)
+    tags = base.split('_')
+    result['instrument'] = lis_instrument(obj, drps)
+    if len(tags) >= 2:
+        result['tags'] = {
+            'vph': tags[0],
+            'speclamp': tags[1]
+        }
+
+    return result
+
+
+def metadata_json(obj):
+    """Extract metadata from serialized file"""
+
+    result = BaseStructuredCalibration().extract_meta_info(obj)
+    return result
+
+
+class Extractor(object):
+    """Extract the metadata of a kind of file.
+
+    `header_only` extractors read only the headers of the file and run
+    in the ingestion loop, the others load the file and run in
+    the workers. Products extracted with `recheck` are loaded again
+    with their type before being registered.
+    """
+
+    name = None
+    suffixes = ()
+    header_only = False
+    recheck = False
+
+    def sniff(self, path, head):
+        """True if the file, whose first bytes are head, can be extracted"""
+        return False
+
+    def extract(self, path, drps):
+        """Return the metadata of the file, as a dictionary"""
+        raise NotImplementedError
+
+    def classify(self, path, drps):
+        """Metadata enough to classify the file, or None if not supported"""
+        return None
+
+
+class FitsExtractor(Extractor):
+    name = 'fits'
+    suffixes = ('.fits', '.fit', '.fits.gz', '.fit.gz', '.fits.fz', '.fz')
+
+    def sniff(self, path, head):
+        if head.startswith(b'\x1f\x8b'):
+            with gzip.open(path) as fd:
+                head = fd.read(SNIFF_SIZE)
+        return head.startswith(b'SIMPLE  =')
+
+    def extract(self, path, drps):
+        # the header tells the type of a product, that is loaded once with it
+        meta = classify_fits(path, drps)
+        if meta['type'] is not None:
+            return metadata_product(path, meta['type'], meta['instrument'], drps)
+        return metadata_fits(path, drps)
+
+    def classify(self, path, drps):
+        return classify_fits(path, drps)
+
+
+class JsonExtractor(Extractor):
+    name = 'json'
+    suffixes = ('.json',)
+
+    def extract(self, path, drps):
+        return metadata_json(path)
+
+
+class LisExtractor(Extractor):
+    name = 'lis'
+    suffixes = ('.lis',)
+
+    def extract(self, path, drps):
+        return metadata_lis(path, drps)
+
+
+class ExtractorRegistry(object):
+    """Extractors, by name"""
+
+    def __init__(self):
+        self.extractors = {}
+        self.loaded = False
+
+    def register(self, extractor):
+        if isinstance(extractor, type):
+            extractor = extractor()
+        self.extractors[extractor.name] = extractor
+        return extractor
+
+    def load_entry_points(self):
+        """Register the extractors of the entry points, once"""
+        if self.loaded:
+            return
+        self.loaded = True
+        for entry in importlib.metadata.entry_points(group=ENTRY_POINT_GROUP):
+            try:
+                extractor = self.register(entry.load())
+            except Exception:
+                _logger.warning('unable to load extractor %s', entry.name, exc_info=True)
+            else:
+                _logger.debug('extractor %s from %s', extractor.name, entry.value)
+
+    def find(self, path):
+        """The extractor for the file in path, or None"""
+        self.load_entry_points()
+        lname = path.lower()
+        # the longest suffix first, .fits.gz before .gz
+        best = None
+        for extractor in self.extractors.values():
+            for suffix in extractor.suffixes:
+                if lname.endswith(suffix) and (best is None or len(suffix) > best[0]):
+                    best = (len(suffix), extractor)
+        if best is not None:
+            return best[1]
+
+        try:
+            with open(path, 'rb') as fd:
+                head = fd.read(SNIFF_SIZE)
+        except OSError:
+            return None
+        for extractor in self.extractors.values():
+            try:
+                if extractor.sniff(path, head):
+                    return extractor
+            except (OSError, EOFError):
+                pass
+        return None
+
+
+registry = ExtractorRegistry()
+for _extractor in [FitsExtractor, JsonExtractor, LisExtractor]:
+    registry.register(_extractor)
+
+
+def register_extractor(extractor):
+    """Register an extractor, class or instance"""
+    return registry.register(extractor)
+
+
+def find_extractor(path):
+    """The extractor for the file in path, or None"""
+    return registry.find(path)
@@ -21,33 +21,80 @@
 
 from __future__ import print_function
 
+import concurrent.futures
+import copy
 import os
-import json
+import warnings
 
+from astropy.io import fits
 import numina.user.helpers
 import numina.types.qc
-from numina.types.product import DataProductTag
+from numina.types.product import DataProductMixin
 from numina.util.jsonencoder import ExtEncoder
 
-from .model import DataProduct, ReductionResult, ReductionResultValue
+from .model import DataProduct, ProductFact, ReductionResult, ReductionResultValue
+from .jsonio import dump_json
+from .timing import TaskTimer
+from .profiler import sql_scope
 
 
-def store_to(result, where):
+# Default number of threads dumping products
+STORE_WORKERS = 4
+
+
+def store_to(result, where, workers=None, compress=False):
+    """Serialize the products of result.
+
+    Products are dumped concurrently by a pool of `workers` threads,
+    each dump with its own copy of `where`. The returned mapping follows
+    the order of ``result.stored()``. If `compress` is True, the FITS
+    images in memory are written gzip-compressed, see dump_fits_gz.
+    """
     import numina.store
     print('calling my store_to')
-    saveres = {}
-    for key, prod in result.stored().items():
-        val = getattr(result, key)
 
-        where.destination = prod.dest
-        saveres[key] = numina.store.dump(prod.type, val, where)
+    if workers is None:
+        workers = STORE_WORKERS
+
+    def dump_product(key, prod):
+        val = getattr(result, key)
+        if compress:
+            saved = dump_fits_gz(val, prod.dest)
+            if saved is not None:
+                return saved
+        this_where = copy.copy(where)
+        this_where.destination = prod.dest
+        return numina.store.dump(prod.type, val, this_where)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(key, executor.submit(dump_product, key, prod)) for key, prod in result.stored().items()]
+        saveres = {key: future.result() for key, future in futures}
 
     return saveres
 
 
+def dump_fits_gz(value, destination):
+    """Write a FITS image in memory compressed with gzip, return the file name.
+
+    The file is compressed while it is written. Gzip keeps the image in
+    the primary HDU, where recipes read it, unlike tile compression
+    (.fits.fz). Returns None if value is not an image in memory.
+    """
+    frame = getattr(value, 'frame', None)
+    if not isinstance(frame, fits.HDUList) or getattr(value, 'filename', None):
+        return None
+
+    filename = destination + '.fits.gz'
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        frame.writeto(filename, overwrite=True, output_verify='warn')
+    return filename
+
+
 class ProcessingTask(numina.user.helpers.ProcessingTask):
-    def __init__(self, session, obsres=None, runinfo=None):
+    def __init__(self, session, obsres=None, runinfo=None, timer=None):
         self.session = session
+        self.timer = TaskTimer() if timer is None else timer
         super(ProcessingTask, self).__init__(obsres, runinfo)
 
     def store(self, where):
@@ -55,17 +102,26 @@ class ProcessingTask(numina.user.helpers.ProcessingTask):
         # save to disk the RecipeResult part and return the file to save it
         # saveres = self.result.store_to(where)
 
-        saveres = store_to(self.result, where)
+        with self.timer.span('store_to'):
+            saveres = store_to(self.result, where,
+                               workers=self.runinfo.get('store_workers'),
+                               compress=self.runinfo.get('compress_fits', False)
+                               )
 
-        self.post_result_store(self.result, saveres)
+        with self.timer.span('post_result_store'), sql_scope('post_result_store'):
+            self.post_result_store(self.result, saveres)
 
-        with open(where.result, 'w+') as fd:
-            json.dump(saveres, fd, indent=2, cls=ExtEncoder)
+        compact = self.runinfo.get('compact_json', False)
 
+        with self.timer.span('write_json'):
+            dump_json(saveres, where.result, compact=compact, cls=ExtEncoder)
+
+        # The observation goes last, so that 'result' and 'runinfo'
+        # can be read without decoding it, see jsonio.load_json_member
         out = {}
-        out['observation'] = self.observation
         out['result'] = where.result
         out['runinfo'] = self.runinfo
+        out['observation'] = self.observation
 
         logfile = 'processing.log'
         relpathdir = os.path.relpath(self.runinfo['results_dir'], self.runinfo['base_dir'])
@@ -74,34 +130,36 @@ class ProcessingTask(numina.user.helpers.ProcessingTask):
         full_task = os.path.join(relpathdir, where.task)
         full_result = os.path.join(relpathdir, where.result)
 
-        with open(where.task, 'w+') as fd:
-            json.dump(out, fd, indent=2, cls=ExtEncoder)
+        with self.timer.span('write_json'):
+            dump_json(out, where.task, compact=compact, cls=ExtEncoder)
 
         result = {'logs': full_logfile, 'task': full_task, 'result': full_result}
 
         return result
 
     def post_result_store(self, result, saveres):
-        session = self.session
+        """Register the result and its products in the database.
 
-        result_db = ReductionResult()
+        All the rows are built in memory and flushed together,
+        the transaction is committed by the caller with the task state.
+        """
+        session = self.session
 
-        # print(self.runinfo)
-        # print(self.observation)
-        result_db.instrument_id = self.observation['instrument']
+        instrument = self.observation['instrument']
+        instrument_id = getattr(instrument, 'name', instrument)
 
+        result_db = ReductionResult()
+        result_db.instrument_id = instrument_id
         result_db.pipeline = self.runinfo['pipeline']
         result_db.obsmode = self.observation['mode']
         result_db.recipe = self.runinfo['recipe_full_name']
-
-        # datatype = Column(String(45))
         result_db.task_id = self.runinfo['taskid']
-        result_db.ob_id = self.observation['observing_result']
-        # dateobs = Column(DateTime)
+        result_db.ob_id = self.observation.get('observing_result')
+        result_db.input_key = self.runinfo.get('input_key')
         if hasattr(result, 'qc'):
             result_db.qc = result.qc
 
-        session.add(result_db)
+        products = []
         for key, prod in result.stored().items():
             if prod.dest != 'qc':
 
@@ -113,72 +171,37 @@ class ProcessingTask(numina.user.helpers.ProcessingTask):
                 val.contents = relpath
                 result_db.values.append(val)
 
-                if isinstance(prod.type, DataProductTag):
+                if isinstance(prod.type, DataProductMixin):
                     product = DataProduct(datatype=prod.type.name(),
                                           task_id=self.runinfo['taskid'],
-                                          instrument_id=self.observation['instrument'],
-                                          contents=relpath
+                                          instrument_id=instrument_id,
+                                          contents=relpath,
+                                          pipeline=self.runinfo['pipeline']
                                           )
                     product.result_value = val
-                    internal_value = getattr(result, key)
-                    meta_info = internal_value.meta
+                    meta_info = product_meta_info(prod.type, getattr(result, key), fullpath)
                     product.dateobs = meta_info['observation_date']
                     product.uuid = meta_info['uuid']
                     product.qc = meta_info['quality_control']
-                    master_tags = meta_info['tags']
-                    for k, v in master_tags.items():
-                        product[k] = v
-
-                    session.add(product)
-
-        session.commit()
-
-    def pre_result_store(self, result, saveres):
-        session = self.session
-
-        result_db = ReductionResult()
-        result_db.instrument_id = self.observation['instrument'].name
-        result_db.pipeline = self.runinfo['pipeline']
-        result_db.obsmode = self.observation['mode']
-        result_db.recipe = self.runinfo['recipe_full_name']
-        result_db.task_id = self.runinfo['taskid']
-        # dateobs = Column(DateTime)
-        if hasattr(result, 'qc'):
-            result_db.qc = result.qc
+                    # Facts are created directly, not through the association proxy
+                    product.facts = {k: ProductFact(key=k, value=v) for k, v in meta_info['tags'].items()}
+                    products.append(product)
 
         session.add(result_db)
+        session.add_all(products)
+        session.flush()
+        return result_db
 
-        for key, prod in result.stored().items():
-            if prod.dest != 'qc':
-
-                val = ReductionResultValue()
-                fullpath = os.path.join(self.runinfo['results_dir'], saveres[prod.dest])
-                relpath = os.path.relpath(fullpath, self.runinfo['base_dir'])
-                val.name = prod.dest
-                val.datatype = prod.type.name()
-                val.contents = relpath
-                result_db.values.append(val)
-
-                if isinstance(prod.type, DataProductTag):
-                    product = DataProduct(datatype=prod.type.name(),
-                                          task_id=self.runinfo['taskid'],
-                                          instrument_id=self.observation['instrument'],
-                                          contents=relpath
-                                          )
-                    product.result_value = val
-                    internal_value = getattr(result, key)
-                    print('extract meta info', prod.type, fullpath, internal_value)
-                    meta_info = prod.type.extract_db_info(fullpath)
-                    product.dateobs = meta_info['observation_date']
-                    product.uuid = meta_info['uuid']
-                    product.qc = meta_info['quality_control']
-                    master_tags = meta_info['tags']
-                    for k, v in master_tags.items():
-                        product[k] = v
+    def pre_result_store(self, result, saveres):
+        return self.post_result_store(result, saveres)
 
-                    session.add(product)
 
-        session.commit()
+def product_meta_info(datatype, value, fullpath):
+    """Metadata of a product, from memory if the value carries it"""
+    meta_info = getattr(value, 'meta', None)
+    if meta_info is None:
+        meta_info = datatype.extract_db_info(fullpath)
+    return meta_info
 
 
 def build_mdir(taskid, obsid):
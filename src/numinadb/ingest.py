@@ -21,78 +21,50 @@
 
 from __future__ import print_function
 
-import uuid
+import collections
+import concurrent.futures
 import datetime
+import hashlib
+import json
+import logging
 import os.path
+import uuid
 
 import yaml
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import selectinload
 from numina.core.oresult import ObservationResult
-from numina.types.frame import DataFrameType
-from numina.types.linescatalog import LinesCatalog
-from numina.types.structured import BaseStructuredCalibration
 from numina.util.context import working_directory
 import numina.store
 import numina.drps
 
-from .model import RecipeParameters, RecipeParameterValues
-from .model import ObservingBlockAlias
+from .model import RecipeParameters, RecipeParameterValues, ParameterFact, ControlFile
+from .model import ObservingBlockAlias, Instrument
 from .model import ObservingBlock, Frame, Fact, DataProduct
-from .event import call_event
-
-
-base_db_info_keys = [
-    'instrument',
-    'object',
-    'observation_date',
-    'uuid',
-    'type',
-    'mode',
-    'exptime',
-    'darktime',
-    'insconf',
-    'blckuuid',
-    'quality_control'
-]
-
-
-def metadata_fits(obj, drps):
-
-    # First. get instrument
-    objl = DataFrameType().convert(obj)
+from .event import call_event, flush_events
+from .paramindex import rebuild_parameter_index, canonical_tags
+from .records import FrameRecord, ProductRecord
+from .extractors import metadata_fits, metadata_json, metadata_lis, classify_fits  # noqa: F401
+from .extractors import metadata_product
+from .extractors import find_extractor
 
-    with objl.open() as hdulist:
-        # get instrument
-        instrument_id = hdulist[0].header['INSTRUME']
 
-    this_drp = drps.query_by_name(instrument_id)
+_logger = logging.getLogger(__name__)
 
-    datamodel = this_drp.datamodel
-    keys = datamodel.db_info_keys
-    result = DataFrameType(datamodel=datamodel).extract_db_info(obj, keys)
-    return result
 
+def add_instruments(session, names):
+    """Insert the instruments in `names` that are not in the database.
 
-def metadata_lis(obj):
-    """Extract metadata from serialized file"""
-    result = LinesCatalog().extract_db_info(obj, base_db_info_keys)
-
-    head, tail = os.path.split(obj)
-    base, ext = os.path.splitext(tail)
-    tags = base.split('_')
-    result['instrument'] = 'MEGARA'
-    result['tags'] = {
-        u'vph': tags[0].decode('utf-8'),
-        u'speclamp': tags[1].decode('utf-8')
-    }
-
-    return result
-
-
-def metadata_json(obj):
-    """Extract metadata from serialized file"""
-
-    result = BaseStructuredCalibration().extract_meta_info(obj)
-    return result
+    They are flushed, so the rows referencing them can be inserted.
+    """
+    names = set(names)
+    if not names:
+        return
+    existing = set(session.scalars(select(Instrument.name).where(Instrument.name.in_(names))))
+    missing = names - existing
+    if missing:
+        session.add_all(Instrument(name=name) for name in sorted(missing))
+        session.flush()
 
 
 def add_ob_facts(session, ob, datadir):
@@ -116,40 +88,77 @@ def add_ob_facts(session, ob, datadir):
             ob.facts.append(fact)
 
 
+def control_file_checksum(data):
+    """Checksum of the contents of a task-control file, independent of formatting"""
+    canonical = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
 def ingest_control_file(session, path):
 
     print('insert task-control values from', path)
 
     with open(path) as fd:
-        data = yaml.load(fd)
+        data = yaml.safe_load(fd)
 
-    res = data.get('requirements', {})
+    checksum = control_file_checksum(data)
+    if session.query(ControlFile.id).filter_by(checksum=checksum).first() is not None:
+        print('control file already ingested, checksum', checksum)
+        return
+
+    session.add(ControlFile(checksum=checksum, path=path))
 
+    res = data.get('requirements', {})
+    add_instruments(session, res)
+
+    # All the existing parameters of the instruments in the file, in one query
+    query = session.query(RecipeParameters).filter(RecipeParameters.instrument_id.in_(list(res)))
+    dbpars = {(par.instrument_id, par.pipeline, par.mode, par.name): par for par in query}
+    # Their values, by parameter and tag set; a tag set has one value
+    query = session.query(RecipeParameterValues).join(RecipeParameterValues.parameter).filter(
+        RecipeParameters.instrument_id.in_(list(res))
+    ).options(selectinload(RecipeParameterValues.facts))
+    dbvals = {}
+    for value in query:
+        par = value.parameter
+        tags = {k: fact.value for k, fact in value.facts.items()}
+        dbvals[(par.instrument_id, par.pipeline, par.mode, par.name, canonical_tags(tags))] = value
+
+    newpars = []
+    newvals = []
     for ins, data1 in res.items():
         for plp, modes in data1.items():
             for mode, params in modes.items():
                 for param in params:
-                    dbpar = session.query(RecipeParameters).filter_by(
-                        instrument_id=ins,
-                        pipeline=plp,
-                        mode=mode,
-                        name=param['name']).first()
+                    key = (ins, plp, mode, param['name'])
+                    dbpar = dbpars.get(key)
                     if dbpar is None:
-                        newpar = RecipeParameters()
-                        newpar.id = None
-                        newpar.instrument_id = ins
-                        newpar.pipeline = plp
-                        newpar.mode = mode
-                        newpar.name = param['name']
-                        dbpar = newpar
-                        session.add(dbpar)
-
-                    newval = RecipeParameterValues()
-                    newval.content = param['content']
-                    dbpar.values.append(newval)
-
-                    for k, v in param['tags'].items():
-                        newval[k] = v
+                        dbpar = RecipeParameters(instrument_id=ins, pipeline=plp,
+                                                 mode=mode, name=param['name'])
+                        dbpars[key] = dbpar
+                        newpars.append(dbpar)
+
+                    vkey = key + (canonical_tags(param['tags']),)
+                    dbval = dbvals.get(vkey)
+                    if dbval is not None:
+                        # a changed value replaces the previous one, an equal value is kept
+                        if dbval.content != param['content']:
+                            dbval.content = param['content']
+                        continue
+
+                    newval = RecipeParameterValues(content=param['content'])
+                    # Assigning the many-to-one side does not load dbpar.values
+                    newval.parameter = dbpar
+                    # Facts are created directly, not through the association proxy
+                    newval.facts = {k: ParameterFact(key=k, value=v) for k, v in param['tags'].items()}
+                    dbvals[vkey] = newval
+                    newvals.append(newval)
+
+    session.add_all(newpars)
+    session.add_all(newvals)
+    # the database assigns the keys, inserting each table in batches
+    session.flush()
+    rebuild_parameter_index(session, res.keys())
     session.commit()
 
 
@@ -182,6 +191,7 @@ def ingest_ob_file(session, path):
         obs_blocks1[ob_id] = ob
         # ignore frames for the moment
 
+    add_instruments(session, [obs.instrument for obs in obs_blocks1.values()])
     obs_blocks2 = {}
     for key, obs in obs_blocks1.items():
         now = datetime.datetime.now()
@@ -202,26 +212,17 @@ def ingest_ob_file(session, path):
             result = metadata_fits(full_fname, drps)
             # numtype = result['type']
             # blck_uuid = obs.uuid # result.get('blckuuid', obs.uuid)
-            result['path'] = fname
-            meta_frames.append(result)
+            meta_frames.append(FrameRecord.from_metadata(result, fname))
 
         for meta in meta_frames:
             # Insert into DB
-            newframe = Frame()
-            newframe.name = meta['path']
-            newframe.uuid = meta['uuid']
-            newframe.start_time = meta['observation_date']
-            # No way of knowing when the readout ends...
-            newframe.completion_time = newframe.start_time + datetime.timedelta(seconds=meta['darktime'])
-            newframe.exposure_time = meta['exptime']
-            newframe.object = meta['object']
-            ob.frames.append(newframe)
+            ob.frames.append(frame_from_record(meta))
 
         # set start/completion time from frames
         if ob.frames:
-            ob.object = meta_frames[0]['object']
-            ob.start_time = ob.frames[0].start_time
-            ob.completion_time = ob.frames[-1].completion_time
+            ob.object = meta_frames[0].object
+            ob.start_time = min(frame.start_time for frame in ob.frames)
+            ob.completion_time = max(frame.completion_time for frame in ob.frames)
 
         # Facts
         # add_ob_facts(session, ob, ingestdir)
@@ -243,196 +244,482 @@ def ingest_ob_file(session, path):
                 child = obs_blocks2[cid]
                 parent.children.append(child)
 
-    print('stage4')
-    for key, obs in obs_blocks2.items():
-        if obs.object is None:
-            o1, s1, c1 = complete_recursive_first(obs)
-            o2, s2, c2 = complete_recursive_last(obs)
-            obs.object = o1
-            obs.start_time = s1
-            obs.completion_time = c2
+    # times and object of the composite OBs, from their children
+    session.flush()
+    update_ancestors(session, list(obs_blocks2.values()))
 
     session.commit()
 
 
-def complete_recursive_first(node):
-    return complete_recursive_idx(node, 0)
-
-
-def complete_recursive_last(node):
-    return complete_recursive_idx(node, -1)
+def update_ancestors(session, obs):
+    """Set the time range and object of the ancestors of the OBs from their descendants.
+
+    `obs` are OBs or OB ids. All the ancestors are updated in one statement:
+    the start time is the earliest start of their descendants, the
+    completion time the latest completion, and the object that of the
+    first descendant. Descendants without object are ignored.
+    """
+    ob_ids = [getattr(ob, 'id', ob) for ob in obs]
+    if not ob_ids:
+        return
+
+    table = ObservingBlock.__table__
+
+    # ancestors of the OBs, up to the root
+    ancestors = select(table.c.parent_id.label('id')).where(
+        table.c.id.in_(ob_ids), table.c.parent_id.is_not(None)
+    ).cte('ancestors', recursive=True)
+    parent = table.alias('parent')
+    ancestors = ancestors.union(
+        select(parent.c.parent_id).join(ancestors, parent.c.id == ancestors.c.id).where(
+            parent.c.parent_id.is_not(None)
+        )
+    )
+
+    # (ancestor, descendant) pairs
+    descendants = select(ancestors.c.id.label('root'), ancestors.c.id.label('id')).cte(
+        'descendants', recursive=True
+    )
+    child = table.alias('child')
+    descendants = descendants.union_all(
+        select(descendants.c.root, child.c.id).join(descendants, child.c.parent_id == descendants.c.id)
+    )
+
+    # descendants not being recomputed, with a known object
+    node = table.alias('node')
+
+    def rollup(column):
+        return select(column).select_from(descendants.join(node, node.c.id == descendants.c.id)).where(
+            descendants.c.root == table.c.id,
+            descendants.c.id.not_in(select(ancestors.c.id)),
+            node.c.object.is_not(None)
+        )
 
+    stmt = update(table).where(table.c.id.in_(select(ancestors.c.id))).values(
+        start_time=rollup(func.min(node.c.start_time)).scalar_subquery(),
+        completion_time=rollup(func.max(node.c.completion_time)).scalar_subquery(),
+        object=rollup(node.c.object).order_by(node.c.start_time).limit(1).scalar_subquery()
+    )
+    session.execute(stmt, execution_options={'synchronize_session': False})
+    # the attributes of the OBs in the session are stale
+    session.expire_all()
+
+
+# Records kept in memory before writing them to the database
+INGEST_BATCH_SIZE = 1000
+
+
+class IngestPipeline(object):
+    """Write frames and products to the database in batches.
+
+    Records are added as they are found and written, in one transaction,
+    each time `batch_size` records are pending. The frames of an OB written
+    in a previous batch are appended to it, so only the pending records
+    and the ids of the OBs created are kept in memory.
+
+    The metadata extracted from a frame, if given to `add_frame`, is
+    passed to the on_ingest_raw_fits handlers when the frame is written.
+    Otherwise they receive the metadata of the record, DB_FRAME_KEYS.
+
+    With `update_obs`, as in continuous ingestion, new frames of OBs
+    already in the database are appended to them, and the facts of the
+    OBs receiving frames are computed again.
+
+    With `deferred`, the frames added without metadata are completed
+    later by enrich_frames: the uuids of those written are collected in
+    `written_frames`, and on_ingest_raw_fits is emitted by enrich_frames.
+    """
+
+    def __init__(self, session, drps, ingestdir, batch_size=INGEST_BATCH_SIZE, deferred=False, update_obs=False):
+        self.session = session
+        self.drps = drps
+        self.ingestdir = ingestdir
+        self.batch_size = batch_size
+        self.frames = {}
+        # metadata of the pending frames, for the handlers
+        self.frame_meta = {}
+        self.products = {}
+        # OBs created by this ingestion, they can receive more frames
+        self.created_obs = set()
+        self.deferred = deferred
+        self.update_obs = update_obs
+        self.written_frames = []
+
+    def pending(self):
+        return len(self.frames) + len(self.products)
+
+    def add_frame(self, record, meta=None):
+        if record.uuid not in self.frames:
+            self.frames[record.uuid] = record
+            if meta is not None:
+                self.frame_meta[record.uuid] = meta
+        self.check()
+
+    def add_product(self, key, record):
+        self.products[key] = record
+        self.check()
+
+    def discard(self):
+        """Drop the pending records, i.e. after a failed transaction"""
+        self.frames.clear()
+        self.frame_meta.clear()
+        self.products.clear()
+
+    def check(self):
+        if self.pending() >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending records, in one transaction per kind"""
+        if self.products:
+            self.flush_products()
+        if self.frames:
+            self.flush_frames()
+
+    def flush_products(self):
+        session = self.session
+        records, self.products = self.products, {}
+
+        print('processing reduction_results')
+        new_products = []
+        for record in records.values():
+            if record.recheck:
+                print('recheck metadata')
+                record = recheck_metadata(record, self.drps)
+                if record is None:
+                    continue
+            new_products.append(record)
+
+        # check if they are already inserted, in one query
+        uuids = [record.uuid for record in new_products]
+        existing = set(session.scalars(select(DataProduct.uuid).where(DataProduct.uuid.in_(uuids))))
+
+        add_instruments(session, [record.instrument for record in new_products if record.uuid not in existing])
+        entries = []
+        for record in new_products:
+            if record.uuid in existing:
+                print('this product is already inserted', record.uuid)
+                continue
+            existing.add(record.uuid)
+            print('processing', record.path)
+            prod_entry = DataProduct(instrument_id=record.instrument,
+                                     datatype=record.datatype,
+                                     task_id=None,
+                                     contents=record.path
+                                     )
+            prod_entry.dateobs = record.observation_date
+            prod_entry.uuid = record.uuid
+            prod_entry.qc = record.quality_control
+            for k, v in record.tags.items():
+                prod_entry[k] = v
+            session.add(prod_entry)
+            entries.append(prod_entry)
+
+        session.flush()
+        product_ids = [prod.id for prod in entries]
+        session.commit()
+        if product_ids:
+            call_event('on_products_registered', session, product_ids)
+        flush_events()
+
+    def flush_frames(self):
+        session = self.session
+        records, self.frames = self.frames, {}
+        metas, self.frame_meta = self.frame_meta, {}
+
+        print('processing observing blocks')
+        by_ob = {}
+        for record in records.values():
+            by_ob.setdefault(record.blckuuid, []).append(record)
+
+        ob_ids = list(by_ob)
+        existing = {ob.id: ob for ob in session.scalars(select(ObservingBlock).where(ObservingBlock.id.in_(ob_ids)))}
+        known_frames = set(session.scalars(select(Frame.uuid).where(Frame.uuid.in_(list(records)))))
+
+        add_instruments(session, [frames[0].instrument for ob_id, frames in by_ob.items() if ob_id not in existing])
+        new_obs = []
+        updated_obs = []
+        new_frames = []
+        for ob_id, frames in by_ob.items():
+            frames = [record for record in frames if record.uuid not in known_frames]
+            if not frames:
+                continue
+            ob = existing.get(ob_id)
+            if ob is None:
+                first = frames[0]
+                ob = ObservingBlock(id=ob_id, instrument_id=first.instrument, mode=first.mode)
+                session.add(ob)
+                self.created_obs.add(ob_id)
+                new_obs.append(ob)
+            elif ob_id not in self.created_obs and not self.update_obs:
+                print('OB already inserted', ob_id)
+                continue
+            else:
+                updated_obs.append(ob)
+
+            for record in frames:
+                newframe = frame_from_record(record)
+                newframe.ob = ob
+                session.add(newframe)
+                new_frames.append(newframe)
+                meta = metas.get(record.uuid)
+                if meta is not None:
+                    call_event('on_ingest_raw_fits', session, record.uuid, meta)
+                elif self.deferred:
+                    self.written_frames.append(record.uuid)
+                else:
+                    call_event('on_ingest_raw_fits', session, record.uuid, record.metadata())
+                ob.object = record.object
+                if newframe.start_time is not None:
+                    if ob.start_time is None or newframe.start_time < ob.start_time:
+                        ob.start_time = newframe.start_time
+                if newframe.completion_time is not None:
+                    if ob.completion_time is None or newframe.completion_time > ob.completion_time:
+                        ob.completion_time = newframe.completion_time
 
-def complete_recursive_idx(node, idx):
-    if node.object is None:
-        if node.children:
-            value = complete_recursive_idx(node.children[idx], idx)
-            if value is not None:
-                return value
-        else:
+        # Facts
+        for ob in new_obs:
+            add_ob_facts(session, ob, self.ingestdir)
+        if self.update_obs:
+            # the tags may depend on the new frames
+            for ob in updated_obs:
+                ob.facts.clear()
+                add_ob_facts(session, ob, self.ingestdir)
+        flush_events()
+
+        session.flush()
+        ob_ids = [ob.id for ob in new_obs]
+        frame_ids = [frame.id for frame in new_frames]
+        # the composite OBs containing these ones
+        update_ancestors(session, list(by_ob))
+        session.commit()
+        if frame_ids:
+            call_event('on_ingest_batch_committed', session, ob_ids, frame_ids)
+        flush_events()
+
+
+def frame_from_record(record):
+    """Create a Frame from a FrameRecord"""
+    return Frame(
+        name=record.path,
+        uuid=record.uuid,
+        start_time=record.observation_date,
+        completion_time=record.completion_time,
+        exposure_time=record.exptime,
+        object=record.object
+    )
+
+
+# Threads extracting the full metadata in two-phase ingestion
+INGEST_WORKERS = 4
+
+
+def recheck_product(record, drps):
+    """Extract the metadata of a product, loading it with its type"""
+    meta = metadata_product(record.path, record.datatype, record.instrument, drps)
+    return ProductRecord.from_metadata(record.datatype, meta, record.path)
+
+
+def enrich_frames(session, paths, drps, workers=INGEST_WORKERS, batch_size=INGEST_BATCH_SIZE):
+    """Complete the metadata of frames registered by their header.
+
+    The metadata of the files in `paths` is extracted in `workers`
+    threads, and the frames and their OBs are updated every
+    `batch_size` files. on_ingest_raw_fits is emitted with the
+    metadata of each file. Returns the number of frames updated.
+    """
+    # a Core UPDATE, executed once with all the rows of a batch
+    frames = Frame.__table__
+    stmt = update(frames).where(frames.c.uuid == bindparam('b_uuid')).values(
+        start_time=bindparam('b_start_time'),
+        completion_time=bindparam('b_completion_time'),
+        exposure_time=bindparam('b_exposure_time'),
+        object=bindparam('b_object')
+    )
+
+    last_completion = select(func.max(Frame.completion_time)).where(
+        Frame.ob_id == ObservingBlock.id
+    ).scalar_subquery()
+
+    def extract(path):
+        try:
+            meta = metadata_fits(path, drps)
+            return FrameRecord.from_metadata(meta, os.path.basename(path)), meta
+        except Exception:
+            _logger.warning('unable to extract the metadata of %s, frame not updated', path, exc_info=True)
             return None
-    else:
-        return (node.object, node.start_time, node.completion_time)
-
 
-def ingest_dir(session, ingestdir):
-
-    drps = numina.drps.get_system_drps()
+    count = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(paths), batch_size):
+            extracted = [item for item in executor.map(extract, paths[start:start + batch_size]) if item is not None]
+            if not extracted:
+                continue
+            records = [record for record, meta in extracted]
+            params = [
+                dict(b_uuid=record.uuid, b_start_time=record.observation_date,
+                     b_completion_time=record.completion_time, b_exposure_time=record.exptime,
+                     b_object=record.object)
+                for record in records
+            ]
+            session.execute(stmt, params)
+            ob_ids = {record.blckuuid for record in records}
+            session.execute(
+                update(ObservingBlock).where(ObservingBlock.id.in_(ob_ids)).values(
+                    completion_time=last_completion
+                ).execution_options(synchronize_session=False)
+            )
+            update_ancestors(session, ob_ids)
+            for record, meta in extracted:
+                call_event('on_ingest_raw_fits', session, record.uuid, meta)
+            flush_events()
+            session.commit()
+            count += len(records)
+    return count
+
+
+def ingest_dir(session, ingestdir, batch_size=INGEST_BATCH_SIZE, two_phase=False, workers=INGEST_WORKERS,
+               drps=None):
+    """Ingest the files under ingestdir.
+
+    With `two_phase`, FITS files are first classified by their primary
+    header: raw frames are registered and committed, so that they can be
+    queried at once, and calibrations are queued. Then the full metadata of
+    the frames and calibrations is extracted in `workers` threads.
+    Returns the IngestPipeline used.
+    """
+
+    if drps is None:
+        drps = numina.drps.get_system_drps()
     # insert OB in database
 
     print("mode ingest dir, path=", ingestdir)
-
-    obs_blocks = {}
-    raw_frames = {}
-    reduction_results = {}
-
-    for x in os.walk(ingestdir):
-        dirname, dirnames, files = x
-        # print('we are in', dirname)
-        # print('dirnames are', dirnames)
-        for fname in files:
-            # check based on extension
-            base, ext = os.path.splitext(fname)
-            full_fname = os.path.join(dirname, fname)
-            if ext == '.fits':
-                # something
-                print("file processed as FITS", full_fname)
-                result = metadata_fits(full_fname, drps)
-
-                # numtype
-                numtype = result['type']
-                blck_uuid = result.get('blckuuid')
-                if numtype is not None:
-                    # a calibration
-                    print("a calibration of type", numtype)
-                    reduction_uuid = result['uuid']
-                    print("a calibration of type {}, uuid {}".format(numtype, reduction_uuid))
-                    reduction_results[full_fname] = (numtype, full_fname, result, True)
-                    continue
+    if two_phase:
+        return ingest_dir_two_phase(session, ingestdir, drps, batch_size=batch_size, workers=workers)
+
+    pipeline = IngestPipeline(session, drps, ingestdir, batch_size=batch_size)
+
+    # header-only extractors run here, the others in the workers;
+    # results are added in order, with at most 2 * workers pending
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for dirname, dirnames, files in os.walk(ingestdir):
+            for fname in files:
+                full_fname = os.path.join(dirname, fname)
+                extractor = find_extractor(full_fname)
+                if extractor is None:
+                    print("file not ingested", fname)
+                elif extractor.header_only:
+                    add_metadata(pipeline, extractor, full_fname, extract_metadata(extractor, full_fname, drps))
                 else:
-                    print('raw data')
-                if blck_uuid is not None:
-                    if blck_uuid not in obs_blocks:
-                        print('added new OB', blck_uuid)
-                        # new block, insert
-                        ob = ObservationResult(
-                            instrument=result['instrument'],
-                            mode=result['mode']
-                        )
-                        ob.id = blck_uuid
-                        ob.configuration = result['insconf']
-
-                        obs_blocks[blck_uuid] = ob
-
-                    uuid_frame = result['uuid']
-                    if uuid_frame not in raw_frames:
-                        result['path'] = fname
-                        raw_frames[uuid_frame] = result
-                        obs_blocks[blck_uuid].frames.append(result)
-
-            elif ext == '.json':
-                print("file ingested as JSON", fname)
-                result = metadata_json(full_fname)
-                numtype = result['type']
-                print(full_fname, "a calibration of type", numtype)
-                reduction_uuid = result['uuid']
-                reduction_results[reduction_uuid] = (numtype, full_fname, result, False)
-            elif ext == '.lis':
-                result = metadata_lis(full_fname)
-                numtype = result['type']
-                print(full_fname, "a calibration of type", numtype)
-                reduction_uuid = result['uuid']
-                reduction_results[reduction_uuid] = (numtype, full_fname, result, False)
-            else:
-                print("file not ingested", fname)
-
-    # insert OB in database
-    print('processing reduction_results')
-    for key, prod in reduction_results.items():
-
-        datatype = prod[0]
-        contents = prod[1]
-        metadata_basic = prod[2]
-        recheck = prod[3]
-        fullpath = contents
-        relpath = fullpath  # os.path.relpath(fullpath, self.runinfo['base_dir'])
-        print('processing', relpath)
-        prod_entry = DataProduct(instrument_id=metadata_basic['instrument'],
-                                 datatype=datatype,
-                                 task_id=0,
-                                 contents=relpath
-                                 )
-
-        if recheck:
-            print('recheck metadata')
-            this_drp = drps.query_by_name(prod_entry.instrument_id)
-            pipeline = this_drp.pipelines['default']
-            db_info_keys = this_drp.datamodel.db_info_keys
-            prodtype = pipeline.load_product_from_name(prod_entry.datatype)
-            # reread with correct type
-            obj = numina.store.load(prodtype, prod_entry.contents)
-            # extend metadata
-            metadata_basic = prodtype.extract_db_info(obj, db_info_keys)
-
-        # check if is already inserted
-        res = session.query(DataProduct).filter_by(uuid=metadata_basic['uuid']).first()
-
-        if res is not None:
-            print('this product is already inserted', metadata_basic['uuid'])
-            continue
-
-        prod_entry.dateobs = metadata_basic['observation_date']
-        prod_entry.uuid = metadata_basic['uuid']
-        prod_entry.qc = metadata_basic['quality_control']
-        session.add(prod_entry)
-
-        print('compute tags')
-        for k, v in metadata_basic['tags'].items():
-            prod_entry[k] = v
-
-    session.commit()
+                    future = executor.submit(extract_metadata, extractor, full_fname, drps)
+                    pending.append((extractor, full_fname, future))
+                while pending and (len(pending) > 2 * workers or pending[0][2].done()):
+                    extractor, path, future = pending.popleft()
+                    add_metadata(pipeline, extractor, path, future.result())
+        for extractor, path, future in pending:
+            add_metadata(pipeline, extractor, path, future.result())
+
+    pipeline.flush()
+    return pipeline
+
+
+def extract_metadata(extractor, full_fname, drps):
+    """The metadata of a file, or None if it can not be extracted"""
+    try:
+        return extractor.extract(full_fname, drps)
+    except Exception:
+        _logger.warning('unable to extract the metadata of %s, file not ingested', full_fname, exc_info=True)
+        return None
+
+
+def classify_metadata(extractor, full_fname, drps):
+    """The header classification of a file, or False if it fails"""
+    try:
+        return extractor.classify(full_fname, drps)
+    except Exception:
+        _logger.warning('unable to classify %s, file not ingested', full_fname, exc_info=True)
+        return False
+
+
+def recheck_metadata(record, drps):
+    """The metadata of a product loaded with its type, or None if it fails"""
+    try:
+        return recheck_product(record, drps)
+    except Exception:
+        _logger.warning('unable to load the product %s, file not ingested', record.path, exc_info=True)
+        return None
+
+
+def add_metadata(pipeline, extractor, full_fname, result):
+    """Add the metadata of a file to the pipeline, as a product or a frame"""
+    if result is None:
+        return
+    numtype = result.get('type')
+    if numtype is not None:
+        # a calibration
+        print("{} a calibration of type {}, uuid {}".format(full_fname, numtype, result.get('uuid')))
+        record = ProductRecord.from_metadata(numtype, result, full_fname, recheck=extractor.recheck)
+        # the uuid of products read again is known after the recheck
+        pipeline.add_product(full_fname if record.recheck else record.uuid, record)
+    elif result.get('blckuuid') is not None:
+        print("{} raw data".format(full_fname))
+        pipeline.add_frame(FrameRecord.from_metadata(result, os.path.basename(full_fname)), meta=result)
+    else:
+        print("file not ingested", full_fname)
 
-    print('processing observing blocks')
-    for key, obs in obs_blocks.items():
 
-        res = session.query(ObservingBlock).filter_by(id=obs.id).first()
+def ingest_file(pipeline, full_fname):
+    """Extract the metadata of a file and add it to the pipeline"""
+    extractor = find_extractor(full_fname)
+    if extractor is None:
+        print("file not ingested", full_fname)
+        return
+    add_metadata(pipeline, extractor, full_fname, extractor.extract(full_fname, pipeline.drps))
 
-        if res is not None:
-            print('OB already inserted', obs.id)
-            continue
 
-        now = datetime.datetime.now()
-        ob = ObservingBlock(instrument_id=obs.instrument, mode=obs.mode, start_time=now)
-        ob.id = obs.id
-        session.add(ob)
+def ingest_dir_two_phase(session, ingestdir, drps, batch_size=INGEST_BATCH_SIZE, workers=INGEST_WORKERS):
 
-        for meta in obs.frames:
-            # Insert into DB
-            newframe = Frame()
-            newframe.name = meta['path']
-            newframe.uuid = meta['uuid']
-            newframe.start_time = meta['observation_date']
-            # No way of knowing when the readout ends...
-            newframe.completion_time = newframe.start_time + datetime.timedelta(seconds=meta['darktime'])
-            newframe.exposure_time = meta['exptime']
-            newframe.object = meta['object']
-            ob.frames.append(newframe)
-            ob.object = meta['object']
-
-        query1 = session.query(Frame).join(ObservingBlock).filter(ObservingBlock.id == obs.id)
-        res = query1.order_by(Frame.start_time).first()
-        if res:
-            ob.start_time = res.start_time
-
-        res = query1.order_by(Frame.completion_time.desc()).first()
-        if res:
-            ob.completion_time = res.completion_time
+    pipeline = IngestPipeline(session, drps, ingestdir, batch_size=batch_size, deferred=True)
+    # paths of the raw frames, by uuid
+    frame_paths = {}
+    deferred_products = []
 
-        # Facts
-        add_ob_facts(session, ob, ingestdir)
-
-    # raw frames insertion
-    for frame in raw_frames:
-        call_event('on_ingest_raw_fits', session, frame, raw_frames[frame])
-
-    session.commit()
+    print('classify files')
+    for dirname, dirnames, files in os.walk(ingestdir):
+        for fname in files:
+            full_fname = os.path.join(dirname, fname)
+            extractor = find_extractor(full_fname)
+            if extractor is None:
+                print("file not ingested", fname)
+                continue
+            result = classify_metadata(extractor, full_fname, drps)
+            if result is False:
+                continue
+            if result is None:
+                # no cheap classification, extract now
+                add_metadata(pipeline, extractor, full_fname, extract_metadata(extractor, full_fname, drps))
+            elif result['type'] is not None:
+                print("a calibration of type {}, queued".format(result['type']))
+                record = ProductRecord.from_metadata(result['type'], result, full_fname, recheck=True)
+                deferred_products.append(record)
+            elif result['blckuuid'] is not None:
+                record = FrameRecord.from_metadata(result, fname)
+                frame_paths.setdefault(record.uuid, full_fname)
+                pipeline.add_frame(record)
+    pipeline.flush()
+
+    # only the frames inserted now, not those already in the database
+    deferred_frames = [frame_paths[uuid] for uuid in pipeline.written_frames]
+
+    print('extract metadata of {} frames'.format(len(deferred_frames)))
+    enrich_frames(session, deferred_frames, drps, workers=workers, batch_size=batch_size)
+
+    print('extract metadata of {} calibrations'.format(len(deferred_products)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        records = executor.map(lambda record: recheck_metadata(record, drps), deferred_products)
+        for record in records:
+            if record is not None:
+                pipeline.add_product(record.path, record)
+    pipeline.flush()
+    return pipeline
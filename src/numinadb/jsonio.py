@@ -0,0 +1,128 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Streamed writing and partial reading of JSON files."""
+
+import gzip
+import json
+
+
+def open_json(path, mode='r'):
+    """Open a JSON file in text mode, compressed with gzip if path ends in .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    else:
+        return open(path, mode, encoding='utf-8')
+
+
+def dump_json(obj, path, compact=False, cls=None):
+    """Write obj as JSON to path, chunk by chunk.
+
+    If `compact` is True, the output has no indentation or spaces.
+    The file is compressed with gzip if path ends in .gz
+    """
+    if cls is None:
+        cls = json.JSONEncoder
+    if compact:
+        encoder = cls(separators=(',', ':'))
+    else:
+        encoder = cls(indent=2)
+
+    with open_json(path, 'w') as fd:
+        for chunk in encoder.iterencode(obj):
+            fd.write(chunk)
+
+
+_whitespace = ' \t\n\r'
+
+
+class _MemberReader(object):
+    """Read the members of a top level JSON object, one by one"""
+
+    def __init__(self, fd, chunk_size):
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """Read more data, return False at the end of the file"""
+        if self.eof:
+            return False
+        data = self.fd.read(self.chunk_size)
+        # grow the reads, values are decoded again after each read
+        self.chunk_size *= 2
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """Skip whitespace and return the next character"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError('unexpected end of JSON file')
+
+    def expect(self, chars):
+        char = self.next_char()
+        if char not in chars:
+            raise ValueError('expected one of {!r}, found {!r}'.format(chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next value"""
+        self.next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # a number could continue in the next read
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        self.expect('{')
+        if self.next_char() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+def load_json_member(path, key, chunk_size=65536):
+    """Load the member `key` of the top level object of a JSON file.
+
+    The file is read and decoded only up to the requested member,
+    members written before are decoded and discarded.
+    Raises KeyError if the member is not found.
+    """
+    with open_json(path, 'r') as fd:
+        reader = _MemberReader(fd, chunk_size)
+        for name in reader.members():
+            value = reader.value()
+            if name == key:
+                return value
+    raise KeyError(key)
@@ -2,26 +2,117 @@
 # from https://avacariu.me/articles/2016/compiling-json-as-text-for-sqlite-with-sqlalchemy
 
 
-import sqlalchemy.types as types
 import json
+import math
+
+import sqlalchemy.types as types
+from sqlalchemy.dialects import postgresql
+
+
+class JSONCodec(object):
+    """Encode and decode JSON columns using the standard library."""
+
+    name = 'json'
+
+    def dumps(self, value):
+        return json.dumps(value)
+
+    def loads(self, value):
+        return json.loads(value)
+
+
+def _finite(value):
+    """False if value contains a float NaN or infinity"""
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, dict):
+        return all(_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return all(_finite(item) for item in value)
+    return True
+
+
+class OrjsonCodec(JSONCodec):
+    """Encode and decode JSON columns using orjson.
+
+    Values that orjson cannot encode, or would change, as NaN and
+    infinity written as null, are encoded by the standard library.
+    Text that orjson cannot decode, such as the NaN written by the
+    standard library, is decoded by the standard library.
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        self.options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, value):
+        try:
+            result = self.orjson.dumps(value, option=self.options)
+        except TypeError:
+            return super(OrjsonCodec, self).dumps(value)
+        # orjson writes NaN and infinity as null, only then the value is walked
+        if b'null' in result and not _finite(value):
+            return super(OrjsonCodec, self).dumps(value)
+        return result.decode('utf-8')
+
+    def loads(self, value):
+        try:
+            return self.orjson.loads(value)
+        except self.orjson.JSONDecodeError:
+            return super(OrjsonCodec, self).loads(value)
+
+
+_codec_classes = {
+    'json': JSONCodec,
+    'orjson': OrjsonCodec
+}
+
+# Codec used by default
+DEFAULT_CODEC = 'json'
+
+
+def create_codec(name=None):
+    """Create a JSON codec by name, DEFAULT_CODEC if name is None"""
+    if name is None:
+        name = DEFAULT_CODEC
+    return _codec_classes[name]()
+
+
+_codec = create_codec()
+
+
+def get_codec():
+    """Return the codec used by JSON columns"""
+    return _codec
+
+
+def set_codec(name=None):
+    """Select the codec used by JSON columns"""
+    global _codec  # noqa
+    _codec = create_codec(name)
+    return _codec
 
 
 class StringyJSON(types.TypeDecorator):
     """Stores and retrieves JSON as TEXT."""
 
     impl = types.TEXT
+    cache_ok = True
 
     def process_bind_param(self, value, dialect):
         if value is not None:
-            value = json.dumps(value)
+            value = _codec.dumps(value)
         return value
 
     def process_result_value(self, value, dialect):
         if value is not None:
-            value = json.loads(value)
+            value = _codec.loads(value)
         return value
 
 
 # TypeEngine.with_variant says "use StringyJSON instead when
-# connecting to 'sqlite'"
-MagicJSON = types.JSON().with_variant(StringyJSON, 'sqlite')
+# connecting to 'sqlite'", and the binary JSONB with 'postgresql'
+MagicJSON = types.JSON().with_variant(StringyJSON, 'sqlite').with_variant(postgresql.JSONB(), 'postgresql')
@@ -0,0 +1,149 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Heartbeat of running tasks and recovery of interrupted task trees."""
+
+import datetime
+import logging
+import threading
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import aliased
+
+from .model import DataProcessingTask, defer_json
+
+
+_logger = logging.getLogger(__name__)
+
+# Seconds between heartbeats of a running task
+HEARTBEAT_INTERVAL = 30
+
+# A running task without heartbeat for this many seconds is considered dead
+LEASE_TIME = 300
+
+
+class Heartbeat(object):
+    """Update the heartbeat of a running task periodically.
+
+    Updates are done in a thread, using its own connection from `engine`::
+
+        with Heartbeat(engine, task.id):
+            ...
+
+    """
+
+    def __init__(self, engine, task_id, interval=HEARTBEAT_INTERVAL):
+        self.engine = engine
+        self.task_id = task_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def beat(self):
+        stmt = update(DataProcessingTask).where(
+            DataProcessingTask.id == self.task_id
+        ).values(heartbeat=datetime.datetime.utcnow())
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(stmt)
+        except Exception:
+            # a missed heartbeat is not fatal, the lease is longer than the interval
+            _logger.warning('unable to update the heartbeat of task %s', self.task_id, exc_info=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.beat()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name='heartbeat-{}'.format(self.task_id), daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def claimable_tasks_query():
+    """SELECT the next task not started whose children are finished.
+
+    Rows locked by other transactions are skipped
+    (FOR UPDATE SKIP LOCKED, ignored by SQLite).
+    """
+    child = aliased(DataProcessingTask)
+    unfinished = select(child.id).where(child.parent_id == DataProcessingTask.id, child.state != 2).exists()
+    # the request is loaded when the task runs
+    return select(DataProcessingTask).options(*defer_json(DataProcessingTask)).where(
+        DataProcessingTask.state == 0,
+        ~unfinished
+    ).order_by(DataProcessingTask.id).limit(1).with_for_update(skip_locked=True)
+
+
+def claim_task(session, host='localhost', max_attempts=10):
+    """Claim the next task ready to run, or return None.
+
+    The task is marked as running and committed. The conditional UPDATE
+    makes the claim safe where SKIP LOCKED is not available: if another
+    process claimed the task first, the next one is tried.
+    """
+    for _ in range(max_attempts):
+        task = session.scalars(claimable_tasks_query()).first()
+        if task is None:
+            session.commit()
+            return None
+
+        now = datetime.datetime.utcnow()
+        res = session.execute(
+            update(DataProcessingTask).where(
+                DataProcessingTask.id == task.id, DataProcessingTask.state == 0
+            ).values(state=1, host=host, start_time=now, heartbeat=now).execution_options(
+                synchronize_session=False
+            )
+        )
+        session.commit()
+        if res.rowcount == 1:
+            session.refresh(task)
+            return task
+    return None
+
+
+def is_stale(task, lease=LEASE_TIME, now=None):
+    """True if the task is running but its heartbeat is older than the lease"""
+    if task.state != 1:
+        return False
+    if now is None:
+        now = datetime.datetime.utcnow()
+    last = task.heartbeat or task.start_time
+    return last is None or (now - last).total_seconds() > lease
+
+
+def reset_tree(task, lease=LEASE_TIME, now=None):
+    """Prepare a task tree to run again.
+
+    Failed tasks and tasks whose process died (see is_stale) are set
+    to not started. Finished tasks keep their state and results.
+    Returns the tasks that were reset. Raises ValueError if a task
+    of the tree is still running.
+    """
+    reset = []
+    for child in task.children:
+        reset.extend(reset_tree(child, lease=lease, now=now))
+
+    if task.state == 1 and not is_stale(task, lease=lease, now=now):
+        raise ValueError('task {} is running, heartbeat at {}'.format(task.id, task.heartbeat))
+
+    if task.state in (1, 3):
+        task.state = 0
+        task.start_time = None
+        task.completion_time = None
+        task.heartbeat = None
+        task.result = None
+        reset.append(task)
+    return reset
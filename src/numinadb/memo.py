@@ -0,0 +1,69 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Reuse of reduction results whose inputs are unchanged."""
+
+import hashlib
+import json
+
+from .model import DataProcessingTask, ReductionResult, ReductionResultValue
+
+
+def recipe_input_key(obsres, recipe, resolved):
+    """Hash of everything that determines the result of a recipe.
+
+    The key covers the frames of the OB, the calibrations, parameters and
+    results resolved by the DAL (see SqliteDAL.recording_inputs),
+    the recipe class and its version.
+    """
+    recipe_class = recipe.__class__
+    data = {
+        'instrument': obsres.instrument,
+        'mode': obsres.mode,
+        'pipeline': getattr(obsres, 'pipeline', 'default'),
+        'frames': [[frame.name, frame.uuid] for frame in obsres.frames],
+        'inputs': resolved,
+        'recipe': '{}.{}'.format(recipe_class.__module__, recipe_class.__qualname__),
+        'recipe_version': getattr(recipe, '__version__', None),
+    }
+    canonical = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def find_reusable_result(session, input_key):
+    """First result of a finished task with the same input key, or None"""
+    return session.query(ReductionResult).join(ReductionResult.task).filter(
+        ReductionResult.input_key == input_key,
+        DataProcessingTask.state == 2
+    ).order_by(ReductionResult.id).first()
+
+
+def link_result(session, previous, task_id, ob_id):
+    """Register the result of a previous task as the result of task_id.
+
+    The values point to the products of the previous result,
+    no product is stored or registered again.
+    """
+    result_db = ReductionResult(
+        instrument_id=previous.instrument_id,
+        pipeline=previous.pipeline,
+        obsmode=previous.obsmode,
+        recipe=previous.recipe,
+        task_id=task_id,
+        ob_id=ob_id,
+        qc=previous.qc,
+        input_key=previous.input_key
+    )
+    for value in previous.values:
+        result_db.values.append(
+            ReductionResultValue(name=value.name, datatype=value.datatype, contents=value.contents)
+        )
+    session.add(result_db)
+    session.flush()
+    return result_db
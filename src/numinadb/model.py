@@ -13,9 +13,10 @@ import datetime
 
 from sqlalchemy import Integer, String, DateTime, Float, Boolean, UnicodeText
 from sqlalchemy import CHAR
-from sqlalchemy import Table, Column, ForeignKey, UniqueConstraint
+from sqlalchemy import Table, Column, ForeignKey, UniqueConstraint, Index
 from sqlalchemy import Enum
-from sqlalchemy.orm import relationship, backref, synonym
+from sqlalchemy import JSON
+from sqlalchemy.orm import relationship, backref, synonym, defer
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.ext.associationproxy import association_proxy
 import numina.types.dataframe
@@ -34,13 +35,17 @@ class Instrument(Base):
 
 class ObservingBlock(Base):
     __tablename__ = 'obs'
+    __table_args__ = (
+        Index('ix_obs_instrument_mode_start', 'instrument_id', 'mode', 'start_time'),
+        Index('ix_obs_object_start', 'object', 'start_time'),
+    )
 
     id = Column(String, primary_key=True)
     instrument_id = Column(String(10), ForeignKey("instruments.name"), nullable=False)
     mode = Column(String, nullable=False)
     object = Column(String)
     parent_id = Column(String, ForeignKey('obs.id'))
-    start_time = Column(DateTime)
+    start_time = Column(DateTime, index=True)
     completion_time = Column(DateTime)
 
     frames = relationship("Frame", back_populates='ob')
@@ -82,6 +87,7 @@ class Fact(Base):
     """A fact about an OB."""
 
     __tablename__ = 'fact'
+    __table_args__ = (Index('ix_fact_key_value', 'key', 'value'), )
 
     id = Column(Integer, primary_key=True)
     key = Column(String(64))
@@ -123,6 +129,7 @@ class ParameterFact(PolymorphicVerticalProperty, Base):
 
 class Frame(Base):
     __tablename__ = 'frames'
+    __table_args__ = (Index('ix_frames_object_start', 'object', 'start_time'), )
     id = Column(Integer, primary_key=True)
     uuid = Column(CHAR(32), nullable=True)
     name = Column(String(100), unique=True, nullable=False)
@@ -151,6 +158,8 @@ class DataProcessingTask(Base):
     create_time = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     start_time = Column(DateTime)
     completion_time = Column(DateTime)
+    # updated periodically while the task is running
+    heartbeat = Column(DateTime)
 
     # obsresult_node_id = Column(Integer, ForeignKey('observation_result.id'), nullable=False)
     ob_id = Column(String, ForeignKey("obs.id"), nullable=False)
@@ -169,6 +178,20 @@ class DataProcessingTask(Base):
     children = relationship("DataProcessingTask", backref=backref('parent', remote_side=[id]))
 
 
+class DataProcessingTaskTiming(Base):
+    """Duration of a stage of a task."""
+
+    __tablename__ = 'dp_task_timing'
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey('dp_task.id'), nullable=False, index=True)
+    stage = Column(String(45), nullable=False)
+    start_time = Column(DateTime, nullable=False)
+    # in seconds
+    duration = Column(Float, nullable=False)
+
+    task = relationship("DataProcessingTask", backref='timings')
+
+
 class ReductionResult(Base):
     __tablename__ = 'reduction_results'
     id = Column(Integer, primary_key=True)
@@ -179,10 +202,12 @@ class ReductionResult(Base):
     recipe = Column(String(100))
 
     task_id = Column(Integer, ForeignKey('dp_task.id'), unique=True, nullable=False)
-    ob_id = Column(String, ForeignKey("obs.id"), nullable=False)
+    ob_id = Column(String, ForeignKey("obs.id"), nullable=False, index=True)
     qc = Column(Enum(qc.QC), default=qc.QC.UNKNOWN)
+    # hash of the inputs of the recipe, see memo.recipe_input_key
+    input_key = Column(CHAR(64), index=True)
 
-    values = relationship("ReductionResultValue")
+    values = relationship("ReductionResultValue", back_populates='result')
     task = relationship("DataProcessingTask", backref=backref('reduction_result', uselist=False))
     ob = relationship("ObservingBlock", backref=backref('reduction_results'))
 
@@ -191,7 +216,7 @@ class ReductionResultValue(Base):
     __tablename__ = 'reduction_result_values'
     id = Column(Integer, primary_key=True)
     result_id = Column(Integer, ForeignKey('reduction_results.id'), nullable=False)
-    result = relationship("ReductionResult")
+    result = relationship("ReductionResult", back_populates='values')
     name = Column(String(45))
     datatype = Column(String(45))
     contents = Column(String(45))
@@ -199,10 +224,15 @@ class ReductionResultValue(Base):
 
 class DataProduct(ProxiedDictMixin, Base):
     __tablename__ = 'products'
+    __table_args__ = (
+        Index('ix_products_lookup_priority', 'datatype', 'instrument_id', 'pipeline', 'priority'),
+        Index('ix_products_lookup_dateobs', 'datatype', 'instrument_id', 'pipeline', 'dateobs'),
+    )
 
     id = Column(Integer, primary_key=True)
     instrument_id = Column(String(10), ForeignKey("instruments.name"), nullable=False)
     datatype = Column(String(45))
+    pipeline = Column(String, default='default', nullable=False)
     task_id = Column(Integer, ForeignKey('dp_task.id'))
     result_id = Column(Integer, ForeignKey('reduction_result_values.id'))
     uuid = Column(CHAR(32))
@@ -218,9 +248,10 @@ class DataProduct(ProxiedDictMixin, Base):
     crel = lambda key, value: ProductFact(key=key, value=value)  # noqa
     _proxied = association_proxy("facts", "value", creator=crel)
 
-    def __init__(self, instrument_id, datatype, task_id, contents, priority=0):
+    def __init__(self, instrument_id, datatype, task_id, contents, priority=0, pipeline='default'):
         self.instrument_id = instrument_id
         self.datatype = datatype
+        self.pipeline = pipeline
         self.task_id = task_id
         self.contents = contents
         self.priority = priority
@@ -232,7 +263,7 @@ class DataProduct(ProxiedDictMixin, Base):
 
 data_obs_fact = Table(
     'data_obs_fact', Base.metadata,
-    Column('obs_id', Integer, ForeignKey('obs.id'), primary_key=True),
+    Column('obs_id', String, ForeignKey('obs.id'), primary_key=True),
     Column('fact_id', Integer, ForeignKey('fact.id'), primary_key=True)
 )
 
@@ -253,7 +284,7 @@ class RecipeParameterValues(ProxiedDictMixin, Base):
     __tablename__ = 'recipe_parameter_values'
 
     id = Column(Integer, primary_key=True)
-    param_id = Column(String,  ForeignKey("recipe_parameters.id"), nullable=False)
+    param_id = Column(Integer, ForeignKey("recipe_parameters.id"), nullable=False)
 
     content = Column(MagicJSON, nullable=False)
     parameter = relationship("RecipeParameters")
@@ -266,3 +297,48 @@ class RecipeParameterValues(ProxiedDictMixin, Base):
     @classmethod
     def with_characteristic(cls, key, value):
         return cls.facts.any(key=key, value=value)
+
+
+class RecipeParameterIndex(Base):
+    """Resolution index of recipe parameter values, by canonical tag set.
+
+    Rebuilt each time a task-control file is ingested.
+    """
+
+    __tablename__ = 'recipe_parameter_index'
+    __table_args__ = (UniqueConstraint('instrument_id', 'pipeline', 'mode', 'name', 'tags'), )
+
+    id = Column(Integer, primary_key=True)
+    instrument_id = Column(String(10), ForeignKey("instruments.name"), nullable=False)
+    pipeline = Column(String, nullable=False)
+    mode = Column(String(100), nullable=False)
+    name = Column(String(100), nullable=False)
+    # JSON of the tags of the value, with sorted keys
+    tags = Column(String, nullable=False)
+    value_id = Column(Integer, ForeignKey('recipe_parameter_values.id'), nullable=False)
+
+    value = relationship("RecipeParameterValues")
+
+
+class ControlFile(Base):
+    """A task-control file already ingested, identified by its content."""
+
+    __tablename__ = 'control_files'
+
+    id = Column(Integer, primary_key=True)
+    checksum = Column(CHAR(64), nullable=False, unique=True)
+    path = Column(String)
+    ingest_time = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+def defer_json(entity):
+    """Loader options deferring the JSON columns of `entity`.
+
+    The columns are neither fetched nor decoded until the
+    attribute is accessed, i.e. ::
+
+        session.query(DataProcessingTask).options(*defer_json(DataProcessingTask))
+
+    """
+    return [defer(getattr(entity, column.key))
+            for column in entity.__table__.columns if isinstance(column.type, JSON)]
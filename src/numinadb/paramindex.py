@@ -0,0 +1,68 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Resolution index of recipe parameters."""
+
+import json
+
+from .model import RecipeParameters, RecipeParameterValues, ParameterFact
+from .model import RecipeParameterIndex
+
+
+def canonical_tags(tags):
+    """Serialize a tag set with sorted keys, equal sets give equal strings"""
+    return json.dumps(tags, sort_keys=True, separators=(',', ':'))
+
+
+def rebuild_parameter_index(session, instruments):
+    """Rebuild the resolution index of the parameters of `instruments`.
+
+    For each parameter and tag set, the value inserted first is indexed.
+    The changes are not committed.
+    """
+    instruments = list(instruments)
+
+    session.query(RecipeParameterIndex).filter(
+        RecipeParameterIndex.instrument_id.in_(instruments)
+    ).delete(synchronize_session=False)
+
+    values = session.query(
+        RecipeParameterValues.id,
+        RecipeParameters.instrument_id,
+        RecipeParameters.pipeline,
+        RecipeParameters.mode,
+        RecipeParameters.name
+    ).join(RecipeParameterValues.parameter).filter(
+        RecipeParameters.instrument_id.in_(instruments)
+    ).order_by(RecipeParameterValues.id).all()
+
+    tags = {row.id: {} for row in values}
+    facts = session.query(ParameterFact).join(
+        RecipeParameterValues, ParameterFact.owner_id == RecipeParameterValues.id
+    ).join(RecipeParameterValues.parameter).filter(
+        RecipeParameters.instrument_id.in_(instruments)
+    )
+    for fact in facts:
+        tags[fact.owner_id][fact.key] = fact.value
+
+    rows = {}
+    for row in values:
+        key = (row.instrument_id, row.pipeline, row.mode, row.name, canonical_tags(tags[row.id]))
+        if key not in rows:
+            rows[key] = dict(
+                instrument_id=row.instrument_id,
+                pipeline=row.pipeline,
+                mode=row.mode,
+                name=row.name,
+                tags=key[-1],
+                value_id=row.id
+            )
+
+    if rows:
+        session.execute(RecipeParameterIndex.__table__.insert(), list(rows.values()))
@@ -0,0 +1,176 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Profiling of the SQL statements sent to the database."""
+
+import atexit
+import collections
+import contextlib
+import functools
+import re
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+
+
+_re_space = re.compile(r'\s+')
+_re_string = re.compile(r"'(?:[^']|'')*'")
+_re_number = re.compile(r'\b\d+(?:\.\d+)?\b')
+_re_params = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_re_rows = re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+')
+
+
+def normalize_statement(statement):
+    """Normalize a SQL statement, so that equivalent statements are equal.
+
+    Whitespace is collapsed, literals are replaced by ``?`` and
+    lists of parameters, such as those of ``IN`` or multi-row ``VALUES``,
+    are replaced by a single ``(?)``.
+    """
+    statement = _re_space.sub(' ', statement).strip()
+    statement = _re_string.sub('?', statement)
+    statement = _re_number.sub('?', statement)
+    statement = _re_params.sub('(?)', statement)
+    statement = _re_rows.sub('(?)', statement)
+    return statement
+
+
+class StatementStats(object):
+    __slots__ = ['count', 'total', 'max']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+class SQLProfiler(object):
+    """Aggregate count, total and maximum time of each SQL statement.
+
+    Statements repeated at least `threshold` times within a single
+    call, delimited with ``scope``, are reported as possible N+1 patterns.
+    """
+
+    def __init__(self, threshold=10):
+        self.threshold = threshold
+        self.stats = collections.defaultdict(StatementStats)
+        # (scope name, statement) -> max number of executions in one call
+        self.repeated = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def detach(self, engine):
+        event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.remove(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _scopes(self):
+        try:
+            return self._local.scopes
+        except AttributeError:
+            self._local.scopes = []
+            return self._local.scopes
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['profiler_start_time'].pop()
+        key = normalize_statement(statement)
+        with self._lock:
+            self.stats[key].add(elapsed)
+        for _, counter in self._scopes():
+            counter[key] += 1
+
+    @contextlib.contextmanager
+    def scope(self, name):
+        """Count the statements executed during a call"""
+        scopes = self._scopes()
+        counter = collections.Counter()
+        scopes.append((name, counter))
+        try:
+            yield
+        finally:
+            scopes.pop()
+            with self._lock:
+                for statement, count in counter.items():
+                    if count >= self.threshold:
+                        key = (name, statement)
+                        self.repeated[key] = max(count, self.repeated.get(key, 0))
+
+    def wrap(self, obj, names):
+        """Run the methods `names` of `obj` within a scope"""
+        for name in names:
+            method = getattr(obj, name)
+            setattr(obj, name, self._scoped(name, method))
+        return obj
+
+    def _scoped(self, name, method):
+        @functools.wraps(method)
+        def scoped_method(*args, **kwargs):
+            with self.scope(name):
+                return method(*args, **kwargs)
+        return scoped_method
+
+    def report(self, fd=None, limit=20, width=100):
+        """Print the most expensive statements and the possible N+1 patterns"""
+        if fd is None:
+            fd = sys.stderr
+
+        with self._lock:
+            stats = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)
+            repeated = sorted(self.repeated.items(), key=lambda item: item[1], reverse=True)
+
+        total_count = sum(st.count for _, st in stats)
+        total_time = sum(st.total for _, st in stats)
+        print('SQL profile: {} statements, {:.3f} s'.format(total_count, total_time), file=fd)
+        print('{:>8s} {:>12s} {:>10s}  {}'.format('count', 'total (ms)', 'max (ms)', 'statement'), file=fd)
+        for statement, st in stats[:limit]:
+            print('{:8d} {:12.3f} {:10.3f}  {}'.format(
+                st.count, 1e3 * st.total, 1e3 * st.max, statement[:width]), file=fd)
+
+        if repeated:
+            print('possible N+1 patterns:', file=fd)
+            print('{:>8s}  {:30s} {}'.format('count', 'call', 'statement'), file=fd)
+            for (name, statement), count in repeated:
+                print('{:8d}  {:30s} {}'.format(count, name, statement[:width]), file=fd)
+
+
+_profiler = None
+
+
+def enable_profiling(engine, threshold=10):
+    """Profile the statements sent to `engine`, report at exit"""
+    global _profiler  # noqa
+    if _profiler is None:
+        _profiler = SQLProfiler(threshold=threshold)
+        atexit.register(_profiler.report)
+    _profiler.attach(engine)
+    return _profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def sql_scope(name):
+    """Scope of the active profiler, does nothing if profiling is disabled"""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.scope(name)
@@ -0,0 +1,196 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Selection of observing blocks."""
+
+import datetime
+import operator
+import re
+import shlex
+
+from sqlalchemy import select, and_, tuple_
+
+from .model import ObservingBlock, Frame, Fact, ReductionResult, data_obs_fact
+
+
+# Rows fetched in each page by find_obs and find_frames
+FIND_PAGE_SIZE = 500
+
+_columns = {
+    'id': ObservingBlock.id,
+    'instrument': ObservingBlock.instrument_id,
+    'mode': ObservingBlock.mode,
+    'object': ObservingBlock.object,
+}
+
+_time_columns = {
+    'start': ObservingBlock.start_time,
+    'end': ObservingBlock.completion_time,
+}
+
+_operators = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+_flags = {
+    # OBs without reduction results
+    'pending': lambda: ~_reduced(),
+    'reduced': lambda: _reduced(),
+    # OBs that are not part of another OB
+    'root': lambda: ObservingBlock.parent_id.is_(None),
+}
+
+_re_term = re.compile(r'^(?P<key>[A-Za-z_][\w.-]*)(?P<op>>=|<=|!=|=|<|>)(?P<value>.*)$')
+
+
+def _reduced():
+    return select(ReductionResult.id).where(ReductionResult.ob_id == ObservingBlock.id).exists()
+
+
+def _has_fact(key, value):
+    return select(data_obs_fact.c.obs_id).join(Fact, Fact.id == data_obs_fact.c.fact_id).where(
+        data_obs_fact.c.obs_id == ObservingBlock.id, Fact.key == key, Fact.value == value
+    ).exists()
+
+
+def parse_query(query):
+    """Split a query in (key, operator, value) terms.
+
+    A query is a sequence of terms separated by spaces,
+    terms containing spaces are quoted::
+
+        instrument=MEGARA "object=NGC 7469" start>=2025-03-01 start<2025-03-02T12:00 fact.vph=LR-B pending
+
+    Valid keys are ``id``, ``instrument``, ``mode`` and ``object``,
+    ``start`` and ``end`` (the time range of the OB, in ISO format),
+    ``fact.<name>`` (a fact of the OB, only with ``=``),
+    and the flags ``pending`` (not yet reduced), ``reduced`` and ``root``
+    (not part of another OB), without operator or value.
+    """
+    terms = []
+    for token in shlex.split(query):
+        if token in _flags:
+            terms.append((token, None, None))
+            continue
+
+        match = _re_term.match(token)
+        if match is None:
+            raise ValueError('invalid term {!r} in query'.format(token))
+        key, op, value = match.group('key', 'op', 'value')
+
+        if key in _time_columns:
+            try:
+                value = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError('invalid date {!r} in query'.format(value))
+        elif key.startswith('fact.'):
+            if op != '=':
+                raise ValueError('only = is valid with facts, in {!r}'.format(token))
+        elif key not in _columns:
+            raise ValueError('unknown key {!r} in query'.format(key))
+        terms.append((key, op, value))
+    return terms
+
+
+def compile_query(query):
+    """Compile a query into a SELECT of the ids of the observing blocks"""
+    clauses = []
+    for key, op, value in parse_query(query):
+        if key in _flags:
+            clauses.append(_flags[key]())
+        elif key in _time_columns:
+            clauses.append(_operators[op](_time_columns[key], value))
+        elif key.startswith('fact.'):
+            clauses.append(_has_fact(key[len('fact.'):], value))
+        else:
+            clauses.append(_operators[op](_columns[key], value))
+
+    stmt = select(ObservingBlock.id)
+    if clauses:
+        stmt = stmt.where(and_(*clauses))
+    return stmt.order_by(ObservingBlock.start_time, ObservingBlock.id)
+
+
+def select_obs(session, query):
+    """Ids of the observing blocks selected by the query"""
+    return list(session.scalars(compile_query(query)))
+
+
+def _paginate(session, stmt, time_column, id_column, after, page_size):
+    """Rows of stmt in order of (time_column, id_column), fetched by pages"""
+    while True:
+        page = stmt
+        if after is not None:
+            # keyset pagination, continue after the last row seen
+            page = page.where(tuple_(time_column, id_column) > tuple_(*after))
+        rows = session.execute(page.order_by(time_column, id_column).limit(page_size)).all()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = (rows[-1].start_time, rows[-1].id)
+
+
+def find_obs(session, instrument=None, mode=None, object=None, start=None, end=None,
+             after=None, page_size=FIND_PAGE_SIZE):
+    """Observing blocks started in [start, end), in order of start time.
+
+    Yields rows with the id, instrument_id, mode, object, start_time
+    and completion_time of the OBs, not ORM objects, fetched in pages
+    of `page_size` rows. Each page starts after the (start_time, id) of
+    the previous one, `after` if given, so that every page uses the
+    indexes (instrument_id, mode, start_time) or (object, start_time)
+    and costs the same. OBs without start time are not returned.
+    """
+    stmt = select(
+        ObservingBlock.id, ObservingBlock.instrument_id, ObservingBlock.mode, ObservingBlock.object,
+        ObservingBlock.start_time, ObservingBlock.completion_time
+    ).where(ObservingBlock.start_time.is_not(None))
+    if instrument is not None:
+        stmt = stmt.where(ObservingBlock.instrument_id == instrument)
+    if mode is not None:
+        stmt = stmt.where(ObservingBlock.mode == mode)
+    if object is not None:
+        stmt = stmt.where(ObservingBlock.object == object)
+    if start is not None:
+        stmt = stmt.where(ObservingBlock.start_time >= start)
+    if end is not None:
+        stmt = stmt.where(ObservingBlock.start_time < end)
+    return _paginate(session, stmt, ObservingBlock.start_time, ObservingBlock.id, after, page_size)
+
+
+def find_frames(session, instrument=None, mode=None, object=None, start=None, end=None,
+                after=None, page_size=FIND_PAGE_SIZE):
+    """Frames started in [start, end), in order of start time.
+
+    Yields rows with the id, name, ob_id, object, start_time,
+    exposure_time and completion_time of the frames. The instrument
+    and mode are those of the OB of the frame. See find_obs.
+    """
+    stmt = select(
+        Frame.id, Frame.name, Frame.ob_id, Frame.object,
+        Frame.start_time, Frame.exposure_time, Frame.completion_time
+    ).where(Frame.start_time.is_not(None))
+    if instrument is not None or mode is not None:
+        stmt = stmt.join(ObservingBlock, Frame.ob_id == ObservingBlock.id)
+        if instrument is not None:
+            stmt = stmt.where(ObservingBlock.instrument_id == instrument)
+        if mode is not None:
+            stmt = stmt.where(ObservingBlock.mode == mode)
+    if object is not None:
+        stmt = stmt.where(Frame.object == object)
+    if start is not None:
+        stmt = stmt.where(Frame.start_time >= start)
+    if end is not None:
+        stmt = stmt.where(Frame.start_time < end)
+    return _paginate(session, stmt, Frame.start_time, Frame.id, after, page_size)
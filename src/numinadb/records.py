@@ -0,0 +1,98 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Compact records of the metadata extracted during ingestion."""
+
+import dataclasses
+import datetime
+
+
+# Metadata of raw frames stored in the database
+DB_FRAME_KEYS = (
+    'uuid',
+    'path',
+    'blckuuid',
+    'instrument',
+    'mode',
+    'insconf',
+    'object',
+    'observation_date',
+    'exptime',
+    'darktime',
+)
+
+# Metadata of products stored in the database
+DB_PRODUCT_KEYS = (
+    'datatype',
+    'path',
+    'instrument',
+    'uuid',
+    'observation_date',
+    'quality_control',
+    'tags',
+    'recheck',
+)
+
+
+@dataclasses.dataclass(slots=True)
+class FrameRecord:
+    """Metadata of a raw frame"""
+
+    uuid: str
+    path: str
+    blckuuid: str = None
+    instrument: str = None
+    mode: str = None
+    insconf: str = None
+    object: str = None
+    observation_date: datetime.datetime = None
+    exptime: float = None
+    darktime: float = None
+
+    @classmethod
+    def from_metadata(cls, meta, path):
+        """Keep the fields of DB_FRAME_KEYS from the metadata of a frame"""
+        return cls(path=path, **{key: meta.get(key) for key in DB_FRAME_KEYS if key != 'path'})
+
+    def metadata(self):
+        """The metadata of DB_FRAME_KEYS, as a dictionary"""
+        return {key: getattr(self, key) for key in DB_FRAME_KEYS}
+
+    @property
+    def completion_time(self):
+        # unknown until the deep metadata is extracted
+        if self.observation_date is None or self.darktime is None:
+            return None
+        # No way of knowing when the readout ends...
+        return self.observation_date + datetime.timedelta(seconds=self.darktime)
+
+
+@dataclasses.dataclass(slots=True)
+class ProductRecord:
+    """Metadata of a data product
+
+    If `recheck` is True, the metadata is extracted again
+    with the type of the product before storing it.
+    """
+
+    datatype: str
+    path: str
+    instrument: str
+    uuid: str
+    observation_date: datetime.datetime = None
+    quality_control: object = None
+    tags: dict = dataclasses.field(default_factory=dict)
+    recheck: bool = False
+
+    @classmethod
+    def from_metadata(cls, datatype, meta, path, recheck=False):
+        """Keep the fields of DB_PRODUCT_KEYS from the metadata of a product"""
+        fields = {key: meta.get(key) for key in DB_PRODUCT_KEYS if key not in ('datatype', 'path', 'recheck')}
+        fields['tags'] = fields['tags'] or {}
+        return cls(datatype=datatype, path=path, recheck=recheck, **fields)
@@ -0,0 +1,144 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Upgrade of the schema of existing databases.
+
+Base.metadata.create_all creates the missing tables, but not the
+columns and indexes added later to existing tables. upgrade_schema
+adds them and fixes the types of the columns in retyped_columns,
+see "numina rundb db --initdb".
+"""
+
+import logging
+
+from sqlalchemy import inspect, literal, text
+from sqlalchemy.schema import CreateTable
+
+from .model import Base
+
+
+_logger = logging.getLogger(__name__)
+
+# columns whose type was changed, as (table, column)
+# their foreign keys did not match the type of the referenced column,
+# so the old tables can only exist in SQLite databases
+retyped_columns = [
+    ('data_obs_fact', 'obs_id'),
+    ('recipe_parameter_values', 'param_id'),
+]
+
+
+class SchemaError(Exception):
+    """The database needs to be upgraded"""
+
+
+def missing_columns(engine):
+    """Columns of the model missing in the existing tables of the database"""
+    inspector = inspect(engine)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing.extend(column for column in table.columns if column.name not in existing)
+    return missing
+
+
+def wrong_types(engine):
+    """Tables with columns of retyped_columns that have the old type"""
+    inspector = inspect(engine)
+    tables = []
+    for name, column_name in retyped_columns:
+        if not inspector.has_table(name):
+            continue
+        column = Base.metadata.tables[name].columns[column_name]
+        existing = {col['name']: col['type'] for col in inspector.get_columns(name)}
+        if existing[column_name].python_type is not column.type.python_type:
+            tables.append(column.table)
+    return tables
+
+
+def rebuild_table_ddl(table, dialect):
+    """Statements recreating the table of SQLite, casting the values of the retyped columns.
+
+    SQLite does not change the type of a column, the table is
+    created again with a temporary name and the rows are copied.
+    The indexes are created later.
+    """
+    preparer = dialect.identifier_preparer
+    name = preparer.format_table(table)
+    tmp_name = preparer.quote('_upgrade_' + table.name)
+    create = str(CreateTable(table).compile(dialect=dialect)).strip()
+    create = create.replace('CREATE TABLE {} '.format(name), 'CREATE TABLE {} '.format(tmp_name), 1)
+    columns = [preparer.format_column(column) for column in table.columns]
+    values = [
+        'CAST({} AS {})'.format(column, col.type.compile(dialect=dialect))
+        if (table.name, col.name) in retyped_columns else column
+        for column, col in zip(columns, table.columns)
+    ]
+    return [
+        create,
+        'INSERT INTO {} ({}) SELECT {} FROM {}'.format(tmp_name, ', '.join(columns), ', '.join(values), name),
+        'DROP TABLE {}'.format(name),
+        'ALTER TABLE {} RENAME TO {}'.format(tmp_name, name)
+    ]
+
+
+def add_column_ddl(column, dialect):
+    """ALTER TABLE statement adding the column to its table"""
+    preparer = dialect.identifier_preparer
+    ddl = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+        preparer.format_table(column.table), preparer.format_column(column), column.type.compile(dialect=dialect)
+    )
+    default = column.default
+    if default is not None and default.is_scalar:
+        value = literal(default.arg, column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+        ddl += ' DEFAULT {}'.format(value)
+    elif not column.nullable:
+        raise SchemaError('column {} can not be added, it is NOT NULL without default'.format(column))
+    if not column.nullable:
+        ddl += ' NOT NULL'
+    return ddl
+
+
+def upgrade_schema(engine):
+    """Add the missing columns and indexes to the existing tables.
+
+    Existing rows get the default value of the new columns.
+    The tables with columns of the old type are recreated.
+    Returns the statements executed.
+    """
+    statements = []
+    with engine.begin() as conn:
+        for column in missing_columns(engine):
+            statements.append(add_column_ddl(column, engine.dialect))
+        for table in wrong_types(engine):
+            if engine.dialect.name != 'sqlite':
+                raise SchemaError('the type of the columns of {} can only be upgraded in SQLite'.format(table))
+            statements.extend(rebuild_table_ddl(table, engine.dialect))
+        for ddl in statements:
+            _logger.info('%s', ddl)
+            conn.execute(text(ddl))
+
+    # after the columns, they may be indexed
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    return statements
+
+
+def check_schema(engine):
+    """Raise SchemaError if columns of the model are missing in the database, or have the old type"""
+    missing = missing_columns(engine)
+    missing.extend(table.columns[column] for table in wrong_types(engine)
+                   for name, column in retyped_columns if name == table.name)
+    if missing:
+        names = ', '.join(str(column) for column in missing)
+        raise SchemaError('the columns {} of the database are missing or have an old type, upgrade it with '
+                          '"numina rundb db --initdb URI"'.format(names))
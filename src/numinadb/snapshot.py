@@ -0,0 +1,100 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Read-only snapshots of the tables used to resolve recipe inputs."""
+
+import os
+import pathlib
+import stat
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+from .base import Base
+
+
+# Tables read by the lookups of the DAL; products are
+# registered by the tasks, the DAL reads them from the database
+SNAPSHOT_TABLES = [
+    'instruments',
+    'obs',
+    'fact',
+    'data_obs_fact',
+    'obs_alias',
+    'frames',
+    'recipe_parameters',
+    'recipe_parameter_values',
+    'parameter_facts',
+    'recipe_parameter_index',
+]
+
+# Bytes of the snapshot mapped in memory by SQLite
+SNAPSHOT_MMAP_SIZE = 256 * 1024 * 1024
+
+
+def snapshot_tables():
+    return [table for table in Base.metadata.sorted_tables if table.name in SNAPSHOT_TABLES]
+
+
+def export_snapshot(engine, path, chunk_size=10000):
+    """Copy the lookup tables of the database in engine to a new SQLite file.
+
+    The snapshot is created with the indexes of the tables, analyzed and
+    vacuumed. The file is written under a temporary name, renamed
+    when complete and made read-only. Returns the number of rows copied.
+    """
+    tmp_path = '{}.tmp'.format(path)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    dest = create_engine('sqlite:///{}'.format(tmp_path), echo=False)
+    tables = snapshot_tables()
+    Base.metadata.create_all(dest, tables=tables)
+
+    nrows = 0
+    with engine.connect() as source, dest.begin() as conn:
+        for table in tables:
+            result = source.execute(select(table))
+            for rows in result.mappings().partitions(chunk_size):
+                conn.execute(table.insert(), [dict(row) for row in rows])
+                nrows += len(rows)
+
+    with dest.connect() as conn:
+        conn.exec_driver_sql('ANALYZE')
+        conn.commit()
+        conn.exec_driver_sql('VACUUM')
+    dest.dispose()
+
+    if os.path.exists(path):
+        os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+    os.replace(tmp_path, path)
+    os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    return nrows
+
+
+def open_snapshot(path, mmap_size=SNAPSHOT_MMAP_SIZE):
+    """Create a session factory for a snapshot.
+
+    The file is opened read-only and immutable, so SQLite does no locking,
+    and mapped in memory. The sessions do not autoflush, objects
+    modified by the DAL are never written to the snapshot.
+    """
+    uri = pathlib.Path(path).resolve().as_uri()
+    engine = create_engine(
+        'sqlite:///{}?mode=ro&immutable=1&uri=true'.format(uri),
+        echo=False
+    )
+
+    @event.listens_for(engine, 'connect')
+    def set_mmap_size(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA mmap_size={:d}'.format(mmap_size))
+        cursor.close()
+
+    return sessionmaker(bind=engine, autoflush=False)
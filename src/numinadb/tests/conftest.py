@@ -0,0 +1,50 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .. import event
+from ..event import EventManager
+from ..model import Base
+
+
+@pytest.fixture
+def session():
+    database = "sqlite:///:memory:"
+    engine = create_engine(database, echo=False)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    try:
+        with Session() as session:
+            yield session
+    finally:
+        Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def postgres_engine():
+    """An engine of the PostgreSQL database in NUMINADB_TEST_POSTGRES_URI, with empty tables"""
+    uri = os.environ.get('NUMINADB_TEST_POSTGRES_URI')
+    if uri is None:
+        pytest.skip('set NUMINADB_TEST_POSTGRES_URI to test with PostgreSQL')
+    engine = create_engine(uri, echo=False)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    try:
+        yield engine
+    finally:
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+
+@pytest.fixture
+def events(monkeypatch):
+    """The (args, kwargs) of the calls of each event, recorded by batch handlers"""
+    calls = {}
+    for name in event._event_names:
+        manager = EventManager(name)
+        monkeypatch.setitem(event._managers, name, manager)
+        calls[name] = []
+        manager.register(calls[name].extend, batch=True)
+    return calls
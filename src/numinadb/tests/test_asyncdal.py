@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+pytest.importorskip('greenlet')
+pytest.importorskip('aiosqlite')
+
+from numina.exceptions import NoResultFound  # noqa: E402
+
+from .. import asyncdal  # noqa: E402
+from ..model import Base, ObservingBlock, Frame, DataProduct, ProductFact  # noqa: E402
+from ..ingest import ingest_control_file  # noqa: E402
+from ..dal import SqliteDAL  # noqa: E402
+from ..asyncdal import AsyncSqliteDAL, async_uri, create_async_sessionmaker  # noqa: E402
+from .test_ingest import CONTROL_FILE  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    uri = "sqlite:///{}".format(tmp_path / 'processing.db')
+    engine = create_engine(uri, echo=False)
+    Base.metadata.create_all(engine)
+    path = tmp_path / "control.yaml"
+    path.write_text(CONTROL_FILE)
+    with sessionmaker(bind=engine)() as session:
+        ingest_control_file(session, str(path))
+        ob = ObservingBlock(id='ob1', instrument_id='MEGARA', mode='MegaraArcCalibration')
+        ob.frames.append(Frame(name='r0001.fits'))
+        session.add(ob)
+        prod = DataProduct(instrument_id='MEGARA', datatype='MasterBias', task_id=None, contents='master_bias.fits')
+        prod.facts = {'vph': ProductFact(key='vph', value='LR-B')}
+        session.add(prod)
+        session.commit()
+    engine.dispose()
+    return uri
+
+
+def test_async_uri():
+    assert async_uri('sqlite:///processing.db').drivername == 'sqlite+aiosqlite'
+    assert async_uri('postgresql://localhost/numina').drivername == 'postgresql+asyncpg'
+    assert async_uri('postgresql+psycopg://localhost/numina').drivername == 'postgresql+psycopg'
+
+
+def test_async_search_parameter(database, tmp_path):
+    engine = create_engine(database)
+    with sessionmaker(bind=engine)() as session:
+        dal = SqliteDAL('test', session, basedir=str(tmp_path), datadir=str(tmp_path))
+        obsres = SimpleNamespace(instrument='MEGARA', mode='MegaraArcCalibration',
+                                 tags={'vph': 'LR-B', 'speclamp': 'ThNe'}, pipeline='default')
+        names = ['nlines', 'polynomial_degree'] * 20
+        expected = [dal.search_parameter(name, None, obsres).content for name in names]
+
+    async def lookups():
+        async_dal = AsyncSqliteDAL('test', create_async_sessionmaker(database),
+                                   basedir=str(tmp_path), datadir=str(tmp_path), drps=dal.drps)
+        res = await asyncio.gather(*[async_dal.search_parameter(name, None, obsres) for name in names])
+        ob = await async_dal.search_oblock_from_id('ob1')
+        with pytest.raises(NoResultFound):
+            obsres.tags = {'vph': 'HR-R'}
+            await async_dal.search_parameter('nlines', None, obsres)
+        return res, ob
+
+    res, ob = asyncio.run(lookups())
+    assert [stored.content for stored in res] == expected
+    assert ob.id == 'ob1'
+    assert [frame.name for frame in ob.frames] == ['r0001.fits']
+
+
+def test_async_search_product(database, tmp_path, monkeypatch):
+    loaded = []
+
+    def load(tipo, path):
+        loaded.append(threading.get_ident())
+        return path
+
+    monkeypatch.setattr(asyncdal, 'load', load)
+    tipo = SimpleNamespace(name=lambda: 'MasterBias')
+    obsres = SimpleNamespace(instrument='MEGARA', tags={'vph': 'LR-B'}, pipeline='default')
+
+    async def lookup():
+        async_dal = AsyncSqliteDAL('test', create_async_sessionmaker(database),
+                                   basedir=str(tmp_path), datadir=str(tmp_path), drps={})
+        return await async_dal.search_product('master_bias', tipo, obsres), threading.get_ident()
+
+    stored, loop_thread = asyncio.run(lookup())
+    assert stored.content == str(tmp_path / 'master_bias.fits')
+    assert stored.tags == {'vph': 'LR-B'}
+    # the file is not read in the thread of the event loop
+    assert loaded and loop_thread not in loaded
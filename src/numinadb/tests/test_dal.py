@@ -0,0 +1,123 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from numina.exceptions import NoResultFound
+from numina.types.frame import DataFrameType
+from numina.types.product import DataProductMixin
+
+from ..model import RecipeParameterIndex, DataProduct
+from ..ingest import ingest_control_file
+from ..dal import SqliteDAL, RANK_TIME
+from .test_ingest import CONTROL_FILE
+
+
+@pytest.fixture
+def dal(session, tmp_path):
+    path = tmp_path / "control.yaml"
+    path.write_text(CONTROL_FILE)
+    ingest_control_file(session, str(path))
+    return SqliteDAL('test', session, basedir=str(tmp_path), datadir=str(tmp_path))
+
+
+@pytest.mark.parametrize("tags, content", [
+    ({'vph': 'LR-B', 'speclamp': 'ThNe'}, [20, 20]),
+    ({'vph': 'LR-U', 'speclamp': 'ThNe'}, [10, 10]),
+    ({'speclamp': 'ThNe'}, [20, 20]),
+])
+def test_search_param_tags(dal, tags, content):
+    mode = 'MegaraArcCalibration'
+    res = dal.search_param_type_tags('nlines', None, 'MEGARA', mode, 'default', tags)
+    assert res.content == content
+
+    # same result without the index
+    res = dal.search_param_type_tags_scan('nlines', None, 'MEGARA', mode, 'default', tags)
+    assert res.content == content
+
+
+def test_search_param_no_index(dal, session):
+    session.query(RecipeParameterIndex).delete()
+    mode = 'MegaraArcCalibration'
+    res = dal.search_param_type_tags('polynomial_degree', None, 'MEGARA', mode, 'default', {'vph': 'LR-B'})
+    assert res.content == 5
+    assert not dal.parameter_index_ready()
+
+
+def test_search_param_index_only(dal, session, monkeypatch):
+    assert dal.parameter_index_ready()
+    # the scan is not used when the index is built
+    monkeypatch.setattr(dal, 'search_param_type_tags_scan', None)
+    mode = 'MegaraArcCalibration'
+    with pytest.raises(NoResultFound):
+        dal.search_param_type_tags('other', None, 'MEGARA', mode, 'default', {'vph': 'LR-B'})
+
+
+def test_search_param_not_found(dal):
+    mode = 'MegaraArcCalibration'
+    with pytest.raises(NoResultFound):
+        dal.search_param_type_tags('nlines', None, 'MEGARA', mode, 'default', {'vph': 'HR-R'})
+    with pytest.raises(NoResultFound):
+        dal.search_param_type_tags('other', None, 'MEGARA', mode, 'default', {'vph': 'LR-B'})
+
+
+def test_recording_inputs(dal):
+    obsres = SimpleNamespace(instrument='MEGARA', mode='MegaraArcCalibration',
+                             pipeline='default', tags={'vph': 'LR-U'})
+    dal.extra_data['polynomial_degree'] = 3
+    with dal.recording_inputs() as resolved:
+        dal.search_parameter('nlines', None, obsres)
+        dal.search_parameter('polynomial_degree', None, obsres)
+    assert resolved == {'nlines': {'parameter': [10, 10]}, 'polynomial_degree': {'parameter': 3}}
+    assert dal.resolved is None
+
+
+class MasterBias(DataProductMixin, DataFrameType):
+    pass
+
+
+@pytest.mark.parametrize("ranking, when, expected", [
+    ({}, datetime.datetime(2025, 3, 1, 20), 'bias_high.fits'),
+    ({'MasterBias': RANK_TIME}, datetime.datetime(2025, 3, 1, 20), 'bias_0301.fits'),
+    ({'MasterBias': RANK_TIME}, datetime.datetime(2025, 2, 27, 23), 'bias_0228.fits'),
+    ({'MasterBias': RANK_TIME}, datetime.datetime(2025, 3, 10), 'bias_0303.fits'),
+    ({'MasterBias': RANK_TIME}, None, 'bias_high.fits'),
+    # at equal distance, the highest priority
+    ({'MasterBias': RANK_TIME}, datetime.datetime(2025, 3, 2, 12), 'bias_0303.fits'),
+])
+def test_search_product_nearest(session, tmp_path, ranking, when, expected):
+    products = [
+        ('MEGARA', 'bias_0228.fits', datetime.datetime(2025, 2, 28, 12), 0),
+        ('MEGARA', 'bias_0301.fits', datetime.datetime(2025, 3, 1, 12), 0),
+        ('MEGARA', 'bias_0303.fits', datetime.datetime(2025, 3, 3, 12), 1),
+        ('MEGARA', 'bias_high.fits', None, 10),
+        ('EMIR', 'bias_emir.fits', datetime.datetime(2025, 3, 1, 20), 0),
+    ]
+    for instrument, contents, dateobs, priority in products:
+        prod = DataProduct(instrument_id=instrument, datatype='MasterBias', task_id=None,
+                           contents=contents, priority=priority)
+        prod.dateobs = dateobs
+        session.add(prod)
+    session.commit()
+
+    dal = SqliteDAL('test', session, basedir=str(tmp_path), datadir=str(tmp_path), product_ranking=ranking)
+    obsres = SimpleNamespace(instrument='MEGARA', pipeline='default', tags={}, start_time=when)
+    stored = dal.search_product('master_bias', MasterBias(), obsres)
+    assert stored.content.filename == str(tmp_path / expected)
+
+
+def test_search_product_instrument_pipeline(session, tmp_path):
+    for instrument, contents, pipeline, priority in [
+        ('MEGARA', 'bias_megara.fits', 'default', 0),
+        ('EMIR', 'bias_emir.fits', 'default', 10),
+        ('MEGARA', 'bias_other.fits', 'other', 20),
+    ]:
+        session.add(DataProduct(instrument_id=instrument, datatype='MasterBias', task_id=None,
+                                contents=contents, priority=priority, pipeline=pipeline))
+    session.commit()
+
+    dal = SqliteDAL('test', session, basedir=str(tmp_path), datadir=str(tmp_path))
+    for pipeline, expected in [('default', 'bias_megara.fits'), ('other', 'bias_other.fits')]:
+        stored = dal.search_prod_type_tags(MasterBias(), 'MEGARA', {}, pipeline)
+        assert stored.content.filename == str(tmp_path / expected)
+    with pytest.raises(NoResultFound):
+        dal.search_prod_type_tags(MasterBias(), 'EMIR', {}, 'other')
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from .. import event
+from ..event import EventManager, BoundedExecutor
+
+
+def test_sync_handler():
+    manager = EventManager('test')
+    manager.register(lambda x: x + 1)
+    assert manager(1) == [2]
+    assert manager.flush() == []
+    stats, = manager.stats()
+    assert stats.calls == 1
+    assert stats.errors == 0
+
+
+def test_background_handler():
+    manager = EventManager('test')
+    threads = set()
+
+    def handler(x):
+        threads.add(threading.get_ident())
+        return x * 2
+
+    manager.register(handler, background=True)
+    for x in range(10):
+        manager(x)
+    assert sorted(manager.flush()) == [2 * x for x in range(10)]
+    assert threading.get_ident() not in threads
+    assert manager.stats()[0].calls == 10
+
+
+def test_batch_handler():
+    manager = EventManager('test')
+    batches = []
+    manager.register(batches.append, batch=True)
+    manager('a', 1)
+    manager('b', 2, key='c')
+    assert batches == []
+    manager.flush()
+    assert batches == [[(('a', 1), {}), (('b', 2), {'key': 'c'})]]
+    # nothing called since the last flush
+    manager.flush()
+    assert len(batches) == 1
+
+
+def test_background_error(caplog):
+    manager = EventManager('test')
+
+    def handler(x):
+        raise ValueError(x)
+
+    manager.register(handler, background=True)
+    manager.register(handler, batch=True)
+    manager.register(lambda x: x, background=True)
+    manager(1)
+    # logged, the other handlers run
+    assert manager.flush() == [1]
+    assert [stats.errors for stats in manager.stats()] == [1, 1, 0]
+    assert len(caplog.records) == 2
+    assert manager.flush() == []
+
+
+def test_bounded_executor():
+    executor = BoundedExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    futures = [executor.submit(release.wait) for _ in range(2)]
+    # a third call waits until a slot is free
+    assert not executor.semaphore.acquire(blocking=False)
+    release.set()
+    assert all(future.result() for future in futures)
+    executor.shutdown()
+
+
+@pytest.mark.parametrize('name', ['on_ingest_batch_committed', 'on_products_registered',
+                                  'on_task_claimed', 'on_task_finished'])
+def test_batch_events(name, monkeypatch):
+    monkeypatch.setitem(event._managers, name, EventManager(name))
+    batches = []
+    event.manage(name, batches.append, batch=True)
+    event.call_event(name, None, [1, 2])
+    event.call_event(name, None, [3])
+    event.flush_events()
+    assert batches == [[((None, [1, 2]), {}), ((None, [3]), {})]]
@@ -0,0 +1,112 @@
+import gzip
+import shutil
+from types import SimpleNamespace
+
+import numina.store
+import numpy
+import pytest
+from astropy.io import fits
+
+from ..extractors import ExtractorRegistry, Extractor, FitsExtractor, JsonExtractor, LisExtractor
+from ..extractors import metadata_fits, metadata_lis, classify_fits
+from .test_ingest import fake_drps, write_raw_frame
+
+
+class TextExtractor(Extractor):
+    name = 'text'
+    suffixes = ('.gz',)
+
+
+@pytest.fixture
+def registry():
+    registry = ExtractorRegistry()
+    registry.loaded = True
+    for extractor in [FitsExtractor, JsonExtractor, LisExtractor, TextExtractor]:
+        registry.register(extractor)
+    return registry
+
+
+def test_find_suffix(registry):
+    assert registry.find('data/r0001.fits').name == 'fits'
+    assert registry.find('data/R0001.FITS.GZ').name == 'fits'
+    assert registry.find('data/r0001.fits.fz').name == 'fits'
+    assert registry.find('data/notes.txt.gz').name == 'text'
+    assert registry.find('data/master_bias.json').name == 'json'
+
+
+def test_find_sniff(registry, tmp_path):
+    path = write_raw_frame(tmp_path, 1)
+    noext = tmp_path / 'r0001'
+    shutil.copy(path, noext)
+    assert registry.find(str(noext)).name == 'fits'
+
+    with open(path, 'rb') as src, gzip.open(tmp_path / 'r0001.gzip', 'wb') as dest:
+        shutil.copyfileobj(src, dest)
+    assert registry.find(str(tmp_path / 'r0001.gzip')).name == 'fits'
+
+    (tmp_path / 'notes').write_text('some notes')
+    assert registry.find(str(tmp_path / 'notes')) is None
+
+
+def test_metadata_compressed(tmp_path):
+    path = write_raw_frame(tmp_path, 1)
+    with fits.open(path) as hdulist:
+        header = hdulist[0].header
+        fits.HDUList([fits.PrimaryHDU(), fits.CompImageHDU(numpy.zeros((16, 16), dtype='f4'), header=header)]
+                     ).writeto(tmp_path / 'r0001.fits.fz')
+        hdulist.writeto(tmp_path / 'r0001.fits.gz')
+
+    for name in ['r0001.fits.fz', 'r0001.fits.gz']:
+        meta = metadata_fits(str(tmp_path / name), fake_drps())
+        assert meta['uuid'] == 'frame1'
+        assert meta['exptime'] == 10.0
+        assert classify_fits(str(tmp_path / name), fake_drps())['blckuuid'] == 'ob1'
+
+
+def test_metadata_lis(tmp_path):
+    path = tmp_path / 'MEGARA' / 'LR-B_ThNe.lis'
+    path.parent.mkdir()
+    path.write_text('4000.0 1.0\n5000.0 2.0\n')
+    drps = SimpleNamespace(query_all=lambda: {'MEGARA': None, 'EMIR': None})
+    meta = metadata_lis(str(path), drps)
+    assert meta['instrument'] == 'MEGARA'
+    assert meta['tags'] == {'vph': 'LR-B', 'speclamp': 'ThNe'}
+
+    other = tmp_path / 'LR-B_ThNe.lis'
+    shutil.copy(path, other)
+    with pytest.raises(ValueError):
+        metadata_lis(str(other), drps)
+    drps = SimpleNamespace(query_all=lambda: {'MEGARA': None})
+    assert metadata_lis(str(other), drps)['instrument'] == 'MEGARA'
+
+    # directories are matched ignoring case
+    lower = tmp_path / 'megara' / 'night1' / 'LR-B_ThNe.lis'
+    lower.parent.mkdir(parents=True)
+    shutil.copy(path, lower)
+    drps = SimpleNamespace(query_all=lambda: {'MEGARA': None, 'EMIR': None})
+    assert metadata_lis(str(lower), drps)['instrument'] == 'MEGARA'
+
+
+def test_fits_extractor_product(tmp_path, monkeypatch):
+    header = fits.Header()
+    header['INSTRUME'] = 'MEGARA'
+    header['NUMTYPE'] = 'MasterBias'
+    header['UUID'] = 'p1'
+    path = tmp_path / 'bias.fits'
+    fits.PrimaryHDU(numpy.zeros((4, 4)), header=header).writeto(path)
+
+    loaded = []
+    prodtype = SimpleNamespace(extract_db_info=lambda obj, keys: {'instrument': 'MEGARA', 'uuid': 'p1'})
+    drp = SimpleNamespace(datamodel=fake_drps().query_by_name('MEGARA').datamodel,
+                          pipelines={'default': SimpleNamespace(load_product_from_name=lambda name: prodtype)})
+    drps = SimpleNamespace(query_by_name=lambda name: drp)
+    monkeypatch.setattr(numina.store, 'load', lambda tipo, obj: loaded.append(obj))
+
+    # a product is loaded once, with its type
+    meta = FitsExtractor().extract(str(path), drps)
+    assert meta == {'instrument': 'MEGARA', 'uuid': 'p1', 'type': 'MasterBias'}
+    assert loaded == [str(path)]
+    # a frame is not
+    meta = FitsExtractor().extract(str(write_raw_frame(tmp_path, 1)), drps)
+    assert meta['blckuuid'] == 'ob1'
+    assert loaded == [str(path)]
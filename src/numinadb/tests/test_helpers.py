@@ -0,0 +1,153 @@
+import datetime
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy
+from astropy.io import fits
+import numina.store
+from numina.types.dataframe import DataFrame
+from numina.types.frame import DataFrameType
+from numina.types.product import DataProductMixin
+from numina.types.qc import QC
+
+from ..model import ObservingBlock, DataProcessingTask, DataProduct, ReductionResult
+from ..helpers import ProcessingTask, store_to
+
+
+class MasterBias(DataProductMixin, DataFrameType):
+    pass
+
+
+def create_result():
+    """A result with a product, a frame that is not a product and a QC"""
+    meta = {
+        'observation_date': datetime.datetime(2025, 3, 1, 20),
+        'uuid': '4b1a0c1e8d5e4a6c9d9f0e1a2b3c4d5e',
+        'quality_control': QC.GOOD,
+        'tags': {'insmode': 'LCB', 'vph': 'LR-B'}
+    }
+    stored = {
+        'master_bias': SimpleNamespace(dest='master_bias', type=MasterBias()),
+        'reduced_image': SimpleNamespace(dest='reduced_image', type=DataFrameType()),
+        'qc': SimpleNamespace(dest='qc', type=None),
+    }
+    return SimpleNamespace(
+        stored=lambda: stored,
+        master_bias=SimpleNamespace(meta=meta),
+        reduced_image=SimpleNamespace(meta=None),
+        qc=QC.PARTIAL
+    )
+
+
+def create_processing_task(session, task, tmp_path):
+    # only the attributes used by post_result_store
+    ptask = ProcessingTask.__new__(ProcessingTask)
+    ptask.session = session
+    ptask.observation = {'instrument': 'MEGARA', 'mode': 'MegaraBiasImage', 'observing_result': task.ob_id}
+    ptask.runinfo = {
+        'pipeline': 'default',
+        'recipe_full_name': 'megaradrp.recipes.calibration.bias.BiasRecipe',
+        'taskid': task.id,
+        'input_key': 'a' * 64,
+        'base_dir': str(tmp_path),
+        'results_dir': str(tmp_path / 'task_001_ob1' / 'results'),
+    }
+    return ptask
+
+
+def test_post_result_store(session, tmp_path):
+    task = DataProcessingTask(ob=ObservingBlock(id='ob1', instrument_id='MEGARA', mode='MegaraBiasImage'))
+    session.add(task)
+    session.commit()
+    task_id = task.id
+
+    ptask = create_processing_task(session, task, tmp_path)
+    saveres = {'master_bias': 'master_bias.fits', 'reduced_image': 'reduced_image.fits'}
+    ptask.post_result_store(create_result(), saveres)
+    session.commit()
+    session.expunge_all()
+
+    result = session.query(ReductionResult).one()
+    assert result.task_id == task_id
+    assert result.ob_id == 'ob1'
+    assert result.instrument_id == 'MEGARA'
+    assert result.pipeline == 'default'
+    assert result.qc == QC.PARTIAL
+    assert result.input_key == 'a' * 64
+    values = {value.name: value for value in result.values}
+    assert set(values) == {'master_bias', 'reduced_image'}
+    assert values['master_bias'].datatype == 'MasterBias'
+    assert values['master_bias'].contents == 'task_001_ob1/results/master_bias.fits'
+
+    # only the product is registered, with its metadata and tags
+    product = session.query(DataProduct).one()
+    assert product.datatype == 'MasterBias'
+    assert product.instrument_id == 'MEGARA'
+    assert product.pipeline == 'default'
+    assert product.task_id == task_id
+    assert product.contents == 'task_001_ob1/results/master_bias.fits'
+    assert product.dateobs == datetime.datetime(2025, 3, 1, 20)
+    assert product.uuid == '4b1a0c1e8d5e4a6c9d9f0e1a2b3c4d5e'
+    assert product.qc == QC.GOOD
+    assert product.result_value.id == values['master_bias'].id
+    assert {key: fact.value for key, fact in product.facts.items()} == {'insmode': 'LCB', 'vph': 'LR-B'}
+
+
+class RecordingType(object):
+    """A type whose values are written in text files, recording the threads"""
+
+    def __init__(self):
+        self.threads = set()
+
+    def _datatype_dump(self, obj, where):
+        self.threads.add(threading.get_ident())
+        time.sleep(0.05)
+        filename = where.destination + '.txt'
+        with open(filename, 'w') as fd:
+            fd.write(obj)
+        return filename
+
+
+def test_store_to_parallel(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    datatype = RecordingType()
+    names = ['value{}'.format(idx) for idx in range(8)]
+    stored = {name: SimpleNamespace(dest='dest_' + name, type=datatype) for name in names}
+    result = SimpleNamespace(stored=lambda: stored, **{name: 'content of ' + name for name in names})
+    where = SimpleNamespace(destination=None, result='result.json', task='task.json')
+
+    saveres = store_to(result, where, workers=4)
+
+    # in the order of stored, each with its own destination
+    assert list(saveres) == names
+    for name in names:
+        assert saveres[name] == 'dest_{}.txt'.format(name)
+        assert (tmp_path / saveres[name]).read_text() == 'content of ' + name
+    assert len(datatype.threads) > 1
+    assert where.destination is None
+
+
+def test_store_to_compress(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = numpy.arange(12, dtype='float32').reshape(3, 4)
+    stored = {
+        'master_bias': SimpleNamespace(dest='master_bias', type=DataFrameType()),
+        'notes': SimpleNamespace(dest='notes', type=RecordingType()),
+    }
+    result = SimpleNamespace(
+        stored=lambda: stored,
+        master_bias=DataFrame(frame=fits.HDUList([fits.PrimaryHDU(data)])),
+        notes='not an image'
+    )
+    where = SimpleNamespace(destination=None)
+
+    saveres = store_to(result, where, workers=2, compress=True)
+
+    assert saveres == {'master_bias': 'master_bias.fits.gz', 'notes': 'notes.txt'}
+    assert not (tmp_path / 'master_bias.fits').exists()
+    # gzip magic number
+    assert (tmp_path / 'master_bias.fits.gz').read_bytes()[:2] == b'\x1f\x8b'
+    frame = numina.store.load(DataFrameType(), saveres['master_bias'])
+    with frame.open() as hdulist:
+        assert numpy.array_equal(hdulist[0].data, data)
@@ -0,0 +1,349 @@
+import datetime
+from types import SimpleNamespace
+
+import numpy
+import pytest
+from astropy.io import fits
+from numina.datamodel import DataModel
+
+from .. import ingest
+from ..model import RecipeParameters, RecipeParameterValues, ParameterFact, ControlFile
+from ..model import ObservingBlock, DataProduct, Fact, Instrument
+from ..ingest import ingest_control_file, IngestPipeline, classify_fits, ingest_dir, ingest_dir_two_phase
+from ..ingest import update_ancestors
+from ..records import FrameRecord, ProductRecord
+
+
+CONTROL_FILE = """
+requirements:
+  MEGARA:
+    default:
+      MegaraArcCalibration:
+        - name: nlines
+          tags:
+            vph: LR-B
+            speclamp: ThNe
+          content: [20, 20]
+        - name: nlines
+          tags:
+            vph: LR-U
+          content: [10, 10]
+        - name: polynomial_degree
+          tags: {}
+          content: 5
+"""
+
+
+@pytest.fixture
+def control_file(tmp_path):
+    path = tmp_path / "control.yaml"
+    path.write_text(CONTROL_FILE)
+    return str(path)
+
+
+def test_ingest_control_file(session, control_file):
+    ingest_control_file(session, control_file)
+
+    assert session.query(RecipeParameters).count() == 2
+    assert session.query(RecipeParameterValues).count() == 3
+    assert session.query(ParameterFact).count() == 3
+
+    par = session.query(RecipeParameters).filter_by(name='nlines').one()
+    values = {value['vph']: value.content for value in par.values}
+    assert values == {'LR-B': [20, 20], 'LR-U': [10, 10]}
+
+
+def test_ingest_control_file_twice(session, control_file):
+    ingest_control_file(session, control_file)
+    ingest_control_file(session, control_file)
+
+    assert session.query(ControlFile).count() == 1
+    assert session.query(RecipeParameterValues).count() == 3
+
+
+def test_ingest_control_file_existing_parameter(session, control_file, tmp_path):
+    ingest_control_file(session, control_file)
+
+    other = tmp_path / "other.yaml"
+    other.write_text(CONTROL_FILE.replace('content: 5', 'content: 3'))
+    ingest_control_file(session, str(other))
+
+    # the changed value replaces the previous one, the equal values are kept
+    assert session.query(RecipeParameters).count() == 2
+    assert session.query(RecipeParameterValues).count() == 3
+    assert session.query(ParameterFact).count() == 3
+    par = session.query(RecipeParameters).filter_by(name='polynomial_degree').one()
+    assert [value.content for value in par.values] == [3]
+    par = session.query(RecipeParameters).filter_by(name='nlines').one()
+    values = {value['vph']: value.content for value in par.values}
+    assert values == {'LR-B': [20, 20], 'LR-U': [10, 10]}
+
+
+def test_ingest_control_file_new_tags(session, control_file, tmp_path):
+    ingest_control_file(session, control_file)
+
+    other = tmp_path / "other.yaml"
+    other.write_text(CONTROL_FILE.replace('vph: LR-U', 'vph: LR-V'))
+    ingest_control_file(session, str(other))
+
+    # a value with a new tag set is added
+    par = session.query(RecipeParameters).filter_by(name='nlines').one()
+    values = {value['vph']: value.content for value in par.values}
+    assert values == {'LR-B': [20, 20], 'LR-U': [10, 10], 'LR-V': [10, 10]}
+
+
+def make_frame(n, blckuuid='ob1'):
+    return FrameRecord(uuid='frame{}'.format(n), path='r{:04d}.fits'.format(n), blckuuid=blckuuid,
+                       instrument='MEGARA', mode='MegaraArcCalibration', object='arc',
+                       observation_date=datetime.datetime(2025, 3, 1, 20, n), exptime=10.0, darktime=12.0)
+
+
+def test_ingest_pipeline_frames(session, monkeypatch):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    pipeline = IngestPipeline(session, None, 'data', batch_size=2)
+    for n in [3, 1, 2, 1]:
+        pipeline.add_frame(make_frame(n))
+    pipeline.add_frame(make_frame(5, blckuuid='ob2'))
+    # two batches are written, one frame is pending
+    assert pipeline.pending() == 1
+    pipeline.flush()
+
+    ob = session.get(ObservingBlock, 'ob1')
+    assert sorted(frame.name for frame in ob.frames) == ['r0001.fits', 'r0002.fits', 'r0003.fits']
+    assert ob.start_time == datetime.datetime(2025, 3, 1, 20, 1)
+    assert ob.completion_time == datetime.datetime(2025, 3, 1, 20, 3, 12)
+    assert len(session.get(ObservingBlock, 'ob2').frames) == 1
+
+    # OBs of a previous ingestion are not modified
+    pipeline = IngestPipeline(session, None, 'data', batch_size=2)
+    pipeline.add_frame(make_frame(4))
+    pipeline.flush()
+    assert len(session.get(ObservingBlock, 'ob1').frames) == 3
+
+
+def test_ingest_pipeline_update_obs(session, monkeypatch):
+    tagged = []
+
+    def add_ob_facts(session, ob, datadir):
+        tagged.append(ob.id)
+        ob.facts.append(Fact(key='frames', value=str(len(ob.frames))))
+
+    monkeypatch.setattr(ingest, 'add_ob_facts', add_ob_facts)
+    pipeline = IngestPipeline(session, None, 'data')
+    for n in [1, 2]:
+        pipeline.add_frame(make_frame(n))
+    pipeline.add_frame(make_frame(5, blckuuid='ob2'))
+    pipeline.flush()
+
+    # continuous ingestion, new frames are appended to the OBs
+    pipeline = IngestPipeline(session, None, 'data', update_obs=True)
+    for n in [2, 3]:
+        pipeline.add_frame(make_frame(n))
+    pipeline.add_frame(make_frame(5, blckuuid='ob2'))
+    pipeline.flush()
+
+    ob = session.get(ObservingBlock, 'ob1')
+    assert sorted(frame.name for frame in ob.frames) == ['r0001.fits', 'r0002.fits', 'r0003.fits']
+    assert ob.completion_time == datetime.datetime(2025, 3, 1, 20, 3, 12)
+    # the facts are computed again, ob2 has no new frames
+    assert tagged == ['ob1', 'ob2', 'ob1']
+    assert [(fact.key, fact.value) for fact in ob.facts] == [('frames', '3')]
+
+
+def test_ingest_pipeline_products(session):
+    pipeline = IngestPipeline(session, None, 'data')
+    for uuid, path in [('p1', 'a.json'), ('p2', 'b.json'), ('p1', 'c.json')]:
+        meta = {'instrument': 'MEGARA', 'uuid': uuid, 'tags': {'vph': 'LR-B'}}
+        pipeline.add_product(path, ProductRecord.from_metadata('MasterBias', meta, path))
+    pipeline.flush()
+    products = session.query(DataProduct).order_by(DataProduct.id).all()
+    assert [prod.contents for prod in products] == ['a.json', 'b.json']
+    assert products[0]['vph'] == 'LR-B'
+    assert products[0].task_id is None
+    assert [ins.name for ins in session.query(Instrument)] == ['MEGARA']
+
+
+def write_raw_frame(dirname, n, blckuuid='ob1'):
+    header = fits.Header()
+    header['INSTRUME'] = 'MEGARA'
+    header['UUID'] = 'frame{}'.format(n)
+    header['BLCKUUID'] = blckuuid
+    header['OBSMODE'] = 'MegaraArcCalibration'
+    header['OBJECT'] = 'arc'
+    header['DATE-OBS'] = '2025-03-01T20:0{}:00'.format(n)
+    header['EXPTIME'] = 10.0
+    header['DARKTIME'] = 12.0
+    path = dirname / 'r{:04d}.fits'.format(n)
+    fits.PrimaryHDU(numpy.zeros((4, 4)), header=header).writeto(path)
+    return path
+
+
+@pytest.fixture
+def raw_dir(tmp_path):
+    for n in range(1, 4):
+        write_raw_frame(tmp_path, n)
+    return tmp_path
+
+
+def fake_drps():
+    drp = SimpleNamespace(datamodel=DataModel())
+    return SimpleNamespace(query_by_name=lambda name: drp)
+
+
+def test_classify_fits(raw_dir):
+    meta = classify_fits(str(raw_dir / 'r0001.fits'), fake_drps())
+    assert meta['uuid'] == 'frame1'
+    assert meta['blckuuid'] == 'ob1'
+    assert meta['type'] is None
+    assert 'exptime' not in meta
+
+
+def test_ingest_two_phase(session, raw_dir, monkeypatch):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    ingest_dir_two_phase(session, str(raw_dir), fake_drps(), batch_size=2, workers=2)
+
+    ob = session.get(ObservingBlock, 'ob1')
+    assert len(ob.frames) == 3
+    assert all(frame.exposure_time == 10.0 for frame in ob.frames)
+    assert ob.start_time == datetime.datetime(2025, 3, 1, 20, 1)
+    assert ob.completion_time == datetime.datetime(2025, 3, 1, 20, 3, 12)
+
+
+def test_update_ancestors(session):
+    def leaf(name, start, end, obj):
+        return ObservingBlock(id=name, instrument_id='MEGARA', mode='MegaraLcbImage', object=obj,
+                              start_time=datetime.datetime(2025, 3, 1, start),
+                              completion_time=datetime.datetime(2025, 3, 1, end))
+
+    root = ObservingBlock(id='root', instrument_id='MEGARA', mode='MegaraLcbAcquisition')
+    middle = ObservingBlock(id='middle', instrument_id='MEGARA', mode='MegaraLcbAcquisition')
+    other = ObservingBlock(id='other', instrument_id='MEGARA', mode='MegaraLcbAcquisition')
+    middle.children = [leaf('b1', 21, 22, 'NGC 7469'), leaf('b2', 22, 23, 'NGC 7469')]
+    root.children = [middle, leaf('c1', 20, 21, 'HD 1234')]
+    other.children = [leaf('d1', 1, 2, 'M 31')]
+    session.add_all([root, other])
+    session.commit()
+
+    update_ancestors(session, ['b2', 'c1'])
+
+    for name in ['root', 'middle']:
+        ob = session.get(ObservingBlock, name)
+        assert ob.completion_time == datetime.datetime(2025, 3, 1, 23)
+    root = session.get(ObservingBlock, 'root')
+    assert root.start_time == datetime.datetime(2025, 3, 1, 20)
+    assert root.object == 'HD 1234'
+    assert session.get(ObservingBlock, 'middle').object == 'NGC 7469'
+    # not an ancestor
+    assert session.get(ObservingBlock, 'other').start_time is None
+
+
+def test_ingest_events(session, events, monkeypatch):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    pipeline = IngestPipeline(session, None, 'data', batch_size=2)
+    pipeline.add_frame(make_frame(1))
+    pipeline.add_frame(make_frame(2))
+    # the full metadata extracted from the file
+    frame_meta = {'uuid': 'frame3', 'blckuuid': 'ob1', 'instrument': 'MEGARA', 'vph': 'LR-B'}
+    pipeline.add_frame(make_frame(3), meta=frame_meta)
+    meta = {'instrument': 'MEGARA', 'uuid': 'p1', 'tags': {}}
+    pipeline.add_product('a.json', ProductRecord.from_metadata('MasterBias', meta, 'a.json'))
+    pipeline.flush()
+
+    frame_ids = [frame.id for frame in session.get(ObservingBlock, 'ob1').frames]
+    [product] = session.query(DataProduct)
+    # a batch of two frames creates the OB, the third frame is added later
+    batches = [args for args, kwargs in events['on_ingest_batch_committed']]
+    assert [ob_ids for _, ob_ids, _ in batches] == [['ob1'], []]
+    assert sorted(frame_id for _, _, ids in batches for frame_id in ids) == sorted(frame_ids)
+    assert events['on_products_registered'] == [((session, [product.id]), {})]
+    metas = {uuid: meta for (_, uuid, meta), _ in events['on_ingest_raw_fits']}
+    assert set(metas) == {'frame1', 'frame2', 'frame3'}
+    assert metas['frame1'] == make_frame(1).metadata()
+    assert metas['frame1']['exptime'] == 10.0
+    assert metas['frame3'] == frame_meta
+
+
+def test_ingest_two_phase_rerun(session, raw_dir, events, monkeypatch):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    extracted = []
+    original = ingest.metadata_fits
+
+    def metadata_fits(path, drps):
+        extracted.append(path)
+        return original(path, drps)
+
+    monkeypatch.setattr(ingest, 'metadata_fits', metadata_fits)
+    ingest_dir_two_phase(session, str(raw_dir), fake_drps(), batch_size=2, workers=2)
+    assert len(extracted) == 3
+    # emitted once per frame, after the extraction of the full metadata
+    metas = {uuid: meta for (_, uuid, meta), _ in events['on_ingest_raw_fits']}
+    assert sorted(metas) == ['frame1', 'frame2', 'frame3']
+    assert all(meta['exptime'] == 10.0 for meta in metas.values())
+
+    # the frames in the database are not extracted again
+    write_raw_frame(raw_dir, 4, blckuuid='ob2')
+    ingest_dir_two_phase(session, str(raw_dir), fake_drps(), batch_size=2, workers=2)
+    assert extracted[3:] == [str(raw_dir / 'r0004.fits')]
+    assert len(events['on_ingest_raw_fits']) == 4
+    assert session.get(ObservingBlock, 'ob2').frames[0].exposure_time == 10.0
+
+
+def test_ingest_dir_skip_errors(session, raw_dir, monkeypatch, caplog):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    # the instrument of the catalog is unknown
+    (raw_dir / 'LR-B_ThNe.lis').write_text('4000.0 1.0\n')
+    drps = fake_drps()
+    drps.query_all = lambda: {'MEGARA': None, 'EMIR': None}
+
+    ingest_dir(session, str(raw_dir), drps=drps, workers=2)
+
+    assert len(session.get(ObservingBlock, 'ob1').frames) == 3
+    assert session.query(DataProduct).count() == 0
+    [record] = caplog.records
+    assert 'LR-B_ThNe.lis' in record.getMessage()
+
+
+def test_ingest_two_phase_skip_errors(session, raw_dir, monkeypatch, caplog):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    # no INSTRUME, the file can not be classified
+    fits.PrimaryHDU(numpy.zeros((4, 4))).writeto(raw_dir / 'noins.fits')
+    # a calibration, fake_drps can not load it with its type
+    header = fits.Header()
+    header['INSTRUME'] = 'MEGARA'
+    header['NUMTYPE'] = 'MasterBias'
+    header['UUID'] = 'p1'
+    fits.PrimaryHDU(numpy.zeros((4, 4)), header=header).writeto(raw_dir / 'bias.fits')
+    # the full metadata of a frame can not be extracted
+    metadata_fits = ingest.metadata_fits
+
+    def failing_metadata(path, drps):
+        if path.endswith('r0002.fits'):
+            raise OSError('truncated file')
+        return metadata_fits(path, drps)
+
+    monkeypatch.setattr(ingest, 'metadata_fits', failing_metadata)
+
+    ingest_dir_two_phase(session, str(raw_dir), fake_drps(), batch_size=2, workers=2)
+
+    ob = session.get(ObservingBlock, 'ob1')
+    assert len(ob.frames) == 3
+    assert ob.completion_time == datetime.datetime(2025, 3, 1, 20, 3, 12)
+    assert session.query(DataProduct).count() == 0
+    # logged in the order of the phases
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 3
+    assert 'noins.fits' in messages[0]
+    assert 'r0002.fits' in messages[1]
+    assert 'bias.fits' in messages[2]
+
+
+def test_add_metadata_keys(session):
+    pipeline = IngestPipeline(session, None, 'data')
+    meta = {'type': 'MasterBias', 'instrument': 'MEGARA', 'uuid': 'p1'}
+    # products are pending by uuid, those checked again by path
+    for path in ['a.json', 'b.json']:
+        ingest.add_metadata(pipeline, SimpleNamespace(recheck=False), path, meta)
+    for path in ['c.fits', 'd.fits']:
+        ingest.add_metadata(pipeline, SimpleNamespace(recheck=True), path, meta)
+    assert sorted(pipeline.products) == ['c.fits', 'd.fits', 'p1']
+    assert pipeline.products['p1'].path == 'b.json'
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from ..jsonio import dump_json, load_json_member, open_json
+
+
+TASK = {
+    'result': 'result.json',
+    'runinfo': {'taskid': 12, 'pipeline': 'default', 'values': [1.5, 2, None, True]},
+    'count': 123456789,
+    'observation': {'frames': ['frame_{}.fits'.format(idx) for idx in range(500)]}
+}
+
+
+@pytest.mark.parametrize("name", ['task.json', 'task.json.gz'])
+@pytest.mark.parametrize("compact", [True, False])
+def test_dump_json(tmp_path, name, compact):
+    path = str(tmp_path / name)
+    dump_json(TASK, path, compact=compact)
+    with open_json(path) as fd:
+        text = fd.read()
+    assert json.loads(text) == TASK
+    assert ('\n' not in text) == compact
+
+
+@pytest.mark.parametrize("name", ['task.json', 'task.json.gz'])
+@pytest.mark.parametrize("compact", [True, False])
+@pytest.mark.parametrize("chunk_size", [1, 7, 65536])
+def test_load_json_member(tmp_path, name, compact, chunk_size):
+    path = str(tmp_path / name)
+    dump_json(TASK, path, compact=compact)
+    for key in TASK:
+        assert load_json_member(path, key, chunk_size=chunk_size) == TASK[key]
+
+    with pytest.raises(KeyError):
+        load_json_member(path, 'missing', chunk_size=chunk_size)
+
+
+def test_load_json_member_stops(tmp_path):
+    path = str(tmp_path / 'task.json')
+    with open(path, 'w') as fd:
+        # invalid after the first member
+        fd.write('{"result": "result.json", "observation": ')
+    assert load_json_member(path, 'result') == 'result.json'
+    with pytest.raises(ValueError):
+        load_json_member(path, 'observation')
+
+
+def test_load_json_member_empty(tmp_path):
+    path = str(tmp_path / 'task.json')
+    with open(path, 'w') as fd:
+        fd.write(' { } ')
+    with pytest.raises(KeyError):
+        load_json_member(path, 'result')
@@ -0,0 +1,89 @@
+import math
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy import inspect
+from sqlalchemy.orm import sessionmaker
+
+from ..model import Base, DataProcessingTask, ObservingBlock, defer_json
+from ..jsonsqlite import JSONCodec, create_codec, get_codec, set_codec
+
+
+PAYLOAD = {
+    "id": "d1d0dc2c-fe6e-4b07-82f6-6db6ac5c0b5f",
+    "pipeline": "default",
+    "values": [1, 2.5, None, True, "text"],
+    "nested": {"logs": "task_001/results/processing.log"}
+}
+
+
+def available_codecs():
+    names = []
+    for name in ['json', 'orjson']:
+        try:
+            create_codec(name)
+            names.append(name)
+        except ImportError:
+            pass
+    return names
+
+
+@pytest.fixture
+def codec():
+    saved = get_codec()
+    yield
+    set_codec(saved.name)
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_codec_roundtrip(name):
+    codec = create_codec(name)
+    assert codec.name == name
+    assert codec.loads(codec.dumps(PAYLOAD)) == PAYLOAD
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_codec_fallback(name):
+    codec = create_codec(name)
+    # beyond 64 bits, not supported by orjson
+    value = {"big": 2 ** 70}
+    assert codec.loads(codec.dumps(value)) == value
+
+
+def test_codec_default():
+    codec = create_codec()
+    assert isinstance(codec, JSONCodec)
+    # orjson is opt-in
+    assert codec.name == 'json'
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_codec_nonfinite(name):
+    codec = create_codec(name)
+    value = {"mean": float('nan'), "max": [float('inf'), -float('inf')]}
+    result = codec.loads(codec.dumps(value))
+    assert math.isnan(result['mean'])
+    assert result['max'] == [float('inf'), -float('inf')]
+    # written by the standard library
+    assert math.isnan(codec.loads(JSONCodec().dumps(value))['mean'])
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_column_codec(codec, name):
+    set_codec(name)
+    engine = create_engine("sqlite:///:memory:", echo=False)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        ob = ObservingBlock(id='1', instrument_id='MEGARA', mode='bias')
+        task = DataProcessingTask(ob=ob, request=PAYLOAD, result=PAYLOAD)
+        session.add(task)
+        session.commit()
+        session.expunge_all()
+
+        task = session.query(DataProcessingTask).options(*defer_json(DataProcessingTask)).one()
+        unloaded = inspect(task).unloaded
+        assert 'request' in unloaded
+        assert 'result' in unloaded
+        assert task.request == PAYLOAD
+        assert task.result == PAYLOAD
@@ -0,0 +1,134 @@
+import datetime
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+from ..model import Base, Instrument, ObservingBlock, DataProcessingTask
+from ..lease import Heartbeat, is_stale, reset_tree, claimable_tasks_query, claim_task
+
+
+@pytest.fixture
+def engine(tmp_path):
+    # a file, so that the heartbeat connection sees the same database
+    engine = create_engine("sqlite:///{}".format(tmp_path / 'processing.db'), echo=False)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def session(engine):
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        yield session
+
+
+NOW = datetime.datetime(2025, 3, 1, 20, 0, 0)
+
+
+def create_tree(states):
+    ob = ObservingBlock(id='ob1', instrument_id='MEGARA', mode='MegaraLcbImage')
+    root = DataProcessingTask(ob=ob, state=states[0], result={'partial': True})
+    for state in states[1:]:
+        child = DataProcessingTask(ob=ob, state=state, result={'state': state})
+        root.children.append(child)
+    return root
+
+
+def test_is_stale():
+    task = DataProcessingTask(state=1, start_time=NOW, heartbeat=NOW)
+    assert not is_stale(task, lease=60, now=NOW + datetime.timedelta(seconds=30))
+    assert is_stale(task, lease=60, now=NOW + datetime.timedelta(seconds=90))
+    task.state = 2
+    assert not is_stale(task, lease=60, now=NOW + datetime.timedelta(seconds=90))
+
+
+def test_reset_tree():
+    root = create_tree([3, 2, 3, 0, 1])
+    root.children[3].heartbeat = NOW - datetime.timedelta(hours=1)
+
+    reset = reset_tree(root, lease=60, now=NOW)
+    assert [task.state for task in [root] + root.children] == [0, 2, 0, 0, 0]
+    assert len(reset) == 3
+    # finished tasks keep their results
+    assert root.children[0].result == {'state': 2}
+    assert root.result is None
+
+
+def test_reset_tree_running():
+    root = create_tree([0, 1])
+    root.children[0].heartbeat = NOW - datetime.timedelta(seconds=10)
+    with pytest.raises(ValueError):
+        reset_tree(root, lease=60, now=NOW)
+
+
+def test_heartbeat(engine, session):
+    root = create_tree([1])
+    session.add(root)
+    session.commit()
+    assert root.heartbeat is None
+
+    deadline = time.monotonic() + 10
+    with Heartbeat(engine, root.id, interval=0.01) as heartbeat:
+        while session.get(DataProcessingTask, root.id).heartbeat is None:
+            assert time.monotonic() < deadline
+            session.expire_all()
+    assert not heartbeat._thread.is_alive()
+
+
+def test_claim_query_skip_locked():
+    sql = str(claimable_tasks_query().compile(dialect=postgresql.dialect()))
+    assert sql.endswith('FOR UPDATE SKIP LOCKED')
+
+
+def test_claim_task(session):
+    root = create_tree([0, 0, 2, 0])
+    session.add(root)
+    session.commit()
+
+    claimed = [claim_task(session, host='node1') for _ in range(3)]
+    # children first, the root waits for them
+    assert [task.id for task in claimed[:2]] == [root.children[0].id, root.children[2].id]
+    assert claimed[2] is None
+    assert all(task.state == 1 and task.host == 'node1' for task in claimed[:2])
+
+    for task in claimed[:2]:
+        task.state = 2
+    session.commit()
+    assert claim_task(session) is root
+    assert claim_task(session) is None
+
+
+def _claim_all(uri):
+    engine = create_engine(uri)
+    Session = sessionmaker(bind=engine)
+    claimed = []
+    with Session() as session:
+        while True:
+            task = claim_task(session)
+            if task is None:
+                break
+            claimed.append(task.id)
+    engine.dispose()
+    return claimed
+
+
+def test_claim_task_concurrent(postgres_engine):
+    import concurrent.futures
+
+    uri = postgres_engine.url.render_as_string(hide_password=False)
+    Session = sessionmaker(bind=postgres_engine)
+    with Session() as session:
+        session.add(Instrument(name='MEGARA'))
+        ob = ObservingBlock(id='ob1', instrument_id='MEGARA', mode='MegaraLcbImage')
+        session.add_all([DataProcessingTask(ob=ob, state=0) for _ in range(50)])
+        session.commit()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(_claim_all, [uri] * 4))
+
+    claimed = [task_id for result in results for task_id in result]
+    assert len(claimed) == 50
+    assert len(set(claimed)) == 50
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+from ..model import ObservingBlock, Frame, DataProcessingTask
+from ..model import ReductionResult, ReductionResultValue
+from ..memo import recipe_input_key, find_reusable_result, link_result
+
+
+class Recipe:
+    __version__ = '1'
+
+
+def create_obsres():
+    frames = [Frame(name='r{}.fits'.format(idx), uuid='{:032d}'.format(idx)) for idx in range(3)]
+    return SimpleNamespace(instrument='MEGARA', mode='MegaraFiberFlatImage', pipeline='default', frames=frames)
+
+
+def test_recipe_input_key():
+    obsres = create_obsres()
+    resolved = {'master_bias': {'product': 12}, 'nlines': {'parameter': [20, 20]}}
+    key = recipe_input_key(obsres, Recipe(), resolved)
+    assert len(key) == 64
+    assert key == recipe_input_key(create_obsres(), Recipe(), dict(resolved))
+
+    other = dict(resolved, master_bias={'product': 13})
+    assert key != recipe_input_key(obsres, Recipe(), other)
+
+    obsres.frames.pop()
+    assert key != recipe_input_key(obsres, Recipe(), resolved)
+
+    class NewRecipe(Recipe):
+        __version__ = '2'
+
+    assert key != recipe_input_key(create_obsres(), NewRecipe(), resolved)
+
+
+def test_reuse_result(session):
+    ob = ObservingBlock(id='ob1', instrument_id='MEGARA', mode='MegaraFiberFlatImage')
+    failed = DataProcessingTask(ob=ob, state=3)
+    done = DataProcessingTask(ob=ob, state=2)
+    session.add_all([failed, done])
+    session.flush()
+
+    for task in [failed, done]:
+        result = ReductionResult(instrument_id='MEGARA', task=task, ob=ob, input_key='a' * 64)
+        result.values.append(ReductionResultValue(name='master_fiberflat', datatype='MasterFiberFlat',
+                                                  contents='task_{}/results/flat.fits'.format(task.id)))
+        session.add(result)
+    session.commit()
+
+    assert find_reusable_result(session, 'b' * 64) is None
+    previous = find_reusable_result(session, 'a' * 64)
+    assert previous.task_id == done.id
+
+    new_task = DataProcessingTask(ob=ob, state=1)
+    session.add(new_task)
+    session.flush()
+    linked = link_result(session, previous, new_task.id, ob.id)
+    session.commit()
+
+    assert new_task.reduction_result is linked
+    assert linked.input_key == previous.input_key
+    assert [value.contents for value in linked.values] == ['task_{}/results/flat.fits'.format(done.id)]
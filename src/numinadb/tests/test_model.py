@@ -1,32 +1,32 @@
-import pytest
-from sqlalchemy import create_engine
 from sqlalchemy import MetaData
-from sqlalchemy.orm import sessionmaker
 
 from ..model import Base
 
 
-@pytest.fixture
-def session():
-    database = "sqlite:///:memory:"
-    engine = create_engine(database, echo=False)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    try:
-        with Session() as session:
-            yield session
-    finally:
-        Base.metadata.drop_all(engine)
-
-
 def test_model(session):
     """Test expected tables are created"""
-    expected_tables = ['data_obs_fact', 'obs', 'instruments', 'fact', 'dp_task',
+    expected_tables = ['data_obs_fact', 'obs', 'instruments', 'fact', 'dp_task', 'dp_task_timing', 'control_files',
                        'frames', 'obs_alias', 'parameter_facts',
-                       'recipe_parameter_values', 'recipe_parameters',
+                       'recipe_parameter_values', 'recipe_parameters', 'recipe_parameter_index',
                        'product_facts', 'products', 'reduction_result_values',
                        'reduction_results']
     metadata = MetaData()
     metadata.reflect(bind=session.get_bind())
     tables = list(metadata.tables.keys())
     assert sorted(tables) == sorted(expected_tables)
+
+
+def test_foreign_key_types():
+    """Foreign keys have the type of the referenced column, as PostgreSQL requires"""
+    for table in Base.metadata.tables.values():
+        for column in table.columns:
+            for fkey in column.foreign_keys:
+                assert type(column.type)._type_affinity is type(fkey.column.type)._type_affinity, column
+
+
+def test_json_postgresql():
+    from sqlalchemy.dialects import postgresql
+    from ..model import DataProcessingTask
+
+    impl = DataProcessingTask.__table__.c.request.type.dialect_impl(postgresql.dialect())
+    assert isinstance(impl, postgresql.JSONB)
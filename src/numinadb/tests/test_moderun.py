@@ -0,0 +1,181 @@
+import argparse
+import configparser
+import datetime
+
+import pytest
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from .. import event
+from ..model import Base, ObservingBlock, DataProcessingTask, DataProduct
+from ..cli import moderun
+from ..cli.rundb import register
+
+
+def create_obs():
+    composite = ObservingBlock(id='ob2', instrument_id='MEGARA', mode='MegaraLcbAcquisition')
+    composite.children = [
+        ObservingBlock(id='ob2a', instrument_id='MEGARA', mode='MegaraLcbImage'),
+        ObservingBlock(id='ob2b', instrument_id='MEGARA', mode='MegaraLcbImage'),
+    ]
+    return [
+        ObservingBlock(id='ob1', instrument_id='MEGARA', mode='MegaraBiasImage'),
+        composite,
+        ObservingBlock(id='ob3', instrument_id='EMIR', mode='IMAGE_DITHER'),
+    ]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    register(subparsers, configparser.ConfigParser())
+    return parser.parse_args(argv)
+
+
+@pytest.mark.parametrize('command', [['id', 'ob1'], ['batch', 'ob1'], ['resume', '1'], ['worker']])
+def test_run_arguments(command):
+    args = parse_args(['rundb'] + command + ['--basedir', 'b', '--datadir', 'd', '--snapshot', 's',
+                                             '--nearest-in-time', 'MasterBias'])
+    assert (args.basedir, args.datadir, args.snapshot) == ('b', 'd', 's')
+    assert args.nearest_in_time == ['MasterBias']
+
+
+def test_generate_batch_tasks(session):
+    session.add_all(create_obs())
+    session.commit()
+
+    tasks = moderun.generate_batch_tasks(session, ['ob1', 'ob2'], {'pipeline': 'default'})
+
+    assert [task.ob_id for task in tasks] == ['ob1', 'ob2']
+    assert session.query(DataProcessingTask).filter_by(label='root').count() == 2
+    root = tasks[1]
+    assert root.method == 'reduction'
+    [node] = root.children
+    assert node.method == 'reductionOB'
+    assert node.request == {'id': 'ob2', 'pipeline': 'default'}
+    assert node.waiting
+    assert sorted(child.ob_id for child in node.children) == ['ob2a', 'ob2b']
+
+
+def test_select_obids(session):
+    session.add_all(create_obs())
+    session.commit()
+
+    args = parse_args(['rundb', 'batch', 'ob3', 'ob1', '--query', 'instrument=MEGARA root'])
+    assert moderun.select_obids(session, args) == ['ob3', 'ob1', 'ob2']
+
+
+def test_mode_run_batch(tmp_path, monkeypatch):
+    uri = 'sqlite:///{}'.format(tmp_path / 'processing.db')
+    engine = create_engine(uri)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        session.add_all(create_obs())
+        session.commit()
+
+    loaded = []
+
+    def get_system_drps():
+        loaded.append(None)
+        return {}
+
+    dals = set()
+    run = []
+
+    def run_task(session, task, dal):
+        dals.add(id(dal))
+        run.append(task.ob_id)
+        if task.ob_id == 'ob3':
+            raise ValueError('recipe failed')
+
+    monkeypatch.setattr(moderun.numina.drps, 'get_system_drps', get_system_drps)
+    monkeypatch.setattr(moderun, 'run_task', run_task)
+
+    args = parse_args(['rundb', '--db', uri, 'batch', 'ob1', 'ob3', '--query', 'instrument=MEGARA root',
+                       '--basedir', str(tmp_path)])
+    assert moderun.mode_run_batch(args, [], None) == 1
+
+    # each OB once, a failure does not stop the others, one DAL and one load of the DRPs
+    assert run == ['ob1', 'ob3', 'ob2']
+    assert len(dals) == 1
+    assert len(loaded) == 1
+    with sessionmaker(bind=engine)() as session:
+        assert session.query(DataProcessingTask).filter_by(label='root').count() == 3
+
+
+def test_mode_run_resume_running(tmp_path, capsys):
+    uri = 'sqlite:///{}'.format(tmp_path / 'processing.db')
+    engine = create_engine(uri)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        [obsres, *_] = create_obs()
+        root = DataProcessingTask(label='root', state=3, ob=obsres)
+        root.children = [DataProcessingTask(state=1, heartbeat=datetime.datetime.utcnow(), ob=obsres)]
+        session.add(root)
+        session.commit()
+        root_id = root.id
+
+    args = parse_args(['rundb', '--db', uri, 'resume', str(root_id), '--basedir', str(tmp_path)])
+    assert moderun.mode_run_resume(args, [], None) == 1
+
+    # a one-line error, and the tree is not modified
+    [line] = capsys.readouterr().out.splitlines()
+    assert line.startswith('cannot resume task {} : task '.format(root_id))
+    assert 'is running' in line
+    with sessionmaker(bind=engine)() as session:
+        assert session.get(DataProcessingTask, root_id).state == 3
+
+
+@pytest.fixture
+def file_session(tmp_path):
+    # a file, so that the heartbeat connection sees the same database
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'processing.db'))
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        yield session
+
+
+def test_run_task_events(file_session, events, monkeypatch):
+    session = file_session
+    [obsres, *_] = create_obs()
+    task = DataProcessingTask(method='reduction', ob=obsres)
+    session.add(task)
+    session.commit()
+
+    def reduction(request, dal, taskid, timer):
+        session.add(DataProduct(instrument_id='MEGARA', datatype='MasterBias', task_id=taskid,
+                                contents='master_bias.fits'))
+        return {'values': []}
+
+    monkeypatch.setitem(moderun.methods, 'reduction', reduction)
+    moderun.run_task(session, task, None)
+
+    assert task.state == 2
+    [product_id] = session.scalars(select(DataProduct.id))
+    assert events['on_task_claimed'] == [((session, [task.id]), {})]
+    assert events['on_products_registered'] == [((session, [product_id]), {})]
+    assert events['on_task_finished'] == [((session, [task.id]), {})]
+
+
+def test_run_task_handler_error(file_session, events, monkeypatch):
+    session = file_session
+    [obsres, *_] = create_obs()
+    task = DataProcessingTask(method='reduction', ob=obsres)
+    session.add(task)
+    session.commit()
+
+    def reduction(request, dal, taskid, timer):
+        raise ValueError('recipe failed')
+
+    def handler(session, task_ids):
+        raise RuntimeError('handler failed')
+
+    monkeypatch.setitem(moderun.methods, 'reduction', reduction)
+    event.manage('on_task_finished', handler)
+
+    # the error of the recipe, not the one of the handler
+    with pytest.raises(ValueError, match='recipe failed'):
+        moderun.run_task(session, task, None)
+    assert task.state == 3
+    assert task.completion_time is not None
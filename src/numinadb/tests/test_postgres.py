@@ -0,0 +1,99 @@
+"""Tests with PostgreSQL, see the postgres environment of tox.ini"""
+
+import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import inspect, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+from .. import ingest
+from ..model import Instrument, ObservingBlock, DataProcessingTask, RecipeParameterValues
+from ..model import DataProduct, ProductFact
+from ..dal import SqliteDAL, RANK_TIME
+from ..ingest import ingest_control_file, ingest_dir_two_phase, IngestPipeline
+from ..records import ProductRecord
+from ..schema import upgrade_schema, check_schema
+from .test_ingest import CONTROL_FILE, write_raw_frame, fake_drps
+
+
+def test_jsonb(postgres_engine):
+    columns = {column['name']: column['type'] for column in inspect(postgres_engine).get_columns('dp_task')}
+    assert isinstance(columns['request'], postgresql.JSONB)
+
+    Session = sessionmaker(bind=postgres_engine)
+    with Session() as session:
+        session.add(Instrument(name='MEGARA'))
+        ob = ObservingBlock(id='ob1', instrument_id='MEGARA', mode='MegaraLcbImage')
+        request = {'id': 'ob1', 'pipeline': 'default', 'tags': {'vph': 'LR-B'}, 'values': [1, 2.5, None]}
+        task = DataProcessingTask(ob=ob, request=request)
+        session.add(task)
+        session.commit()
+        task_id = task.id
+        session.expunge_all()
+
+        assert session.get(DataProcessingTask, task_id).request == request
+        # JSONB operators
+        found = session.scalars(select(DataProcessingTask.id).where(
+            DataProcessingTask.request['tags']['vph'].as_string() == 'LR-B'
+        )).all()
+        assert found == [task_id]
+
+
+def test_ingest(postgres_engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    control = tmp_path / 'control.yaml'
+    control.write_text(CONTROL_FILE.replace('MEGARA', 'EMIR'))
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    for n in range(1, 4):
+        write_raw_frame(raw_dir, n)
+
+    Session = sessionmaker(bind=postgres_engine)
+    with Session() as session:
+        # the foreign keys are enforced, the instruments are inserted by each ingestion
+        ingest_dir_two_phase(session, str(raw_dir), fake_drps(), batch_size=2, workers=2)
+        ingest_control_file(session, str(control))
+        pipeline = IngestPipeline(session, None, str(tmp_path))
+        meta = {'instrument': 'FRIDA', 'uuid': 'p1', 'tags': {'filter': 'J'}}
+        pipeline.add_product('a.json', ProductRecord.from_metadata('MasterDark', meta, 'a.json'))
+        pipeline.flush()
+
+        assert session.scalars(select(Instrument.name).order_by(Instrument.name)).all() == ['EMIR', 'FRIDA', 'MEGARA']
+        assert session.query(RecipeParameterValues).count() == 3
+        ob = session.get(ObservingBlock, 'ob1')
+        assert len(ob.frames) == 3
+        assert ob.start_time == datetime.datetime(2025, 3, 1, 20, 1)
+        assert ob.completion_time == datetime.datetime(2025, 3, 1, 20, 3, 12)
+        [product] = session.query(DataProduct)
+        assert product.task_id is None
+        assert product['filter'] == 'J'
+
+
+def test_upgrade_schema(postgres_engine):
+    assert upgrade_schema(postgres_engine) == []
+    check_schema(postgres_engine)
+
+
+def test_search_nearest(postgres_engine, tmp_path):
+    Session = sessionmaker(bind=postgres_engine)
+    with Session() as session:
+        session.add(Instrument(name='MEGARA'))
+        session.commit()
+        start = datetime.datetime(2025, 3, 1)
+        for day in range(120):
+            prod = DataProduct(instrument_id='MEGARA', datatype='MasterBias', task_id=None,
+                               contents='bias_{}.fits'.format(day))
+            prod.dateobs = start + datetime.timedelta(days=day)
+            prod.facts = {'vph': ProductFact(key='vph', value='LR-B' if day % 40 == 0 else 'LR-U')}
+            session.add(prod)
+        session.commit()
+
+        dal = SqliteDAL('test', session, basedir=str(tmp_path), datadir=str(tmp_path),
+                        product_ranking={'MasterBias': RANK_TIME}, drps={})
+        tipo = SimpleNamespace(name=lambda: 'MasterBias')
+        # the facts are loaded while the products are read in batches
+        for when, expected in [(start + datetime.timedelta(days=65), 'bias_80.fits'),
+                               (start + datetime.timedelta(days=55), 'bias_40.fits')]:
+            _, path, _ = dal.locate_prod_type_tags(tipo, 'MEGARA', {'vph': 'LR-B'}, 'default', when=when)
+            assert path == str(tmp_path / expected)
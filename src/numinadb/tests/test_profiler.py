@@ -0,0 +1,54 @@
+import io
+
+from sqlalchemy import create_engine, text
+
+from ..profiler import SQLProfiler, normalize_statement
+
+
+def test_normalize_statement():
+    stmt1 = "SELECT obs.id FROM obs\n WHERE obs.id IN (?, ?, ?) AND obs.mode = 'bias' LIMIT 10"
+    stmt2 = "SELECT obs.id FROM obs WHERE obs.id IN (?) AND obs.mode = 'dark' LIMIT 1"
+    assert normalize_statement(stmt1) == normalize_statement(stmt2)
+
+    stmt1 = "INSERT INTO fact (key, value) VALUES (?, ?), (?, ?), (?, ?)"
+    stmt2 = "INSERT INTO fact (key, value) VALUES (?, ?)"
+    assert normalize_statement(stmt1) == normalize_statement(stmt2)
+
+    assert normalize_statement("SELECT max(id) AS max_1 FROM t1") == "SELECT max(id) AS max_1 FROM t1"
+
+
+def test_profiler():
+    engine = create_engine("sqlite:///:memory:", echo=False)
+    profiler = SQLProfiler(threshold=5)
+    profiler.attach(engine)
+
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE t1 (id INTEGER PRIMARY KEY, value VARCHAR)"))
+        with profiler.scope('search'):
+            for idx in range(8):
+                conn.execute(text("SELECT value FROM t1 WHERE id = :id"), dict(id=idx))
+        with profiler.scope('search_once'):
+            conn.execute(text("SELECT value FROM t1 WHERE id = 1"))
+
+    profiler.detach(engine)
+
+    stmt = normalize_statement("SELECT value FROM t1 WHERE id = ?")
+    assert profiler.stats[stmt].count == 9
+    assert profiler.repeated == {('search', stmt): 8}
+
+    fd = io.StringIO()
+    profiler.report(fd)
+    report = fd.getvalue()
+    assert 'SQL profile: 10 statements' in report
+    assert 'possible N+1 patterns' in report
+
+
+def test_profiler_wrap():
+    profiler = SQLProfiler()
+
+    class Calls:
+        def call(self, value):
+            return profiler._scopes()[-1][0], value
+
+    calls = profiler.wrap(Calls(), ['call'])
+    assert calls.call(1) == ('call', 1)
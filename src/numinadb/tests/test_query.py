@@ -0,0 +1,113 @@
+import datetime
+
+import pytest
+
+from ..model import ObservingBlock, Frame, Fact, DataProcessingTask, ReductionResult
+from ..query import parse_query, select_obs, find_obs, find_frames
+
+
+@pytest.fixture
+def session(session):
+    session.add_all(create_obs())
+    session.commit()
+    return session
+
+
+def create_obs():
+    start = datetime.datetime(2025, 3, 1, 20, 0, 0)
+    obs = []
+    for idx, (ins, mode, obj) in enumerate([
+        ('MEGARA', 'MegaraBiasImage', 'BIAS'),
+        ('MEGARA', 'MegaraFiberFlatImage', 'FLAT'),
+        ('MEGARA', 'MegaraLcbImage', 'NGC 7469'),
+        ('EMIR', 'IMAGE_DITHER', 'NGC 7469'),
+    ]):
+        ob = ObservingBlock(id='ob{}'.format(idx), instrument_id=ins, mode=mode, object=obj,
+                            start_time=start + datetime.timedelta(hours=idx),
+                            completion_time=start + datetime.timedelta(hours=idx, minutes=30))
+        obs.append(ob)
+
+    obs[0].facts.append(Fact(key='speed', value='normal'))
+    vph = Fact(key='vph', value='LR-B')
+    obs[1].facts.append(vph)
+    obs[2].facts.append(vph)
+    obs[3].parent_id = obs[2].id
+
+    task = DataProcessingTask(ob=obs[0])
+    result = ReductionResult(instrument_id='MEGARA', task=task, ob=obs[0])
+    return obs + [task, result]
+
+
+def test_parse_query():
+    terms = parse_query('instrument=MEGARA "object=NGC 7469"')
+    assert terms == [('instrument', '=', 'MEGARA'), ('object', '=', 'NGC 7469')]
+
+    with pytest.raises(ValueError):
+        parse_query('instrument')
+    with pytest.raises(ValueError):
+        parse_query('color=red')
+    with pytest.raises(ValueError):
+        parse_query('start>=yesterday')
+    with pytest.raises(ValueError):
+        parse_query('fact.vph!=LR-B')
+
+    terms = parse_query('start>=2025-03-01 pending')
+    assert terms == [('start', '>=', datetime.datetime(2025, 3, 1)), ('pending', None, None)]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ('instrument=MEGARA', ['ob0', 'ob1', 'ob2']),
+    ('instrument=MEGARA mode=MegaraFiberFlatImage', ['ob1']),
+    ('"object=NGC 7469"', ['ob2', 'ob3']),
+    ('', ['ob0', 'ob1', 'ob2', 'ob3']),
+    ('instrument!=MEGARA', ['ob3']),
+    ('start>=2025-03-01T21:00 start<2025-03-01T23:00', ['ob1', 'ob2']),
+    ('end<=2025-03-01T21:30', ['ob0', 'ob1']),
+    ('fact.vph=LR-B', ['ob1', 'ob2']),
+    ('fact.vph=LR-B fact.speed=normal', []),
+    ('instrument=MEGARA pending', ['ob1', 'ob2']),
+    ('reduced', ['ob0']),
+    ('root', ['ob0', 'ob1', 'ob2']),
+])
+def test_select_obs(session, query, expected):
+    assert select_obs(session, query) == expected
+
+
+@pytest.mark.parametrize("criteria, expected", [
+    (dict(instrument='MEGARA'), ['ob0', 'ob1', 'ob2']),
+    (dict(instrument='MEGARA', mode='MegaraLcbImage'), ['ob2']),
+    (dict(object='NGC 7469'), ['ob2', 'ob3']),
+    (dict(start=datetime.datetime(2025, 3, 1, 21), end=datetime.datetime(2025, 3, 1, 23)), ['ob1', 'ob2']),
+    (dict(), ['ob0', 'ob1', 'ob2', 'ob3']),
+])
+def test_find_obs(session, criteria, expected):
+    for page_size in [1, 2, 10]:
+        rows = list(find_obs(session, page_size=page_size, **criteria))
+        assert [row.id for row in rows] == expected
+
+
+def test_find_obs_same_start(session):
+    start = datetime.datetime(2025, 3, 2, 20)
+    session.add_all([
+        ObservingBlock(id='ob{}'.format(idx), instrument_id='EMIR', mode='IMAGE_DITHER', start_time=start)
+        for idx in range(10, 15)
+    ])
+    session.commit()
+    rows = find_obs(session, instrument='EMIR', start=start, page_size=2)
+    assert [row.id for row in rows] == ['ob10', 'ob11', 'ob12', 'ob13', 'ob14']
+
+    rows = find_obs(session, instrument='EMIR', after=(start, 'ob12'), page_size=2)
+    assert [row.id for row in rows] == ['ob13', 'ob14']
+
+
+def test_find_frames(session):
+    start = datetime.datetime(2025, 3, 1, 20, 0, 0)
+    for idx in range(4):
+        session.add(Frame(name='frame{}.fits'.format(idx), ob_id='ob{}'.format(idx), object='NGC 7469',
+                          start_time=start + datetime.timedelta(hours=idx)))
+    session.commit()
+
+    rows = list(find_frames(session, instrument='MEGARA', object='NGC 7469', page_size=2))
+    assert [row.name for row in rows] == ['frame0.fits', 'frame1.fits', 'frame2.fits']
+    rows = list(find_frames(session, start=datetime.datetime(2025, 3, 1, 22)))
+    assert [row.name for row in rows] == ['frame2.fits', 'frame3.fits']
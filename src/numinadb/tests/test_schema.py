@@ -0,0 +1,87 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from ..model import Base
+from ..cli.modedb import create_db
+from ..schema import upgrade_schema, check_schema, SchemaError
+
+
+def create_old_db(tmp_path, table, column):
+    """A database created before the column was added to the table"""
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'old.db'))
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for index in Base.metadata.tables[table].indexes:
+            if column in index.columns:
+                conn.execute(text('DROP INDEX {}'.format(index.name)))
+        conn.execute(text('ALTER TABLE {} DROP COLUMN {}'.format(table, column)))
+    return engine
+
+
+def test_upgrade_input_key(tmp_path):
+    engine = create_old_db(tmp_path, 'reduction_results', 'input_key')
+    with pytest.raises(SchemaError, match='reduction_results.input_key'):
+        check_schema(engine)
+
+    assert upgrade_schema(engine) == ['ALTER TABLE reduction_results ADD COLUMN input_key CHAR(64)']
+
+    check_schema(engine)
+    indexes = inspect(engine).get_indexes('reduction_results')
+    assert ['input_key'] in [index['column_names'] for index in indexes]
+    # nothing left to upgrade
+    assert upgrade_schema(engine) == []
+
+
+def test_upgrade_heartbeat(tmp_path):
+    engine = create_old_db(tmp_path, 'dp_task', 'heartbeat')
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO dp_task (id, state, create_time, ob_id) VALUES (1, 1, '2025-03-01', 'ob1')"))
+
+    assert upgrade_schema(engine) == ['ALTER TABLE dp_task ADD COLUMN heartbeat DATETIME']
+
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT heartbeat FROM dp_task')).all() == [(None,)]
+
+
+def test_upgrade_types(tmp_path):
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'old.db'))
+    Base.metadata.create_all(engine)
+    # the tables with the old types of the foreign keys
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE data_obs_fact'))
+        conn.execute(text('DROP TABLE recipe_parameter_values'))
+        conn.execute(text('CREATE TABLE data_obs_fact (obs_id INTEGER, fact_id INTEGER, '
+                          'PRIMARY KEY (obs_id, fact_id))'))
+        conn.execute(text('CREATE TABLE recipe_parameter_values (id INTEGER PRIMARY KEY, '
+                          'param_id VARCHAR NOT NULL, content TEXT NOT NULL)'))
+        conn.execute(text("INSERT INTO data_obs_fact VALUES (12, 1), ('ob1', 2)"))
+        conn.execute(text("INSERT INTO recipe_parameter_values VALUES (1, '3', '[10, 10]')"))
+    with pytest.raises(SchemaError, match='data_obs_fact.obs_id, recipe_parameter_values.param_id'):
+        check_schema(engine)
+
+    statements = upgrade_schema(engine)
+
+    assert len(statements) == 8
+    check_schema(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text('SELECT obs_id, typeof(obs_id), fact_id FROM data_obs_fact ORDER BY fact_id'))
+        assert rows.all() == [('12', 'text', 1), ('ob1', 'text', 2)]
+        rows = conn.execute(text('SELECT id, param_id, typeof(param_id), content FROM recipe_parameter_values'))
+        assert rows.all() == [(1, 3, 'integer', '[10, 10]')]
+    assert upgrade_schema(engine) == []
+
+
+def test_upgrade_pipeline(tmp_path, capsys):
+    engine = create_old_db(tmp_path, 'products', 'pipeline')
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO products (id, instrument_id, datatype, contents, priority) "
+                          "VALUES (1, 'MEGARA', 'MasterBias', 'master_bias.fits', 0)"))
+
+    create_db(str(engine.url))
+
+    assert "ALTER TABLE products ADD COLUMN pipeline VARCHAR DEFAULT 'default' NOT NULL" in capsys.readouterr().out
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT pipeline FROM products')).all() == [('default',)]
+    # the indexes on the new column
+    indexes = {index['name'] for index in inspect(engine).get_indexes('products')}
+    assert {'ix_products_lookup_priority', 'ix_products_lookup_dateobs'} <= indexes
@@ -0,0 +1,71 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from ..model import Base, ObservingBlock, ObservingBlockAlias, DataProduct
+from ..ingest import ingest_control_file
+from ..dal import SqliteDAL
+from ..snapshot import export_snapshot, open_snapshot, SNAPSHOT_TABLES
+from .test_ingest import CONTROL_FILE
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / 'processing.db'), echo=False)
+    Base.metadata.create_all(engine)
+    path = tmp_path / "control.yaml"
+    path.write_text(CONTROL_FILE)
+    with sessionmaker(bind=engine)() as session:
+        ingest_control_file(session, str(path))
+        session.add(ObservingBlock(id='ob1', instrument_id='MEGARA', mode='MegaraArcCalibration'))
+        session.add(ObservingBlockAlias(uuid='ob1', alias='arc'))
+        session.commit()
+    return engine
+
+
+def test_export_snapshot(engine, tmp_path):
+    path = str(tmp_path / 'snapshot.db')
+    nrows = export_snapshot(engine, path)
+    assert nrows > 0
+    assert os.stat(path).st_mode & 0o222 == 0
+
+    tables = inspect(create_engine('sqlite:///{}'.format(path))).get_table_names()
+    assert sorted(tables) == sorted(SNAPSHOT_TABLES)
+
+    # a second export replaces the snapshot
+    assert export_snapshot(engine, path) == nrows
+
+
+def test_dal_snapshot(engine, tmp_path):
+    path = str(tmp_path / 'snapshot.db')
+    export_snapshot(engine, path)
+    lookup_session = open_snapshot(path)()
+
+    with sessionmaker(bind=engine)() as session:
+        dal = SqliteDAL('test', session, basedir=str(tmp_path), datadir=str(tmp_path),
+                        lookup_session=lookup_session)
+        reference = SqliteDAL('test', session, basedir=str(tmp_path), datadir=str(tmp_path), drps=dal.drps)
+
+        args = ('nlines', None, 'MEGARA', 'MegaraArcCalibration', 'default', {'vph': 'LR-U'})
+        assert dal.search_param_type_tags(*args).content == reference.search_param_type_tags(*args).content
+
+        ob = dal.search_oblock_from_id('arc')
+        assert ob.id == 'ob1'
+        assert ob in lookup_session
+
+        # a product registered after the snapshot, i.e. by an earlier task
+        session.add(DataProduct(instrument_id='MEGARA', datatype='MasterBias', task_id=None,
+                                contents='master_bias.fits'))
+        session.commit()
+        tipo = SimpleNamespace(name=lambda: 'MasterBias')
+        _, path, _ = dal.locate_prod_type_tags(tipo, 'MEGARA', {}, 'default')
+        assert path == os.path.join(str(tmp_path), 'master_bias.fits')
+
+    # the snapshot is read-only
+    ob.mode = 'MegaraLcbImage'
+    with pytest.raises(OperationalError):
+        lookup_session.commit()
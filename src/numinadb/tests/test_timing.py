@@ -0,0 +1,39 @@
+import pytest
+
+from ..model import DataProcessingTask, DataProcessingTaskTiming, ObservingBlock
+from ..timing import TaskTimer, timing_summary
+
+
+def test_timer_span():
+    timer = TaskTimer()
+    with timer.span('dal'):
+        pass
+    with pytest.raises(ValueError):
+        with timer.span('run_recipe'):
+            raise ValueError
+    assert [span[0] for span in timer.spans] == ['dal', 'run_recipe']
+    assert all(span[2] >= 0 for span in timer.spans)
+
+
+def test_timing_summary(session):
+    ob = ObservingBlock(id='1', instrument_id='MEGARA', mode='bias')
+    tasks = [DataProcessingTask(ob=ob) for _ in range(2)]
+    session.add_all(tasks)
+    session.flush()
+
+    for task in tasks:
+        timer = TaskTimer()
+        for stage in ['dal', 'run_recipe', 'dal']:
+            with timer.span(stage):
+                pass
+        timer.store(session, task.id)
+        assert timer.spans == []
+    session.commit()
+
+    assert session.query(DataProcessingTaskTiming).count() == 6
+
+    summary = {row[0]: row[1] for row in timing_summary(session)}
+    assert summary == {'dal': 4, 'run_recipe': 2}
+
+    summary = {row[0]: row[1] for row in timing_summary(session, task_ids=[tasks[0].id])}
+    assert summary == {'dal': 2, 'run_recipe': 1}
@@ -0,0 +1,131 @@
+import threading
+
+import pytest
+
+from .. import ingest
+from ..model import ObservingBlock
+from ..ingest import IngestPipeline
+from ..watch import InotifyWatcher, PollingWatcher, watch_dir
+from .test_ingest import fake_drps, write_raw_frame
+
+
+def test_polling_watcher(tmp_path):
+    (tmp_path / 'old.json').write_text('{}')
+    watcher = PollingWatcher(str(tmp_path), interval=0)
+    path = tmp_path / 'new.json'
+    path.write_text('{}')
+    # reported when unchanged between two scans
+    assert watcher.poll(timeout=0) == []
+    assert watcher.poll(timeout=0) == [str(path)]
+    assert watcher.poll(timeout=0) == []
+
+
+def test_inotify_watcher(tmp_path):
+    try:
+        watcher = InotifyWatcher(str(tmp_path))
+    except (OSError, AttributeError, TypeError):
+        pytest.skip('inotify not available')
+    with watcher:
+        (tmp_path / 'a.json').write_text('{}')
+        subdir = tmp_path / 'night1'
+        subdir.mkdir()
+        (subdir / 'b.json').write_text('{}')
+        paths = set()
+        for _ in range(10):
+            paths.update(watcher.poll(timeout=0.1))
+    assert paths == {str(tmp_path / 'a.json'), str(subdir / 'b.json')}
+
+
+def test_watch_dir(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    stop = threading.Event()
+
+    class Watcher(PollingWatcher):
+        # write frames when watching, stop after the second batch
+        polls = 0
+
+        def poll(self, timeout):
+            self.polls += 1
+            if self.polls in (1, 4):
+                write_raw_frame(tmp_path, self.polls)
+            elif self.polls == 8:
+                stop.set()
+            return super().poll(timeout)
+
+    watcher = Watcher(str(tmp_path), interval=0)
+    watch_dir(session, str(tmp_path), drps=fake_drps(), watcher=watcher, debounce=0, stop=stop)
+
+    ob = session.get(ObservingBlock, 'ob1')
+    assert sorted(frame.name for frame in ob.frames) == ['r0001.fits', 'r0004.fits']
+
+
+def test_watch_dir_retry(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    stop = threading.Event()
+
+    class Pipeline(IngestPipeline):
+        # the first transaction fails
+        failures = 1
+
+        def flush(self):
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError('database is locked')
+            super().flush()
+
+    class Watcher(PollingWatcher):
+        polls = 0
+
+        def poll(self, timeout):
+            self.polls += 1
+            if self.polls == 1:
+                write_raw_frame(tmp_path, 1)
+            elif self.polls == 8:
+                stop.set()
+            return super().poll(timeout)
+
+    pipeline = Pipeline(session, fake_drps(), str(tmp_path))
+    watcher = Watcher(str(tmp_path), interval=0)
+    watch_dir(session, str(tmp_path), watcher=watcher, pipeline=pipeline, debounce=0, stop=stop)
+
+    assert pipeline.failures == 0
+    ob = session.get(ObservingBlock, 'ob1')
+    assert [frame.name for frame in ob.frames] == ['r0001.fits']
+
+
+def test_watch_dir_commit_fails(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'add_ob_facts', lambda session, ob, datadir: None)
+    stop = threading.Event()
+    # the first commit, of the frames, fails
+    commit = session.commit
+    failures = []
+
+    def failing_commit():
+        if not failures:
+            failures.append(True)
+            raise RuntimeError('database is locked')
+        commit()
+
+    monkeypatch.setattr(session, 'commit', failing_commit)
+
+    class Watcher(PollingWatcher):
+        polls = 0
+
+        def poll(self, timeout):
+            self.polls += 1
+            if self.polls == 1:
+                # a full batch
+                write_raw_frame(tmp_path, 1)
+                write_raw_frame(tmp_path, 2)
+            elif self.polls == 8:
+                stop.set()
+            return super().poll(timeout)
+
+    watcher = Watcher(str(tmp_path), interval=0)
+    watch_dir(session, str(tmp_path), drps=fake_drps(), watcher=watcher, debounce=0, batch_size=2, stop=stop)
+
+    assert failures == [True]
+    # only the committed rows
+    session.rollback()
+    ob = session.get(ObservingBlock, 'ob1')
+    assert sorted(frame.name for frame in ob.frames) == ['r0001.fits', 'r0002.fits']
@@ -0,0 +1,74 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Timing of the stages of processing tasks."""
+
+import contextlib
+import datetime
+import logging
+import time
+
+from sqlalchemy import func
+
+from .model import DataProcessingTaskTiming
+
+
+_logger = logging.getLogger(__name__)
+
+
+class TaskTimer(object):
+    """Record the duration of the stages of a task.
+
+    Stages are recorded with the context manager ``span``::
+
+        timer = TaskTimer()
+        with timer.span('build_recipe_input'):
+            ...
+
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        start_time = datetime.datetime.utcnow()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - t0
+            _logger.debug('stage %s took %.3f s', stage, duration)
+            self.spans.append((stage, start_time, duration))
+
+    def store(self, session, task_id):
+        """Add the recorded spans to the session and clear them"""
+        session.add_all([
+            DataProcessingTaskTiming(task_id=task_id, stage=stage, start_time=start_time, duration=duration)
+            for stage, start_time, duration in self.spans
+        ])
+        self.spans = []
+
+
+def timing_summary(session, task_ids=None):
+    """Count, total, mean and maximum duration of each stage.
+
+    If `task_ids` is given, only those tasks are considered.
+    """
+    timing = DataProcessingTaskTiming
+    query = session.query(
+        timing.stage,
+        func.count(timing.id),
+        func.sum(timing.duration),
+        func.avg(timing.duration),
+        func.max(timing.duration)
+    )
+    if task_ids is not None:
+        query = query.filter(timing.task_id.in_(task_ids))
+    return query.group_by(timing.stage).order_by(func.sum(timing.duration).desc()).all()
@@ -0,0 +1,264 @@
+#
+# Copyright 2025 Universidad Complutense de Madrid
+#
+# This file is part of Numina DB
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# License-Filename: LICENSE.txt
+#
+
+"""Continuous ingestion of the files written in a directory."""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+
+import numina.drps
+
+from .ingest import IngestPipeline, INGEST_BATCH_SIZE, ingest_file
+
+
+_logger = logging.getLogger(__name__)
+
+# Seconds without new files before ingesting the pending ones
+DEBOUNCE = 2.0
+
+# Maximum seconds a file waits to be ingested
+MAX_DELAY = 10.0
+
+# Times the files of a batch that can not be stored are ingested again
+MAX_RETRIES = 3
+
+# Seconds between scans of PollingWatcher
+POLL_INTERVAL = 5.0
+
+# inotify constants, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_event_header = struct.Struct('iIII')
+
+
+def _walk_files(path):
+    for dirname, dirnames, files in os.walk(path):
+        for fname in files:
+            yield os.path.join(dirname, fname)
+
+
+class InotifyWatcher(object):
+    """Report files closed after writing, or moved, under a directory.
+
+    Uses inotify, through ctypes. New subdirectories are watched too.
+    Raises OSError if inotify is not available.
+    """
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, path):
+        libname = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.path = path
+        self.dirs = {}
+        for dirname, dirnames, files in os.walk(path):
+            self.add_watch(dirname)
+
+    def add_watch(self, dirname):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirname), self.mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), dirname)
+        self.dirs[wd] = dirname
+
+    def poll(self, timeout):
+        """Paths of the files written, waiting at most timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, size = _event_header.unpack_from(data, pos)
+            pos += _event_header.size
+            name = os.fsdecode(data[pos:pos + size].rstrip(b'\0'))
+            pos += size
+
+            if mask & IN_Q_OVERFLOW:
+                _logger.warning('inotify queue overflow, scanning %s', self.path)
+                paths.extend(_walk_files(self.path))
+                continue
+            dirname = self.dirs.get(wd)
+            if dirname is None:
+                continue
+            fullname = os.path.join(dirname, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # files may be written before the watch is added
+                    for subdir, dirnames, files in os.walk(fullname):
+                        self.add_watch(subdir)
+                    paths.extend(_walk_files(fullname))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                paths.append(fullname)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class PollingWatcher(object):
+    """Report new or modified files under a directory, scanning it periodically.
+
+    A file is reported when its size and modification time did not
+    change between two scans, so files being written are not reported.
+    """
+
+    def __init__(self, path, interval=POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.last_scan = None
+        self.pending = {}
+        self.reported = self.scan()
+
+    def scan(self):
+        stats = {}
+        for path in _walk_files(self.path):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stats[path] = (st.st_size, st.st_mtime_ns)
+        self.last_scan = time.monotonic()
+        return stats
+
+    def poll(self, timeout):
+        """Paths of the files written, waiting at most timeout seconds"""
+        wait = self.last_scan + self.interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+
+        paths = []
+        stats = self.scan()
+        for path, stat in stats.items():
+            if self.reported.get(path) == stat:
+                continue
+            if self.pending.get(path) == stat:
+                self.reported[path] = stat
+                paths.append(path)
+        self.pending = {path: stat for path, stat in stats.items() if self.reported.get(path) != stat}
+        return paths
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def create_watcher(path, polling=False):
+    """Create an InotifyWatcher, or a PollingWatcher if inotify is not available"""
+    if not polling:
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError, TypeError):
+            _logger.info('inotify not available, watching %s by polling', path)
+    return PollingWatcher(path)
+
+
+def watch_dir(session, path, drps=None, watcher=None, pipeline=None,
+              debounce=DEBOUNCE, max_delay=MAX_DELAY, batch_size=INGEST_BATCH_SIZE, stop=None):
+    """Ingest the files written under path, until stop is set.
+
+    Files are collected until no new file arrives for `debounce` seconds,
+    the oldest has waited `max_delay` seconds or `batch_size` are pending.
+    Then they are ingested, and written in one flush of the pipeline,
+    which does not write batches by itself. Files that can not be
+    ingested are logged and skipped. If the flush fails, the files
+    are ingested again with the next batch, at most MAX_RETRIES times.
+    Files existing before the watch are not ingested, see ingest_dir.
+
+    New frames of OBs already in the database are appended to them,
+    see IngestPipeline.
+    """
+    if pipeline is None:
+        if drps is None:
+            drps = numina.drps.get_system_drps()
+        pipeline = IngestPipeline(session, drps, path, batch_size=batch_size)
+    pipeline.update_obs = True
+    # the batches are formed here, all the writes go through the flush below
+    pipeline.batch_size = float('inf')
+    if watcher is None:
+        watcher = create_watcher(path)
+
+    # paths, with the number of failed attempts
+    pending = {}
+    first = last = None
+    with watcher:
+        while stop is None or not stop.is_set():
+            paths = watcher.poll(timeout=min(debounce, 1.0))
+            now = time.monotonic()
+            for fullname in paths:
+                pending.setdefault(fullname, 0)
+                last = now
+                if first is None:
+                    first = now
+            if not pending:
+                continue
+            if now - last < debounce and now - first < max_delay and len(pending) < batch_size:
+                continue
+
+            _logger.info('ingesting %d files', len(pending))
+            for fullname in pending:
+                try:
+                    ingest_file(pipeline, fullname)
+                except Exception:
+                    _logger.warning('unable to ingest %s', fullname, exc_info=True)
+            try:
+                pipeline.flush()
+            except Exception:
+                _logger.exception('unable to store %d files', len(pending))
+                session.rollback()
+                pipeline.discard()
+                failed = {fullname: attempts + 1 for fullname, attempts in pending.items()}
+                pending = {fullname: attempts for fullname, attempts in failed.items() if attempts <= MAX_RETRIES}
+                for fullname in failed.keys() - pending.keys():
+                    _logger.error('file not stored after %d attempts: %s', MAX_RETRIES + 1, fullname)
+                if pending:
+                    _logger.warning('files to store again: %s', ', '.join(pending))
+                    # with the next batch
+                    first = last = time.monotonic()
+                    continue
+            pending.clear()
+            first = last = None
+    return pipeline